@@ -0,0 +1,128 @@
+"""
+Benchmark of the approximate ivf embedding index against the exact index: the recall of the top k keys
+and the search latency, on synthetic clustered embeddings or on the embeddings of an embedding store.
+
+Usage:
+    # 10k and 50k synthetic embeddings of 768 dimensions
+    python scripts/embedding_index_benchmark.py --sizes 10000 50000
+    # the embeddings of the experiences of a project, with the queries sampled from them
+    python scripts/embedding_index_benchmark.py --store project/experience/embeddings/Planner
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from taskweaver.memory.embedding_index import EmbeddingIndex, IVFEmbeddingIndex
+from taskweaver.memory.embedding_store import EmbeddingStore
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="The numbers of embeddings")
+parser.add_argument("--dim", type=int, default=768, help="The dimension of the synthetic embeddings")
+parser.add_argument("--store", type=str, help="Benchmark the embeddings of the embedding store in the directory")
+parser.add_argument("--queries", type=int, default=200, help="The number of queries")
+parser.add_argument("--top_k", type=int, default=10)
+parser.add_argument("--nlist", type=int, default=0, help="The number of clusters, 0 for the square root of the size")
+parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32], help="The numbers of clusters searched")
+
+args = parser.parse_args()
+
+
+def synthetic_embeddings(size: int, dim: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    # the embeddings of texts are clustered by topic, which is imitated by noisy copies of topic centers
+    centers = rng.normal(size=(max(size // 100, 1), dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, len(centers), size)] + rng.normal(scale=2.0, size=(size, dim))
+    queries = centers[rng.integers(0, len(centers), args.queries)] + rng.normal(scale=2.0, size=(args.queries, dim))
+    return embeddings.astype(np.float32), queries.astype(np.float32)
+
+
+def store_embeddings(store_dir: str, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    store = EmbeddingStore(store_dir)
+    embeddings = store.get_embeddings(store.keys()).astype(np.float32)
+    # the queries are the embeddings slightly moved, so that they are not the indexed embeddings themselves
+    queries = embeddings[rng.integers(0, len(embeddings), args.queries)]
+    queries = queries + rng.normal(scale=0.1 * float(np.std(embeddings)), size=queries.shape)
+    return embeddings, queries.astype(np.float32)
+
+
+def time_searches(index: EmbeddingIndex[int], queries: np.ndarray) -> Tuple[List[List[int]], List[float]]:
+    results: List[List[int]] = []
+    latencies: List[float] = []
+    for query in queries:
+        start = time.perf_counter()
+        result = index.search(query, top_k=args.top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([key for key, _ in result])
+    return results, latencies
+
+
+def percentile(values: List[float], p: float) -> float:
+    return float(np.percentile(values, p))
+
+
+def benchmark(embeddings: np.ndarray, queries: np.ndarray) -> List[Dict[str, float]]:
+    keys = list(range(len(embeddings)))
+    exact: EmbeddingIndex[int] = EmbeddingIndex()
+    exact.add_many(keys, embeddings)
+    exact_results, exact_latencies = time_searches(exact, queries)
+    rows: List[Dict[str, float]] = [
+        {
+            "nprobe": 0,
+            "recall": 1.0,
+            "p50_ms": percentile(exact_latencies, 50),
+            "p99_ms": percentile(exact_latencies, 99),
+            "build_s": 0.0,
+        },
+    ]
+
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        ivf: IVFEmbeddingIndex[int] = IVFEmbeddingIndex(nlist=args.nlist, nprobe=nprobe, min_train_size=1)
+        ivf.add_many(keys, embeddings)
+        build_time = time.perf_counter() - start
+        ivf_results, ivf_latencies = time_searches(ivf, queries)
+        recall = statistics.mean(
+            len(set(exact_result) & set(ivf_result)) / max(len(exact_result), 1)
+            for exact_result, ivf_result in zip(exact_results, ivf_results)
+        )
+        rows.append(
+            {
+                "nprobe": nprobe,
+                "recall": recall,
+                "p50_ms": percentile(ivf_latencies, 50),
+                "p99_ms": percentile(ivf_latencies, 99),
+                "build_s": build_time,
+            },
+        )
+    return rows
+
+
+def report(name: str, size: int, rows: List[Dict[str, float]]):
+    print(f"\n{name}: {size} embeddings, top {args.top_k}")
+    print(f"{'index':<16}{'recall':>8}{'p50 ms':>10}{'p99 ms':>10}{'build s':>10}")
+    for row in rows:
+        index_name = "exact" if row["nprobe"] == 0 else f"ivf nprobe={int(row['nprobe'])}"
+        print(
+            f"{index_name:<16}{row['recall']:>8.3f}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}{row['build_s']:>10.2f}",
+        )
+
+
+def main():
+    rng = np.random.default_rng(0)
+    if args.store is not None:
+        embeddings, queries = store_embeddings(args.store, rng)
+        report(args.store, len(embeddings), benchmark(embeddings, queries))
+        return
+    for size in args.sizes:
+        embeddings, queries = synthetic_embeddings(size, args.dim, rng)
+        report("synthetic", size, benchmark(embeddings, queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,7 @@ from taskweaver.logging import LoggingModule
 from taskweaver.memory.experience import ExperienceGenerator
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--target_role", type=str, choices=["Planner", "CodeInterpreter"], required=True)
+parser.add_argument("--target_role", type=str, choices=["Planner", "CodeInterpreter", "All"], required=True)
 parser.add_argument(
     "--project_dir",
     type=str,
@@ -36,6 +36,11 @@ parser.add_argument(
     help="Delete handcraft experience with experience id",
 )
 parser.add_argument("--show", action="store_true")
+parser.add_argument(
+    "--migrate",
+    action="store_true",
+    help="Copy the experiences in the yaml files to the binary store (requires experience.storage=npy)",
+)
 
 args = parser.parse_args()
 
@@ -54,7 +59,10 @@ class ExperienceManager:
         self.experience_generator = app_injector.create_object(ExperienceGenerator)
 
     def refresh(self):
-        self.experience_generator.refresh(args.target_role)
+        self.experience_generator.refresh(
+            args.target_role,
+            progress=lambda done, total: print(f"Refreshed {done}/{total} experiences"),
+        )
         print("Refreshed experience list")
 
     def delete_experience(self, exp_id: str):
@@ -69,6 +77,10 @@ class ExperienceManager:
         self.experience_generator.delete_handcrafted_experience(exp_id=exp_id)
         print(f"Deleted handcraft experience with id: {exp_id}")
 
+    def migrate(self):
+        self.experience_generator.migrate_experience(args.target_role)
+        print("Migrated experience to the binary store")
+
     def show(self):
         self.experience_generator.load_experience(args.target_role)
         if len(self.experience_generator.experience_list) == 0:
@@ -85,6 +97,8 @@ class ExperienceManager:
 
 if __name__ == "__main__":
     experience_manager = ExperienceManager()
+    if args.migrate:
+        experience_manager.migrate()
     if args.refresh:
         experience_manager.refresh()
     if args.delete:
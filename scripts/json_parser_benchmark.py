@@ -0,0 +1,126 @@
+"""
+Benchmark of the JSON stream parser used to parse the LLM outputs of the roles: the parsing time of each output
+streamed in chunks of 2 to 8 characters, as played back by MockApiService, and in one chunk, compared with the
+parser of a baseline git revision. The events of both parsers are checked to be the same.
+
+The outputs are the completions recorded in the cache files of MockApiService, or synthetic outputs of the
+code interpreter with code of 5 to 10 KB.
+
+Usage:
+    # compare with the parser of the revision before the last change of the parser
+    python scripts/json_parser_benchmark.py
+    # compare with the parser of a revision on the completions recorded in a cache
+    python scripts/json_parser_benchmark.py --baseline main --cache project/cache/mock.yaml
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import types
+from typing import Any, Callable, Iterable, List
+
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from taskweaver.utils import json_parser
+
+PARSER_PATH = "taskweaver/utils/json_parser.py"
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--baseline", type=str, help="The git revision of the baseline parser")
+parser.add_argument("--cache", type=str, nargs="+", default=[], help="The cache files of MockApiService")
+parser.add_argument("--outputs", type=int, default=20, help="The number of synthetic outputs")
+parser.add_argument("--repeat", type=int, default=5, help="The number of times each output is parsed")
+
+args = parser.parse_args()
+
+
+def git(*git_args: str) -> str:
+    return subprocess.check_output(["git", *git_args], cwd=REPO_DIR, text=True).strip()
+
+
+def load_baseline_parser(revision: str) -> types.ModuleType:
+    module = types.ModuleType("baseline_json_parser")
+    exec(compile(git("show", f"{revision}:{PARSER_PATH}"), f"{revision}:{PARSER_PATH}", "exec"), module.__dict__)
+    return module
+
+
+def cached_outputs(cache_paths: List[str]) -> List[str]:
+    outputs: List[str] = []
+    for path in cache_paths:
+        with open(path, "r") as f:
+            cache = yaml.safe_load(f)
+        for entry in cache["completion_store"].values():
+            role, content = entry["value"].split(":", 1)
+            if role == "assistant":
+                outputs.append(content)
+    return outputs
+
+
+def synthetic_outputs(count: int, rng: random.Random) -> List[str]:
+    outputs: List[str] = []
+    for i in range(count):
+        lines = ["import pandas as pd", f"df = pd.read_csv('./data_{i}.csv')"]
+        while sum(len(line) + 1 for line in lines) < rng.randint(5000, 10000):
+            n = len(lines)
+            lines.append(f"df['col_{n}'] = df['a'] * {n} + df[\"b\"].apply(lambda x: x / {n})\t# step {n}")
+        response = [
+            {"type": "thought", "content": f"I will load ./data_{i}.csv and compute the columns."},
+            {"type": "python", "content": "\n".join(lines)},
+            {"type": "text", "content": "The columns are computed."},
+        ]
+        outputs.append(json.dumps({"response": response}, indent=2))
+    return outputs
+
+
+def playback_chunks(output: str, rng: random.Random) -> List[str]:
+    chunks: List[str] = []
+    pos = 0
+    while pos < len(output):
+        size = rng.randint(2, 8)
+        chunks.append(output[pos : pos + size])
+        pos += size
+    return chunks
+
+
+def parse(parse_json_stream: Callable[..., Iterable[Any]], chunks: List[str]) -> List[Any]:
+    return [tuple(ev) for ev in parse_json_stream(iter(chunks), skip_after_root=True)]
+
+
+def time_parse(parse_json_stream: Callable[..., Iterable[Any]], chunks: List[str]) -> float:
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        parse(parse_json_stream, chunks)
+    return (time.perf_counter() - start) / args.repeat * 1000
+
+
+def main():
+    revision = args.baseline
+    if revision is None:
+        revision = git("log", "-n", "1", "--format=%H", "--", PARSER_PATH) + "~1"
+    baseline = load_baseline_parser(revision)
+    rng = random.Random(0)
+    outputs = cached_outputs(args.cache) if len(args.cache) > 0 else synthetic_outputs(args.outputs, rng)
+
+    print(f"{len(outputs)} outputs, {statistics.mean(len(o) for o in outputs) / 1024:.1f} KB on average")
+    print(f"baseline: {revision}")
+    print(f"{'chunks':<12}{'baseline ms':>14}{'current ms':>14}{'speedup':>10}{'MB/s':>10}")
+    for name, split in [("playback", lambda o: playback_chunks(o, rng)), ("whole", lambda o: [o])]:
+        baseline_ms, current_ms = 0.0, 0.0
+        for output in outputs:
+            chunks = split(output)
+            assert parse(baseline.parse_json_stream, chunks) == parse(json_parser.parse_json_stream, chunks)
+            baseline_ms += time_parse(baseline.parse_json_stream, chunks)
+            current_ms += time_parse(json_parser.parse_json_stream, chunks)
+        throughput = sum(len(o) for o in outputs) / 1024 / 1024 / (current_ms / 1000)
+        print(f"{name:<12}{baseline_ms:>14.1f}{current_ms:>14.1f}{baseline_ms / current_ms:>9.1f}x{throughput:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
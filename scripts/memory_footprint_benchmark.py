@@ -0,0 +1,115 @@
+"""
+Benchmark of the memory footprint of a session: the rounds, posts and attachments of a conversation built live,
+the same conversation loaded from its JSON form, and the role views read from the memory by the roles.
+
+The footprint is measured with tracemalloc and reported per post, in total and without the message and attachment
+contents, which is the overhead of the in-memory representation.
+
+Usage:
+    python scripts/memory_footprint_benchmark.py --rounds 100 1000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from taskweaver.memory import Attachment, Conversation, Memory, Post, Round
+from taskweaver.memory.attachment import AttachmentType
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rounds", type=int, nargs="+", default=[100, 1000], help="The numbers of rounds in a session")
+parser.add_argument("--code_interpreter_turns", type=int, default=3, help="The code interpreter turns per round")
+
+args = parser.parse_args()
+
+
+def build_session(rounds: int) -> Memory:
+    memory = Memory("benchmark")
+    for i in range(rounds):
+        chat_round = memory.create_round(f"request {i}: show the top 10 rows of ./data_{i}.csv")
+        chat_round.add_post(Post.create(chat_round.user_query, "User", "Planner"))
+        for turn in range(args.code_interpreter_turns):
+            planner_post = Post.create(f"Please load ./data_{i}.csv and show the rows, step {turn}", "Planner")
+            planner_post.send_to = "CodeInterpreter"
+            planner_post.add_attachment(Attachment.create(AttachmentType.init_plan, f"1. load data_{i}\n2. show"))
+            planner_post.add_attachment(Attachment.create(AttachmentType.plan, f"1. load data_{i} and show"))
+            planner_post.add_attachment(Attachment.create(AttachmentType.current_plan_step, "1. load and show"))
+            chat_round.add_post(planner_post)
+
+            code_post = Post.create(f"The rows of data_{i} are shown.", "CodeInterpreter", "Planner")
+            code_post.add_attachment(Attachment.create(AttachmentType.thought, "I will load the file with pandas."))
+            code_post.add_attachment(
+                Attachment.create(AttachmentType.python, f"import pandas as pd\ndf = pd.read_csv('./data_{i}.csv')"),
+            )
+            code_post.add_attachment(Attachment.create(AttachmentType.execution_status, "SUCCESS"))
+            code_post.add_attachment(Attachment.create(AttachmentType.execution_result, "   a  b\n0  1  2\n1  3  4"))
+            chat_round.add_post(code_post)
+        chat_round.add_post(Post.create(f"The top 10 rows of data_{i} are shown.", "Planner", "User"))
+        chat_round.change_round_state("finished")
+    return memory
+
+
+def content_size(conversation: Conversation) -> int:
+    size = 0
+    for chat_round in conversation.rounds:
+        size += sys.getsizeof(chat_round.user_query)
+        for post in chat_round.post_list:
+            size += sys.getsizeof(post.message)
+            size += sum(sys.getsizeof(attachment.content) for attachment in post.attachment_list)
+    return size
+
+
+def measure(build: Callable[[], Any]) -> Tuple[Any, int]:
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return result, size
+
+
+def report(name: str, posts: int, size: int, contents: int):
+    print(
+        f"{name:<24}{size / 1024:>12.1f}{size / posts:>12.0f}{(size - contents) / posts:>16.0f}",
+    )
+
+
+def main():
+    for rounds in args.rounds:
+        memory, live_size = measure(lambda: build_session(rounds))
+        conversation = memory.conversation
+        posts = sum(len(chat_round.post_list) for chat_round in conversation.rounds)
+        attachments = sum(len(post.attachment_list) for r in conversation.rounds for post in r.post_list)
+        contents = content_size(conversation)
+        serialized = json.dumps(conversation.to_dict())
+
+        def load() -> Conversation:
+            content: Dict[str, Any] = json.loads(serialized)
+            loaded = Conversation.init()
+            for round_content in content["rounds"]:
+                loaded.add_round(Round.from_dict(round_content))
+            return loaded
+
+        loaded, loaded_size = measure(load)
+
+        def read_views() -> List[Any]:
+            return [memory.get_role_rounds(role) for role in ["Planner", "CodeInterpreter"]]
+
+        _, views_size = measure(read_views)
+
+        print(f"\n{rounds} rounds, {posts} posts, {attachments} attachments, {len(serialized) / 1024:.1f} KB as JSON")
+        print(f"{'':<24}{'total KB':>12}{'B/post':>12}{'overhead B/post':>16}")
+        report("live session", posts, live_size, contents)
+        report("loaded session", posts, loaded_size, content_size(loaded))
+        report("role views", posts, views_size, 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Benchmark of the orchestration overhead of TaskWeaver, i.e., the time spent in TaskWeaver itself for a round:
+prompt composition, JSON stream parsing, event emission, memory copying and logging.
+
+The LLM calls are played back by MockApiService in playback_only mode with zero playback_delay, from a cache
+recorded with a scripted LLM before the measurement, and the code is "executed" by a stub execution manager,
+so that nearly all the measured time is orchestration overhead.
+
+Usage:
+    # measure 1, 10 and 100 rounds and save the results as the baseline
+    python scripts/orchestration_benchmark.py --save_baseline scripts/orchestration_benchmark_baseline.json
+    # measure again and fail if the throughput dropped by more than the tolerance
+    python scripts/orchestration_benchmark.py --baseline scripts/orchestration_benchmark_baseline.json
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Generator, List, Literal, Optional, Tuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from taskweaver.app.app import TaskWeaverApp
+from taskweaver.ces.common import Client, ExecutionResult, Manager
+from taskweaver.code_interpreter.code_executor import CodeExecutor
+from taskweaver.code_interpreter.code_generator import CodeGenerator
+from taskweaver.llm import LLMApi
+from taskweaver.llm.base import CompletionService
+from taskweaver.llm.cancellation import cancellable_stream
+from taskweaver.llm.mock import MockApiService, MockCacheStore
+from taskweaver.llm.openai import OpenAIService
+from taskweaver.llm.util import ChatMessageType, format_chat_message
+from taskweaver.logging import TelemetryLogger
+from taskweaver.memory import Memory
+from taskweaver.module.event_emitter import SessionEventEmitter
+from taskweaver.planner.planner import Planner
+from taskweaver.role.translator import PostTranslator
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rounds", type=int, nargs="+", default=[1, 10, 100], help="The numbers of rounds to run")
+parser.add_argument("--repeat", type=int, default=3, help="The number of timed runs for each number of rounds")
+parser.add_argument("--baseline", type=str, help="Compare the results with the baseline JSON file")
+parser.add_argument("--save_baseline", type=str, help="Save the results as the baseline JSON file")
+parser.add_argument(
+    "--smoother",
+    action="store_true",
+    help="Keep the stream smoother, which paces the LLM output for display at up to 600 chars/sec",
+)
+parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=0.2,
+    help="The tolerated throughput drop compared with the baseline, as a ratio",
+)
+
+
+class StubClient(Client):
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def load_plugin(self, plugin_name: str, plugin_code: str, plugin_config: Dict[str, str]) -> None:
+        pass
+
+    def test_plugin(self, plugin_name: str) -> None:
+        pass
+
+    def update_session_var(self, session_var_dict: Dict[str, str]) -> None:
+        pass
+
+    def execute_code(self, exec_id: str, code: str) -> ExecutionResult:
+        return ExecutionResult(execution_id=exec_id, code=code, is_success=True, output="2")
+
+
+class StubManager(Manager):
+    def initialize(self) -> None:
+        pass
+
+    def clean_up(self) -> None:
+        pass
+
+    def get_session_client(
+        self,
+        session_id: str,
+        env_id: Optional[str] = None,
+        session_dir: Optional[str] = None,
+        cwd: Optional[str] = None,
+    ) -> Client:
+        return StubClient()
+
+    def get_kernel_mode(self) -> Literal["local", "container"] | None:
+        return "local"
+
+
+class ScriptedCompletionService(CompletionService):
+    """The LLM used to record the cache: the Planner delegates each query to the CodeInterpreter once."""
+
+    def chat_completion(
+        self,
+        messages: List[ChatMessageType],
+        stream: bool = True,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        top_p: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Generator[ChatMessageType, None, None]:
+        last_message = messages[-1]["content"]
+        if messages[0]["content"].startswith("You are the Planner"):
+            to_code_interpreter = not last_message.startswith("CodeInterpreter:")
+            response = [
+                {
+                    "type": "init_plan",
+                    "content": "1. compute the result\n2. report the result <sequentially depends on 1>",
+                },
+                {"type": "plan", "content": "1. compute the result and report it"},
+                {"type": "current_plan_step", "content": "1. compute the result and report it"},
+                {"type": "send_to", "content": "CodeInterpreter" if to_code_interpreter else "User"},
+                {
+                    "type": "message",
+                    "content": "Please compute the result" if to_code_interpreter else "The result is 2",
+                },
+            ]
+        else:
+            response = [
+                {"type": "thought", "content": "I will compute the result with Python."},
+                {"type": "python", "content": "result = 1 + 1\nresult"},
+            ]
+        yield format_chat_message("assistant", json.dumps({"response": response}, indent=2))
+
+
+class PhaseTimer:
+    """Time the calls of the methods of each phase. The phase timings are inclusive, so nested phases overlap."""
+
+    phases: Dict[str, List[Tuple[type, str]]] = {
+        "planner.compose_prompt": [(Planner, "compose_prompt")],
+        "code_generator.compose_prompt": [(CodeGenerator, "compose_prompt")],
+        "translator.parse_stream": [(PostTranslator, "raw_text_to_post")],
+        "event_emission": [(SessionEventEmitter, "emit")],
+        "memory.get_role_rounds": [(Memory, "get_role_rounds")],
+        "logging": [
+            (TelemetryLogger, "info"),
+            (TelemetryLogger, "debug"),
+            (TelemetryLogger, "warning"),
+            (TelemetryLogger, "error"),
+            (TelemetryLogger, "dump_log_file"),
+        ],
+        "code_execution": [(CodeExecutor, "execute_code")],
+    }
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {phase: 0.0 for phase in self.phases}
+        self.calls: Dict[str, int] = {phase: 0 for phase in self.phases}
+        self._originals: List[Tuple[type, str, Callable[..., Any]]] = []
+
+    def __enter__(self) -> "PhaseTimer":
+        for phase, methods in self.phases.items():
+            for cls, name in methods:
+                original = getattr(cls, name)
+                self._originals.append((cls, name, original))
+                setattr(cls, name, self._timed(phase, original))
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        for cls, name, original in reversed(self._originals):
+            setattr(cls, name, original)
+        self._originals = []
+
+    def _timed(self, phase: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[phase] += time.perf_counter() - start
+                self.calls[phase] += 1
+
+        return wrapper
+
+
+def create_app(app_dir: str, mode: str) -> TaskWeaverApp:
+    app = TaskWeaverApp(
+        app_dir=app_dir,
+        config={
+            "llm.api_key": "benchmark",
+            "llm.use_mock": True,
+            "llm.mock.mode": mode,
+            "llm.mock.playback_delay": 0,
+            "llm.mock.cache_path": os.path.join(app_dir, "cache", "mock.yaml"),
+            "llm.embedding_api_type": "sentence_transformers",
+            "execution_service.kernel_mode": "local",
+        },
+    )
+    app.app_injector.binder.bind(Manager, to=StubManager())
+    return app
+
+
+def run_rounds(app: TaskWeaverApp, rounds: int) -> float:
+    session = app.get_session()
+    start = time.perf_counter()
+    for i in range(rounds):
+        chat_round = session.send_message(f"What is 1 + 1? (query {i})")
+        assert chat_round.state == "finished", f"round {i} failed: {chat_round.post_list[-1].message}"
+    elapsed = time.perf_counter() - start
+    session.stop()
+    return elapsed
+
+
+def record_cache(app_dir: str, rounds: int) -> None:
+    """Record the LLM responses of the rounds with the scripted LLM, and save them once at the end."""
+    app = create_app(app_dir, "playback_or_record")
+    # the LLMs created by the session use the scripted LLM as the base service of the mock layer
+    app.app_injector.binder.bind(OpenAIService, to=ScriptedCompletionService())
+    session = app.get_session()
+    mock = app.app_injector.get(MockApiService)
+    save_to_disk = mock.cache._save_to_disk
+    mock.cache._save_to_disk = lambda: None  # type: ignore
+    try:
+        for i in range(rounds):
+            chat_round = session.send_message(f"What is 1 + 1? (query {i})")
+            assert chat_round.state == "finished", f"round {i} failed: {chat_round.post_list[-1].message}"
+    finally:
+        session.stop()
+    save_to_disk()
+    assert len(MockCacheStore(mock.config.cache_path).completion_store) > 0
+
+
+def benchmark(rounds: int, repeat: int) -> Dict[str, Any]:
+    app_dir = tempfile.mkdtemp(prefix="taskweaver_benchmark_")
+    try:
+        record_cache(app_dir, rounds)
+
+        timings: List[float] = []
+        timers: List[PhaseTimer] = []
+        for _ in range(repeat):
+            app = create_app(app_dir, "playback_only")
+            with PhaseTimer() as timer:
+                timings.append(run_rounds(app, rounds))
+            timers.append(timer)
+
+        # allocations are measured in a separate run as tracing them slows down the execution
+        app = create_app(app_dir, "playback_only")
+        tracemalloc.start()
+        run_rounds(app, rounds)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(app_dir, ignore_errors=True)
+
+    median = statistics.median(timings)
+    timer = timers[timings.index(median)] if median in timings else timers[0]
+    return {
+        "rounds": rounds,
+        "seconds": round(median, 4),
+        "seconds_per_round": round(median / rounds, 4),
+        "rounds_per_sec": round(rounds / median, 2),
+        "phases": {
+            phase: {
+                "calls": timer.calls[phase],
+                "seconds": round(timer.seconds[phase], 4),
+                "ms_per_round": round(timer.seconds[phase] * 1000 / rounds, 3),
+            }
+            for phase in PhaseTimer.phases
+        },
+        "allocations": {
+            "peak_kb": round(peak / 1024, 1),
+            "retained_kb": round(retained / 1024, 1),
+        },
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions: List[str] = []
+    for key, result in results["benchmarks"].items():
+        if key not in baseline["benchmarks"]:
+            continue
+        expected = baseline["benchmarks"][key]["rounds_per_sec"]
+        actual = result["rounds_per_sec"]
+        change = (actual - expected) / expected
+        print(f"{key} rounds: {actual} rounds/sec, baseline {expected} rounds/sec ({change:+.1%})")
+        if actual < expected * (1 - tolerance):
+            regressions.append(f"{key} rounds: throughput dropped by {-change:.1%}")
+    return regressions
+
+
+def main():
+    args = parser.parse_args()
+    if not args.smoother:
+        # the smoother deliberately slows down fast streams, which would dominate the measured time
+        LLMApi._stream_smoother = lambda self, stream_init, stats=None, count_tokens=None: (  # type: ignore
+            cancellable_stream(stream_init, stats=stats, count_tokens=count_tokens)
+        )
+
+    results: Dict[str, Any] = {
+        "python": platform.python_version(),
+        "smoother": args.smoother,
+        "platform": platform.platform(),
+        "benchmarks": {},
+    }
+    for rounds in args.rounds:
+        result = benchmark(rounds, args.repeat)
+        results["benchmarks"][str(rounds)] = result
+        print(
+            f"{rounds} rounds: {result['rounds_per_sec']} rounds/sec, {result['seconds_per_round'] * 1000:.1f} ms/round"
+        )
+        for phase, timing in result["phases"].items():
+            print(f"  {phase:<32} {timing['ms_per_round']:>10.3f} ms/round {timing['calls']:>8} calls")
+        print(
+            f"  {'allocations':<32} {result['allocations']['peak_kb']:>10.1f} KB peak "
+            f"{result['allocations']['retained_kb']:>8.1f} KB retained",
+        )
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved the baseline to {args.save_baseline}")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print("Regressions found:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
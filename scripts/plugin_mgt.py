@@ -24,6 +24,11 @@ parser.add_argument(
 )
 parser.add_argument("--refresh", action="store_true", help="Refresh plugin embeddings.")
 parser.add_argument("--show", action="store_true", help="Show plugin information.")
+parser.add_argument(
+    "--migrate",
+    action="store_true",
+    help="Copy the plugin embeddings in the meta files to the binary store (requires plugin.embedding_storage=npy).",
+)
 
 args = parser.parse_args()
 
@@ -45,6 +50,10 @@ class PluginManager:
         self.plugin_selector.refresh()
         print("Plugin embeddings refreshed.")
 
+    def migrate(self):
+        self.plugin_selector.migrate_embeddings()
+        print("Plugin embeddings migrated.")
+
     def show(self):
         plugin_list = self.plugin_selector.available_plugins
         if len(plugin_list) == 0:
@@ -62,6 +71,8 @@ class PluginManager:
 
 if __name__ == "__main__":
     plugin_manager = PluginManager()
+    if args.migrate:
+        plugin_manager.migrate()
     if args.refresh:
         plugin_manager.refresh()
     if args.show:
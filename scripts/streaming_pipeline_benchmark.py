@@ -0,0 +1,107 @@
+"""
+Benchmark of the CPU time spent on streaming an LLM output from the chunks of the LLM API to the post events:
+the cancellable and metered streams, the translator parsing the output into the post and the event proxy
+updating the attachments and emitting the events to a handler collecting them, as a UI would.
+
+The CPU time is measured with time.process_time and reported per KB of output, for outputs of the code
+interpreter with code of increasing size streamed in chunks of about 4 characters, the size of a token.
+The pacing of the stream smoother is not included, as it sleeps rather than consumes CPU.
+
+Usage:
+    python scripts/streaming_pipeline_benchmark.py --sizes 1 10 100
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Any, Generator, List
+
+from injector import Injector
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from taskweaver.llm.cancellation import cancellable_stream
+from taskweaver.llm.usage import TokenUsage, metered_stream
+from taskweaver.llm.util import ChatMessageType, format_chat_message
+from taskweaver.logging import LoggingModule
+from taskweaver.memory import Post
+from taskweaver.module.event_emitter import PostEventProxy, PostEventType, SessionEventEmitter, SessionEventHandlerBase
+from taskweaver.role import PostTranslator
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100], help="The sizes of the code in KB")
+parser.add_argument("--repeat", type=int, default=5, help="The number of times each output is streamed")
+
+args = parser.parse_args()
+
+
+class CollectingHandler(SessionEventHandlerBase):
+    def __init__(self) -> None:
+        self.updates: List[str] = []
+
+    def handle_post(self, type: PostEventType, msg: str, extra: Any, post_id: str, round_id: str, **kwargs: Any):
+        if type == PostEventType.post_attachment_update:
+            self.updates.append(msg)
+
+
+def llm_output(size_kb: int) -> str:
+    lines = ["import pandas as pd"]
+    code_size = len(lines[0])
+    while code_size < size_kb * 1024:
+        n = len(lines)
+        lines.append(f"df['col_{n}'] = df['a'] * {n} + df['b'].apply(lambda x: x / {n})")
+        code_size += len(lines[-1]) + 1
+    response = [
+        {"type": "thought", "content": "I will compute the columns."},
+        {"type": "python", "content": "\n".join(lines)},
+        {"type": "send_to", "content": "Planner"},
+        {"type": "message", "content": "The columns are computed."},
+    ]
+    return json.dumps({"response": response})
+
+
+def chunk_stream(output: str) -> Generator[ChatMessageType, None, None]:
+    rng = random.Random(0)
+    pos = 0
+    while pos < len(output):
+        size = rng.randint(2, 6)
+        yield format_chat_message("assistant", output[pos : pos + size])
+        pos += size
+
+
+def stream_once(translator: PostTranslator, emitter: SessionEventEmitter, output: str) -> float:
+    stream = metered_stream(
+        lambda: cancellable_stream(lambda: chunk_stream(output)),
+        on_usage=lambda usage: None,
+        estimate=lambda content: TokenUsage(completion_tokens=len(content) // 4),
+    )
+    post_proxy = PostEventProxy(emitter, "round-benchmark", Post.create(message="", send_from="CodeInterpreter"))
+    start = time.process_time()
+    translator.raw_text_to_post(llm_output=stream, post_proxy=post_proxy)
+    post_proxy.end()
+    cpu_time = time.process_time() - start
+    assert post_proxy.post.attachment_list[1].content == json.loads(output)["response"][1]["content"]
+    return cpu_time
+
+
+def main():
+    injector = Injector([LoggingModule])
+    emitter = SessionEventEmitter()
+    emitter.handlers.append(CollectingHandler())
+    injector.binder.bind(SessionEventEmitter, emitter)
+    translator = injector.create_object(PostTranslator)
+
+    print(f"{'code KB':>8}{'output KB':>12}{'CPU ms':>10}{'CPU ms/KB':>12}")
+    for size_kb in args.sizes:
+        output = llm_output(size_kb)
+        cpu_times = [stream_once(translator, emitter, output) for _ in range(args.repeat)]
+        cpu_ms = statistics.median(cpu_times) * 1000
+        output_kb = len(output) / 1024
+        print(f"{size_kb:>8}{output_kb:>12.1f}{cpu_ms:>10.1f}{cpu_ms / output_kb:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
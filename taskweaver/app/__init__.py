@@ -1,8 +1,17 @@
 from .app import TaskWeaverApp
-from .session_store import InMemorySessionStore, SessionStore
+from .session_store import (
+    DurableSessionStore,
+    FileSystemSessionStore,
+    InMemorySessionStore,
+    SessionStore,
+    SQLiteSessionStore,
+)
 
 __all__ = [
     "TaskWeaverApp",
     "SessionStore",
     "InMemorySessionStore",
+    "DurableSessionStore",
+    "FileSystemSessionStore",
+    "SQLiteSessionStore",
 ]
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import os
 from typing import Literal, Optional, overload
 
 from injector import Binder, Injector, Module, inject, provider
@@ -8,7 +9,7 @@ from taskweaver.config.module_config import ModuleConfig
 
 from ..session import Session
 from ..utils import create_id
-from .session_store import InMemorySessionStore, SessionStore
+from .session_store import FileSystemSessionStore, InMemorySessionStore, SessionStore, SQLiteSessionStore
 
 
 class SessionManager:
@@ -52,10 +53,10 @@ class SessionManager:
         session = self._get_session_from_store(session_id, False)
         if session is not None:
             session.stop()
-            self.session_store.remove_session(session_id)
+            self.session_store.release_session(session_id)
 
     def stop_all_sessions(self) -> None:
-        for session_id in self.session_store.get_all_session_ids():
+        for session_id in list(self.session_store.get_active_session_ids()):
             self.stop_session(session_id)
 
     @overload
@@ -97,9 +98,14 @@ class SessionManagerConfig(ModuleConfig):
         self._set_name("session_manager")
         self.session_store_type = self._get_enum(
             "store_type",
-            ["in_memory"],
+            ["in_memory", "file_system", "sqlite"],
             "in_memory",
         )
+        # the directory of the file system store, or of the database file of the sqlite store
+        self.session_store_path = self._get_path(
+            "store_path",
+            os.path.join(self.src.app_base_path, "workspace", "session_store"),
+        )
 
 
 class SessionManagerModule(Module):
@@ -107,7 +113,11 @@ class SessionManagerModule(Module):
         binder.bind(SessionManager, to=SessionManager)
 
     @provider
-    def provide_session_store(self, config: SessionManagerConfig) -> SessionStore:
+    def provide_session_store(self, config: SessionManagerConfig, injector: Injector) -> SessionStore:
         if config.session_store_type == "in_memory":
             return InMemorySessionStore()
+        if config.session_store_type == "file_system":
+            return FileSystemSessionStore(injector, config.session_store_path)
+        if config.session_store_type == "sqlite":
+            return SQLiteSessionStore(injector, os.path.join(config.session_store_path, "sessions.db"))
         raise Exception(f"unknown session store type {config.session_store_type}")
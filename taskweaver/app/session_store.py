@@ -1,7 +1,19 @@
 import abc
-from typing import Dict, Iterable, Optional
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple
 
+from injector import Injector
+
+from ..memory import Round
+from ..module.event_emitter import RoundEventType, SessionEventHandlerBase
 from ..session.session import Session
+from ..utils import json_dumps
 
 
 class SessionStore(abc.ABC):
@@ -25,6 +37,14 @@ class SessionStore(abc.ABC):
     def get_all_session_ids(self) -> Iterable[str]:
         pass
 
+    def get_active_session_ids(self) -> Iterable[str]:
+        """Get the ids of the sessions held in memory."""
+        return self.get_all_session_ids()
+
+    def release_session(self, session_id: str) -> None:
+        """Release a stopped session from memory. A durable store keeps it to be resumed later."""
+        self.remove_session(session_id)
+
 
 class InMemorySessionStore(SessionStore):
     def __init__(self) -> None:
@@ -44,3 +64,274 @@ class InMemorySessionStore(SessionStore):
 
     def get_all_session_ids(self) -> Iterable[str]:
         return self.sessions.keys()
+
+
+class _SessionRecorder(SessionEventHandlerBase):
+    def __init__(self, store: "DurableSessionStore", session: Session) -> None:
+        self.store = store
+        self.session = session
+
+    def handle_round(self, type: RoundEventType, msg: str, extra: Any, round_id: str, **kwargs: Any):
+        if type == RoundEventType.round_end:
+            self.store.save_round(self.session, round_id)
+
+
+class DurableSessionStore(SessionStore):
+    """
+    A session store persisting the sessions, which are shared by the app workers using the same store.
+    The metadata and the new round of a session are saved when each round ends. A session is hydrated when it is
+    requested: its memory is rebuilt from the saved rounds, while its kernel is started by the next execution.
+    Only the sessions in use are held in memory.
+    """
+
+    def __init__(self, injector: Injector) -> None:
+        self.injector = injector
+        self.sessions: Dict[str, Session] = {}
+        self.lock = threading.RLock()
+        # the lock hydrating each session, and the number of the threads using it
+        self._hydrations: Dict[str, List[Any]] = {}
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                return session
+            hydration = self._hydrations.setdefault(session_id, [threading.Lock(), 0])
+            hydration[1] += 1
+        try:
+            # a session is hydrated by one thread, while the store lock is not held by the other sessions
+            with hydration[0]:
+                return self._hydrate_session(session_id)
+        finally:
+            with self.lock:
+                hydration[1] -= 1
+                if hydration[1] == 0:
+                    self._hydrations.pop(session_id, None)
+
+    def _hydrate_session(self, session_id: str) -> Optional[Session]:
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                return session
+            loaded = self._load_session(session_id)
+        if loaded is None:
+            return None
+        metadata, round_list = loaded
+        session = self.injector.create_object(Session, {"session_id": session_id})
+        for round_dict in round_list:
+            chat_round = Round.from_dict(round_dict)
+            chat_round.id = round_dict["id"]
+            session.memory.conversation.add_round(chat_round)
+        session.round_index = metadata.get("round_index", len(round_list))
+        session.session_var = metadata.get("session_var", {})
+        with self.lock:
+            existing = self.sessions.get(session_id)
+            if existing is None:
+                self._attach(session)
+                return session
+        # the session has been set meanwhile, so the hydrated one is stopped to release its event log and kernel
+        session.stop()
+        return existing
+
+    def set_session(self, session_id: str, session: Session) -> None:
+        with self.lock:
+            with self._transaction():
+                if self.sessions.get(session_id) is not session:
+                    self._attach(session)
+                    for index, chat_round in enumerate(session.memory.conversation.rounds):
+                        self._save_round(session_id, index, chat_round.id, json_dumps(chat_round.to_dict()))
+                self._save_metadata(session_id, json_dumps(self._get_metadata(session)))
+
+    def remove_session(self, session_id: str) -> None:
+        with self.lock:
+            self.sessions.pop(session_id, None)
+            self._delete_session(session_id)
+
+    def has_session(self, session_id: str) -> bool:
+        with self.lock:
+            return session_id in self.sessions or self._has_session(session_id)
+
+    def get_all_session_ids(self) -> Iterable[str]:
+        with self.lock:
+            return sorted(set(self.sessions.keys()) | set(self._list_session_ids()))
+
+    def get_active_session_ids(self) -> Iterable[str]:
+        with self.lock:
+            return list(self.sessions.keys())
+
+    def release_session(self, session_id: str) -> None:
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def save_round(self, session: Session, round_id: str) -> None:
+        """Save the round of the session and the metadata of the session."""
+        rounds = session.memory.conversation.rounds
+        for index in range(len(rounds) - 1, -1, -1):
+            if rounds[index].id == round_id:
+                with self.lock, self._transaction():
+                    self._save_round(session.session_id, index, round_id, json_dumps(rounds[index].to_dict()))
+                    self._save_metadata(session.session_id, json_dumps(self._get_metadata(session)))
+                return
+
+    def _attach(self, session: Session) -> None:
+        self.sessions[session.session_id] = session
+        session.event_emitter.register(_SessionRecorder(self, session))
+
+    @staticmethod
+    def _get_metadata(session: Session) -> Dict[str, Any]:
+        return {
+            "session_id": session.session_id,
+            "round_index": session.round_index,
+            "session_var": session.session_var,
+            "updated_at": time.time(),
+        }
+
+    @contextmanager
+    def _transaction(self) -> Generator[None, None, None]:
+        """Save the round and the metadata of a session together, for a store supporting transactions."""
+        yield
+
+    @abc.abstractmethod
+    def _load_session(self, session_id: str) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """Load the metadata and the rounds of the session, or None if it is not saved."""
+
+    @abc.abstractmethod
+    def _save_metadata(self, session_id: str, metadata: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _save_round(self, session_id: str, index: int, round_id: str, content: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _delete_session(self, session_id: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _has_session(self, session_id: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def _list_session_ids(self) -> Iterable[str]:
+        pass
+
+
+class FileSystemSessionStore(DurableSessionStore):
+    """
+    A session store saving each session in a directory: its metadata in `session.json`
+    and each round in `rounds/<index>.json`, which are replaced atomically.
+    """
+
+    def __init__(self, injector: Injector, store_path: str) -> None:
+        super().__init__(injector)
+        self.store_path = store_path
+        os.makedirs(self.store_path, exist_ok=True)
+
+    def _load_session(self, session_id: str) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        session_dir = self._get_session_dir(session_id)
+        try:
+            with open(os.path.join(session_dir, "session.json"), "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        except FileNotFoundError:
+            return None
+        round_dir = os.path.join(session_dir, "rounds")
+        round_files = sorted(
+            (name for name in os.listdir(round_dir) if name.endswith(".json")) if os.path.isdir(round_dir) else [],
+            key=lambda name: int(name.split(".")[0]),
+        )
+        round_list: List[Dict[str, Any]] = []
+        for name in round_files:
+            with open(os.path.join(round_dir, name), "r", encoding="utf-8") as f:
+                round_list.append(json.load(f))
+        return metadata, round_list
+
+    def _save_metadata(self, session_id: str, metadata: str) -> None:
+        self._write(os.path.join(self._get_session_dir(session_id), "session.json"), metadata)
+
+    def _save_round(self, session_id: str, index: int, round_id: str, content: str) -> None:
+        self._write(os.path.join(self._get_session_dir(session_id), "rounds", f"{index}.json"), content)
+
+    def _delete_session(self, session_id: str) -> None:
+        shutil.rmtree(self._get_session_dir(session_id), ignore_errors=True)
+
+    def _has_session(self, session_id: str) -> bool:
+        return os.path.exists(os.path.join(self._get_session_dir(session_id), "session.json"))
+
+    def _list_session_ids(self) -> Iterable[str]:
+        return [session_id for session_id in os.listdir(self.store_path) if self._has_session(session_id)]
+
+    def _get_session_dir(self, session_id: str) -> str:
+        assert os.path.basename(session_id) == session_id, f"invalid session id {session_id}"
+        return os.path.join(self.store_path, session_id)
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+class SQLiteSessionStore(DurableSessionStore):
+    """A session store saving the sessions in a SQLite database, which can be shared by the processes of a host."""
+
+    def __init__(self, injector: Injector, db_path: str) -> None:
+        super().__init__(injector)
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, metadata TEXT NOT NULL)",
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rounds ("
+            "session_id TEXT NOT NULL, round_index INTEGER NOT NULL, round_id TEXT NOT NULL, content TEXT NOT NULL, "
+            "PRIMARY KEY (session_id, round_index))",
+        )
+
+    def _load_session(self, session_id: str) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        row = self.conn.execute("SELECT metadata FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        rows = self.conn.execute(
+            "SELECT content FROM rounds WHERE session_id = ? ORDER BY round_index",
+            (session_id,),
+        ).fetchall()
+        return json.loads(row[0]), [json.loads(content) for (content,) in rows]
+
+    @contextmanager
+    def _transaction(self) -> Generator[None, None, None]:
+        # the connection is in autocommit mode, so the transaction is started explicitly and takes the write lock
+        # of the database at once, to be serialized with the other processes sharing the database
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _save_metadata(self, session_id: str, metadata: str) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, metadata) VALUES (?, ?)",
+            (session_id, metadata),
+        )
+
+    def _save_round(self, session_id: str, index: int, round_id: str, content: str) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO rounds (session_id, round_index, round_id, content) VALUES (?, ?, ?, ?)",
+            (session_id, index, round_id, content),
+        )
+
+    def _delete_session(self, session_id: str) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM rounds WHERE session_id = ?", (session_id,))
+            self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _has_session(self, session_id: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
+
+    def _list_session_ids(self) -> Iterable[str]:
+        return [session_id for (session_id,) in self.conn.execute("SELECT session_id FROM sessions").fetchall()]
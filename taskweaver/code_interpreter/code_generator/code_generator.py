@@ -11,10 +11,13 @@ from taskweaver.llm.util import ChatMessageType, format_chat_message
 from taskweaver.logging import TelemetryLogger
 from taskweaver.memory import Attachment, Conversation, Memory, Post, Round, RoundCompressor
 from taskweaver.memory.attachment import AttachmentType
+from taskweaver.memory.embedding_index import EmbeddingIndexConfig, QueryEmbeddingCache
 from taskweaver.memory.experience import Experience, ExperienceGenerator
 from taskweaver.memory.plugin import PluginEntry, PluginRegistry
 from taskweaver.misc.example import load_examples
 from taskweaver.module.event_emitter import PostEventProxy
+from taskweaver.module.prompt_budget import PromptBudget
+from taskweaver.module.prompt_util import PromptCache
 from taskweaver.module.tracing import Tracing, get_tracer, tracing_decorator
 from taskweaver.role import PostTranslator, Role
 from taskweaver.utils import read_yaml
@@ -58,6 +61,9 @@ class CodeGeneratorConfig(ModuleConfig):
 
         self.llm_alias = self._get_str("llm_alias", default="", required=False)
 
+        # the maximum number of tokens in the prompt, 0 means unlimited
+        self.prompt_token_budget = self._get_int("prompt_token_budget", 0)
+
 
 class CodeGenerator(Role):
     @inject
@@ -71,6 +77,7 @@ class CodeGenerator(Role):
         round_compressor: RoundCompressor,
         post_translator: PostTranslator,
         experience_generator: ExperienceGenerator,
+        embedding_index_config: EmbeddingIndexConfig,
     ):
         self.config = config
         self.logger = logger
@@ -98,10 +105,17 @@ class CodeGenerator(Role):
         )
 
         self.round_compressor: RoundCompressor = round_compressor
+        self.prompt_cache = PromptCache()
+        self.prompt_budget = PromptBudget(
+            self.llm_api.get_tokenizer(self.config.llm_alias),
+            self.config.prompt_token_budget,
+        )
         self.compression_template = read_yaml(self.config.compression_prompt_path)["content"]
+        # the query is embedded once in a round for the plugin selection and the experience retrieval
+        self.query_embedding_cache = QueryEmbeddingCache(self.llm_api.get_embedding)
 
         if self.config.enable_auto_plugin_selection:
-            self.plugin_selector = PluginSelector(plugin_registry, self.llm_api)
+            self.plugin_selector = PluginSelector(plugin_registry, self.llm_api, embedding_index_config)
             self.plugin_selector.load_plugin_embeddings()
             logger.info("Plugin embeddings loaded")
             self.selected_plugin_pool = SelectedPluginPool()
@@ -156,22 +170,36 @@ class CodeGenerator(Role):
         plugins: List[PluginEntry],
         selected_experiences: Optional[List[Experience]] = None,
     ) -> List[ChatMessageType]:
-        experiences = (
-            self.experience_generator.format_experience_in_prompt(
-                self.prompt_data["experience_instruction"],
-                selected_experiences,
-            )
-            if self.config.use_experience
-            else ""
-        )
-
-        chat_history = [format_chat_message(role="system", message=f"{self.instruction}\n{experiences}")]
+        # the instruction and the examples are static, so they are rendered once and put first in the prompt,
+        # which keeps the prompt prefix identical across turns for the prefix caching of the LLM endpoints
+        system = [format_chat_message(role="system", message=self.instruction)]
 
         if self.examples is None:
             self.examples = self.load_examples()
-        for i, example in enumerate(self.examples):
-            chat_history.extend(
-                self.compose_conversation(example.rounds, example.plugins, add_requirements=False),
+        examples = self.prompt_cache.get_or_create(
+            "examples",
+            self.examples,
+            lambda: [
+                self.compose_conversation(example.rounds, example.plugins, add_requirements=False)
+                for example in self.examples
+            ],
+        )
+
+        # the experiences are selected for each query, so they are put after the static prefix
+        context: List[ChatMessageType] = []
+        if self.config.use_experience and selected_experiences is not None and len(selected_experiences) > 0:
+            context = self.prompt_cache.get_or_create(
+                "experiences",
+                [exp for exp, _ in selected_experiences],
+                lambda: [
+                    format_chat_message(
+                        role="system",
+                        message=self.experience_generator.format_experience_in_prompt(
+                            self.prompt_data["experience_instruction"],
+                            selected_experiences,
+                        ),
+                    ),
+                ],
             )
 
         summary = None
@@ -184,15 +212,18 @@ class CodeGenerator(Role):
                 prompt_template=self.compression_template,
             )
 
-        chat_history.extend(
-            self.compose_conversation(
-                rounds,
+        return self.prompt_budget.build(
+            system,
+            examples,
+            rounds,
+            rounds_composer=lambda _rounds: self.compose_conversation(
+                _rounds,
                 add_requirements=True,
                 summary=summary,
                 plugins=plugins,
             ),
+            context=context,
         )
-        return chat_history
 
     def format_attachment(self, attachment: Attachment):
         if attachment.type == AttachmentType.thought:
@@ -200,6 +231,9 @@ class CodeGenerator(Role):
         else:
             return attachment.content
 
+    def format_code_feedback(self, post: Post) -> str:
+        return self.post_translator.render_cache.get(post, "code_feedback", lambda: format_code_feedback(post))
+
     def compose_conversation(
         self,
         rounds: List[Round],
@@ -250,7 +284,7 @@ class CodeGenerator(Role):
 
                     user_feedback = "None"
                     if last_post is not None and last_post.send_from == "CodeInterpreter":
-                        user_feedback = format_code_feedback(last_post)
+                        user_feedback = self.format_code_feedback(last_post)
 
                     user_message += self.user_message_head_template.format(
                         FEEDBACK=user_feedback,
@@ -259,7 +293,7 @@ class CodeGenerator(Role):
                 elif post.send_from == post.send_to == "CodeInterpreter":
                     # for code correction
                     user_message += self.user_message_head_template.format(
-                        FEEDBACK=format_code_feedback(post),
+                        FEEDBACK=self.format_code_feedback(post),
                         MESSAGE=f"{post.get_attachment(AttachmentType.revise_message)[0]}",
                     )
 
@@ -276,7 +310,7 @@ class CodeGenerator(Role):
                         # It is used to make sure the last assistant message has a feedback
                         # This is only used for examples or context summarization
                         user_message += self.user_message_head_template.format(
-                            FEEDBACK=format_code_feedback(post),
+                            FEEDBACK=self.format_code_feedback(post),
                             MESSAGE="This is the feedback.",
                         )
 
@@ -314,10 +348,12 @@ class CodeGenerator(Role):
     def select_plugins_for_prompt(
         self,
         query: str,
+        query_embedding: Optional[List[float]] = None,
     ) -> List[PluginEntry]:
         selected_plugins = self.plugin_selector.plugin_select(
             query,
             self.config.auto_plugin_selection_topk,
+            query_embedding=query_embedding,
         )
         self.selected_plugin_pool.add_selected_plugins(selected_plugins)
         self.logger.info(f"Selected plugins: {[p.name for p in selected_plugins]}")
@@ -350,14 +386,23 @@ class CodeGenerator(Role):
         self.tracing.set_span_attribute("use_experience", self.config.use_experience)
 
         if self.config.enable_auto_plugin_selection:
-            self.plugin_pool = self.select_plugins_for_prompt(query)
+            self.plugin_pool = self.select_plugins_for_prompt(
+                query,
+                self.query_embedding_cache.get(rounds[-1].id, query),
+            )
 
         if self.config.use_experience:
-            selected_experiences = self.experience_generator.retrieve_experience(query)
+            selected_experiences = self.experience_generator.retrieve_experience(
+                query,
+                query_embedding=self.query_embedding_cache.get(rounds[-1].id, query),
+            )
         else:
             selected_experiences = None
 
         prompt = self.compose_prompt(rounds, self.plugin_pool, selected_experiences)
+        self.logger.info(f"CodeGenerator prompt token stats: {self.prompt_budget.stats}")
+        for key, value in self.prompt_budget.stats.items():
+            self.tracing.set_span_attribute(f"prompt.{key}", value)
 
         def early_stop(_type: AttachmentType, value: str) -> bool:
             if _type in [AttachmentType.text, AttachmentType.python, AttachmentType.sample]:
@@ -403,8 +448,12 @@ class CodeGenerator(Role):
         plugin_list: List[PluginEntry],
     ) -> str:
         if self.config.load_plugin:
-            return "\n".join(
-                [plugin.format_prompt() for plugin in plugin_list],
+            return self.prompt_cache.get_or_create(
+                "plugins",
+                plugin_list,
+                lambda: "\n".join(
+                    [plugin.format_prompt() for plugin in plugin_list],
+                ),
             )
         return ""
 
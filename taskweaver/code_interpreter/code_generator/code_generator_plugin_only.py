@@ -11,6 +11,7 @@ from taskweaver.llm.util import ChatMessageType
 from taskweaver.logging import TelemetryLogger
 from taskweaver.memory import Memory, Post, Round
 from taskweaver.memory.attachment import AttachmentType
+from taskweaver.memory.embedding_index import EmbeddingIndexConfig, QueryEmbeddingCache
 from taskweaver.memory.plugin import PluginEntry, PluginRegistry
 from taskweaver.module.event_emitter import PostEventProxy, SessionEventEmitter
 from taskweaver.module.tracing import Tracing, get_tracer, tracing_decorator
@@ -56,6 +57,7 @@ class CodeGeneratorPluginOnly(Role):
         tracing: Tracing,
         event_emitter: SessionEventEmitter,
         llm_api: LLMApi,
+        embedding_index_config: EmbeddingIndexConfig,
     ):
         self.config = config
         self.logger = logger
@@ -71,18 +73,27 @@ class CodeGeneratorPluginOnly(Role):
         self.instruction_template = self.prompt_data["content"]
 
         if self.config.enable_auto_plugin_selection:
-            self.plugin_selector = PluginSelector(plugin_registry, self.llm_api)
+            self.plugin_selector = PluginSelector(
+                plugin_registry,
+                self.llm_api,
+                embedding_index_config,
+                plugin_only=True,
+            )
             self.plugin_selector.load_plugin_embeddings()
             logger.info("Plugin embeddings loaded")
             self.selected_plugin_pool = SelectedPluginPool()
+            # the user query is embedded once in a round, not in each reply
+            self.query_embedding_cache = QueryEmbeddingCache(self.llm_api.get_embedding)
 
     def select_plugins_for_prompt(
         self,
         user_query: str,
+        query_embedding: Optional[List[float]] = None,
     ) -> List[PluginEntry]:
         selected_plugins = self.plugin_selector.plugin_select(
             user_query,
             self.config.auto_plugin_selection_topk,
+            query_embedding=query_embedding,
         )
         self.selected_plugin_pool.add_selected_plugins(selected_plugins)
         self.logger.info(f"Selected plugins: {[p.name for p in selected_plugins]}")
@@ -109,7 +120,10 @@ class CodeGeneratorPluginOnly(Role):
         self.tracing.set_span_attribute("user_query", user_query)
         self.tracing.set_span_attribute("enable_auto_plugin_selection", self.config.enable_auto_plugin_selection)
         if self.config.enable_auto_plugin_selection:
-            self.plugin_pool = self.select_plugins_for_prompt(user_query)
+            self.plugin_pool = self.select_plugins_for_prompt(
+                user_query,
+                self.query_embedding_cache.get(rounds[-1].id, user_query),
+            )
 
         # obtain the user query from the last round
         prompt, tools = _compose_prompt(
@@ -144,8 +158,8 @@ class CodeGeneratorPluginOnly(Role):
             self.tracing.set_span_attribute("functions", llm_response["content"])
 
             if self.config.enable_auto_plugin_selection:
-                # here the code is in json format, not really code
-                self.selected_plugin_pool.filter_unused_plugins(code=llm_response["content"])
+                # the content is the function calls in json format, not code
+                self.selected_plugin_pool.filter_unused_functions(function_calls=llm_response["content"])
             return post_proxy.end()
         else:
             self.tracing.set_span_status("ERROR", "Unexpected response from LLM")
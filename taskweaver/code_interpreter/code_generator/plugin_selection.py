@@ -1,13 +1,22 @@
+import ast
+import json
 import os
-from typing import Dict, List
+import re
+from typing import Any, Dict, List, Optional, Set
 
-import numpy as np
 from injector import inject
-from sklearn.metrics.pairwise import cosine_similarity
 
+from taskweaver.code_interpreter.code_verification import separate_magics_and_code
 from taskweaver.llm import LLMApi
+from taskweaver.memory.embedding_index import (
+    EmbeddingIndex,
+    EmbeddingIndexConfig,
+    IVFEmbeddingIndex,
+    create_embedding_index,
+)
+from taskweaver.memory.embedding_store import EmbeddingRecord, EmbeddingStore
 from taskweaver.memory.plugin import PluginEntry, PluginRegistry
-from taskweaver.utils import generate_md5_hash, write_yaml
+from taskweaver.utils import generate_md5_hash, read_yaml, write_yaml
 
 
 class SelectedPluginPool:
@@ -28,7 +37,16 @@ class SelectedPluginPool:
         """
         Filter out plugins that are not used in the code generated by LLM
         """
-        plugins_used_in_code = [p for p in self.selected_plugin_pool if p.name in code]
+        self._keep_used_plugins(get_code_identifiers(code))
+
+    def filter_unused_functions(self, function_calls: str):
+        """
+        Filter out plugins that are not called in the function calls generated by LLM in the plugin-only mode
+        """
+        self._keep_used_plugins(get_function_call_names(function_calls))
+
+    def _keep_used_plugins(self, used_names: Set[str]):
+        plugins_used_in_code = [p for p in self.selected_plugin_pool if p.name in used_names]
         self._previous_used_plugin_cache = self.merge_plugin_pool(
             self._previous_used_plugin_cache,
             plugins_used_in_code,
@@ -41,20 +59,49 @@ class SelectedPluginPool:
     @staticmethod
     def merge_plugin_pool(pool1: List[PluginEntry], pool2: List[PluginEntry]) -> List[PluginEntry]:
         """
-        Merge two plugin pools and remove duplicates
+        Merge two plugin pools and remove duplicates, keeping the first plugin of each name
         """
-        merged_list = pool1 + pool2
-        result = []
-
-        for item in merged_list:
-            is_duplicate = False
-            for existing_item in result:
-                if item.name == existing_item.name:
-                    is_duplicate = True
-                    break
-            if not is_duplicate:
-                result.append(item)
-        return result
+        merged: Dict[str, PluginEntry] = {}
+        for item in pool1 + pool2:
+            merged.setdefault(item.name, item)
+        return list(merged.values())
+
+
+def get_code_identifiers(code: str) -> Set[str]:
+    """
+    Get the names and attributes referenced in the code, so that a plugin is used only if its name is an identifier,
+    not a part of another identifier or a string. The words of the code are returned if it cannot be parsed.
+    """
+    _, python_code, _ = separate_magics_and_code(code)
+    try:
+        tree = ast.parse(python_code)
+    except SyntaxError:
+        return set(re.findall(r"[A-Za-z_]\w*", code))
+    identifiers: Set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            identifiers.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            identifiers.add(node.attr)
+        elif isinstance(node, ast.alias):
+            identifiers.add(node.asname or node.name)
+    return identifiers
+
+
+def get_function_call_names(function_calls: str) -> Set[str]:
+    """
+    Get the names of the functions called in the function calls of the LLM response, a JSON list of objects
+    with the name and the arguments of each call. The words of the content are returned if it cannot be parsed.
+    """
+    try:
+        calls: Any = json.loads(function_calls)
+    except json.JSONDecodeError:
+        return set(re.findall(r"[A-Za-z_]\w*", function_calls))
+    if isinstance(calls, dict):
+        calls = [calls]
+    if not isinstance(calls, list):
+        return set()
+    return set(call["name"] for call in calls if isinstance(call, dict) and isinstance(call.get("name"), str))
 
 
 class PluginSelector:
@@ -63,6 +110,7 @@ class PluginSelector:
         self,
         plugin_registry: PluginRegistry,
         llm_api: LLMApi,
+        index_config: EmbeddingIndexConfig,
         plugin_only: bool = False,
     ):
         if plugin_only:
@@ -70,7 +118,9 @@ class PluginSelector:
         else:
             self.available_plugins = plugin_registry.get_list()
         self.llm_api = llm_api
+        self.plugins: Dict[str, PluginEntry] = {p.name: p for p in self.available_plugins}
         self.plugin_embedding_dict: Dict[str, List[float]] = {}
+        self.plugin_index: EmbeddingIndex[str] = create_embedding_index(index_config)
 
         self.exception_message_for_refresh = (
             "Please cd to the `script` directory and "
@@ -81,16 +131,28 @@ class PluginSelector:
         if not os.path.exists(self.meta_file_dir):
             os.makedirs(self.meta_file_dir)
 
+        # the embeddings are in the meta yaml files of the plugins, or in a binary embedding store
+        self.embedding_store = (
+            EmbeddingStore(os.path.join(self.meta_file_dir, "embeddings"))
+            if plugin_registry.embedding_storage == "npy"
+            else None
+        )
+
     def refresh(self):
         plugins_to_embedded = []
+        embedding_model = self.llm_api.embedding_service.config.embedding_model
         for idx, p in enumerate(self.available_plugins):
-            if (
-                len(p.meta_data.embedding) > 0
-                and p.meta_data.embedding_model == self.llm_api.embedding_service.config.embedding_model
-                and p.meta_data.md5hash == generate_md5_hash(p.spec.name + p.spec.description)
-            ):
-                continue
+            md5hash = generate_md5_hash(p.spec.name + p.spec.description)
+            if self.embedding_store is not None:
+                record = self.embedding_store.get(p.name)
+                up_to_date = record is not None and record.model == embedding_model and record.hash == md5hash
             else:
+                up_to_date = (
+                    len(p.meta_data.embedding) > 0
+                    and p.meta_data.embedding_model == embedding_model
+                    and p.meta_data.md5hash == md5hash
+                )
+            if not up_to_date:
                 plugins_to_embedded.append((idx, p.name + ": " + p.spec.description))
 
         if len(plugins_to_embedded) == 0:
@@ -99,14 +161,43 @@ class PluginSelector:
 
         plugin_embeddings = self.llm_api.get_embedding_list([text for idx, text in plugins_to_embedded])
 
+        records: List[EmbeddingRecord] = []
         for i, embedding in enumerate(plugin_embeddings):
             p = self.available_plugins[plugins_to_embedded[i][0]]
             p.meta_data.embedding = embedding
-            p.meta_data.embedding_model = self.llm_api.embedding_service.config.embedding_model
+            p.meta_data.embedding_model = embedding_model
             p.meta_data.md5hash = generate_md5_hash(p.spec.name + p.spec.description)
-            write_yaml(p.meta_data.path, p.meta_data.to_dict())
+            if self.embedding_store is not None:
+                records.append(EmbeddingRecord(p.name, embedding, embedding_model, p.meta_data.md5hash))
+            else:
+                write_yaml(p.meta_data.path, p.meta_data.to_dict())
+        if self.embedding_store is not None:
+            self.embedding_store.put_many(records)
+
+    def migrate_embeddings(self):
+        """Copy the embeddings in the meta yaml files of the plugins to the binary embedding store."""
+        assert self.embedding_store is not None, "plugin.embedding_storage must be npy to migrate the embeddings"
+        records: List[EmbeddingRecord] = []
+        for p in self.available_plugins:
+            if p.meta_data.path is None or not os.path.exists(p.meta_data.path):
+                continue
+            meta_data = read_yaml(p.meta_data.path)
+            if len(meta_data.get("embedding") or []) > 0:
+                records.append(
+                    EmbeddingRecord(p.name, meta_data["embedding"], meta_data["embedding_model"], meta_data["md5hash"]),
+                )
+        self.embedding_store.put_many(records)
 
     def load_plugin_embeddings(self):
+        if self.embedding_store is not None:
+            # the embeddings are read into the meta data of the plugins, which is checked below
+            for p in self.available_plugins:
+                record = self.embedding_store.get(p.name)
+                if record is not None:
+                    p.meta_data.embedding = record.embedding  # type: ignore
+                    p.meta_data.embedding_model = record.model
+                    p.meta_data.md5hash = record.hash
+
         for idx, p in enumerate(self.available_plugins):
             # check if the plugin has embedding
             assert len(p.meta_data.embedding) > 0, (
@@ -127,30 +218,31 @@ class PluginSelector:
 
             self.plugin_embedding_dict[p.name] = p.meta_data.embedding
 
-    def plugin_select(self, user_query: str, top_k: int = 5) -> List[PluginEntry]:
-        user_query_embedding = np.array(self.llm_api.get_embedding(user_query))
+        embedding_model = self.llm_api.embedding_service.config.embedding_model
+        index_path = os.path.join(self.meta_file_dir, "embeddings", "ivf_index.npz")
+        if isinstance(self.plugin_index, IVFEmbeddingIndex):
+            self.plugin_index.load(index_path, embedding_model)
+        self.plugin_index.add_many(list(self.plugin_embedding_dict.keys()), list(self.plugin_embedding_dict.values()))
+        if isinstance(self.plugin_index, IVFEmbeddingIndex) and self.plugin_index.is_dirty:
+            self.plugin_index.save(index_path, embedding_model)
 
-        similarities = []
+    def plugin_select(
+        self,
+        user_query: str,
+        top_k: int = 5,
+        query_embedding: Optional[List[float]] = None,
+    ) -> List[PluginEntry]:
+        """
+        Select the plugins most similar to the query.
 
+        Args:
+            user_query: the query.
+            top_k: the number of plugins to select.
+            query_embedding: the embedding of the query if it is already computed, e.g., for experience retrieval.
+        """
         if top_k >= len(self.available_plugins):
             return self.available_plugins
 
-        for p in self.available_plugins:
-            similarity = cosine_similarity(
-                user_query_embedding.reshape(
-                    1,
-                    -1,
-                ),
-                np.array(self.plugin_embedding_dict[p.name]).reshape(1, -1),
-            )
-            similarities.append((p, similarity))
-
-        plugins_rank = sorted(
-            similarities,
-            key=lambda x: x[1],
-            reverse=True,
-        )[:top_k]
-
-        selected_plugins = [p for p, sim in plugins_rank]
-
-        return selected_plugins
+        if query_embedding is None:
+            query_embedding = self.llm_api.get_embedding(user_query)
+        return [self.plugins[name] for name, _ in self.plugin_index.search(query_embedding, top_k=top_k)]
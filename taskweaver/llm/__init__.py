@@ -1,5 +1,5 @@
 import types
-from typing import Any, Callable, Generator, List, Optional, Type
+from typing import Any, Callable, Dict, Generator, List, Optional, Type
 
 from injector import Injector, Module, inject, provider
 
@@ -11,16 +11,39 @@ from taskweaver.llm.base import (
     ExtLLMModuleConfig,
     LLMModuleConfig,
     LLMServiceConfig,
+    override_config,
 )
+from taskweaver.llm.cancellation import CancellationStats, CancellationToken, cancellable_stream, get_cancellation_stats
 from taskweaver.llm.google_genai import GoogleGenAIService
+from taskweaver.llm.hedging import (
+    LLMHedgingConfig,
+    get_hedge_budget,
+    get_hedge_delay,
+    get_latency_tracker,
+    hedged_stream,
+)
 from taskweaver.llm.mock import MockApiService
 from taskweaver.llm.ollama import OllamaService
 from taskweaver.llm.openai import OpenAIService
 from taskweaver.llm.placeholder import PlaceholderEmbeddingService
+from taskweaver.llm.pool import CompletionServicePool, LLMPoolConfig, PoolMember
 from taskweaver.llm.qwen import QWenService, QWenServiceConfig
+from taskweaver.llm.resilience import LLMResilienceConfig, ResilientCompletionService
+from taskweaver.llm.routing import LLMRoutingConfig, llm_router, tracked_stream
 from taskweaver.llm.sentence_transformer import SentenceTransformerService
+from taskweaver.llm.single_flight import (
+    LLMSingleFlightConfig,
+    completion_flights,
+    embedding_flights,
+    get_single_flight_stats,
+    make_request_key,
+)
+from taskweaver.llm.tokenizer import Tokenizer, TokenizerConfig, get_tokenizer
+from taskweaver.llm.usage import TokenUsage, current_usage_labels, get_usage_stats, get_usage_tracker, metered_stream
 from taskweaver.llm.util import ChatMessageType, format_chat_message
 from taskweaver.llm.zhipuai import ZhipuAIService
+from taskweaver.module.tracing import get_current_span
+from taskweaver.utils import StringBuilder
 
 llm_completion_config_map = {
     "openai": OpenAIService,
@@ -49,6 +72,13 @@ class LLMApi(object):
         self.injector = injector
         self.ext_llm_injector = Injector([])
         self.ext_llms = {}  # extra llm models
+        self.ext_llm_models = {}  # model names of the extra llm models
+        self.tokenizer_config = self.injector.get(TokenizerConfig)
+        self.hedging_config = self.injector.get(LLMHedgingConfig)
+        self.single_flight_config = self.injector.get(LLMSingleFlightConfig)
+        self.routing_config = self.injector.get(LLMRoutingConfig)
+        # the identities of the llms, which tell whether requests to them can be coalesced
+        self.llm_identities = {"": self._get_llm_identity(self.config)}
 
         if self.config.api_type in ["openai", "azure", "azure_ad"]:
             self._set_completion_service(OpenAIService)
@@ -65,6 +95,11 @@ class LLMApi(object):
         else:
             raise ValueError(f"API type {self.config.api_type} is not supported")
 
+        self.completion_service = self._build_completion_service(
+            self.injector.get(AppConfigSource),
+            self.completion_service,
+        )
+
         if self.config.embedding_api_type in ["openai", "azure", "azure_ad"]:
             self._set_embedding_service(OpenAIService)
         elif self.config.embedding_api_type == "ollama":
@@ -93,6 +128,7 @@ class LLMApi(object):
             mock = self.injector.get(MockApiService)
             mock.set_base_completion_service(base_completion_service)
             mock.set_base_embedding_service(base_embedding_service)
+            self.injector.binder.bind(MockApiService, to=mock)
             self._set_completion_service(MockApiService)
             self._set_embedding_service(MockApiService)
 
@@ -102,6 +138,22 @@ class LLMApi(object):
                 assert api_type in llm_completion_config_map, f"API type {api_type}  is not supported"
                 llm_completion_service = self._get_completion_service(config)
                 self.ext_llms[key] = llm_completion_service
+                ext_llm_config = self.ext_llm_injector.get(LLMModuleConfig)
+                self.ext_llm_models[key] = ext_llm_config.model
+                self.llm_identities[key] = self._get_llm_identity(ext_llm_config)
+
+        # the outcomes of the requests are tracked for the routing only when it is enabled for some role
+        self.routing_enabled = False
+        for role in [None, *self.routing_config.roles.keys()]:
+            policy = self.routing_config.get_policy(role)
+            if policy.enabled and policy.fast_alias != "":
+                if policy.fast_alias not in self.ext_llms:
+                    raise ValueError(f"The fast LLM {policy.fast_alias} of the routing is not in ext_llms.llm_configs")
+                self.routing_enabled = True
+
+    @staticmethod
+    def _get_llm_identity(llm_config: LLMModuleConfig) -> str:
+        return f"{llm_config.api_type}|{llm_config.api_base}|{llm_config.model}|{llm_config.use_mock}"
 
     def _set_completion_service(self, svc: Type[CompletionService]) -> None:
         self.completion_service: CompletionService = self.injector.get(svc)
@@ -111,10 +163,88 @@ class LLMApi(object):
         self.embedding_service: EmbeddingService = self.injector.get(svc)
         self.injector.binder.bind(svc, to=self.embedding_service)
 
-    def _get_completion_service(self, config) -> CompletionService:
+    def _get_completion_service(self, config: AppConfigSource) -> CompletionService:
         self.ext_llm_injector.binder.bind(AppConfigSource, to=config)
         api_type = config.get_str("llm.api_type")
-        return self.ext_llm_injector.get(llm_completion_config_map[api_type])
+        return self._build_completion_service(
+            config,
+            self.ext_llm_injector.get(llm_completion_config_map[api_type]),
+        )
+
+    @staticmethod
+    def _create_completion_service(config: AppConfigSource) -> CompletionService:
+        injector = Injector([])
+        injector.binder.bind(AppConfigSource, to=config)
+        api_type = config.get_str("llm.api_type")
+        assert api_type in llm_completion_config_map, f"API type {api_type} is not supported"
+        return injector.get(llm_completion_config_map[api_type])
+
+    def _build_completion_service(
+        self,
+        config: AppConfigSource,
+        service: CompletionService,
+    ) -> CompletionService:
+        """
+        Build the completion service of an LLM config: a single endpoint with the resilience layer,
+        or a pool of endpoints when `llm.pool.endpoints` or a different `llm.backup_model` is configured.
+        """
+        injector = Injector([])
+        injector.binder.bind(AppConfigSource, to=config)
+        llm_config = injector.get(LLMModuleConfig)
+        pool_config = injector.get(LLMPoolConfig)
+        resilience_config = injector.get(LLMResilienceConfig)
+
+        has_backup = llm_config.backup_model not in [None, "", llm_config.model]
+        if len(pool_config.endpoints) == 0 and not has_backup:
+            return self._wrap_completion_service(service, resilience_config)
+
+        def create_member(svc: CompletionService, weight: float) -> PoolMember:
+            if resilience_config.enabled:
+                # the pool fails over to other endpoints instead of retrying the same one
+                svc = ResilientCompletionService(svc, resilience_config, max_retries=0)
+            return CompletionServicePool.create_member(
+                svc,
+                weight=weight,
+                failure_threshold=resilience_config.failure_threshold,
+                recovery_timeout=resilience_config.recovery_timeout,
+            )
+
+        members: List[PoolMember] = []
+        for endpoint in pool_config.endpoints:
+            overrides = {k: v for k, v in endpoint.items() if k != "weight"}
+            members.append(
+                create_member(
+                    self._create_completion_service(override_config(config, overrides)),
+                    float(endpoint.get("weight", 1)),
+                ),
+            )
+        if len(members) == 0:
+            members.append(create_member(service, 1.0))
+
+        fallback_members: List[PoolMember] = []
+        if has_backup:
+            backup_config = override_config(config, {"llm.model": llm_config.backup_model})
+            fallback_members.append(create_member(self._create_completion_service(backup_config), 1.0))
+
+        return CompletionServicePool(
+            members,
+            fallback_members,
+            strategy=pool_config.strategy,
+            max_retries=resilience_config.max_retries if resilience_config.enabled else 0,
+            backoff_base=resilience_config.backoff_base,
+            backoff_max=resilience_config.backoff_max,
+            retry_budget=resilience_config.retry_budget,
+        )
+
+    @staticmethod
+    def _wrap_completion_service(
+        svc: CompletionService,
+        resilience_config: LLMResilienceConfig,
+    ) -> CompletionService:
+        if not resilience_config.enabled:
+            return svc
+        # add rate limiting, concurrency limit and retry layer to the completion service
+        return ResilientCompletionService(svc, resilience_config)
 
     def _get_embedding_service(self, svc: Type[EmbeddingService]) -> EmbeddingService:
         # TODO
@@ -132,6 +262,7 @@ class LLMApi(object):
         **kwargs: Any,
     ) -> ChatMessageType:
         msg: ChatMessageType = format_chat_message("assistant", "")
+        llm_alias = self._route(messages, llm_alias)
         if llm_alias is not None and llm_alias != "":
             if llm_alias in self.ext_llms:
                 completion_service = self.ext_llms[llm_alias]
@@ -141,15 +272,31 @@ class LLMApi(object):
                 )
         else:
             completion_service = self.completion_service
-        for msg_chunk in completion_service.chat_completion(
-            messages,
-            stream,
-            temperature,
-            max_tokens,
-            top_p,
-            stop,
-            **kwargs,
-        ):
+
+        def get_generator() -> Generator[ChatMessageType, None, None]:
+            return self._track(
+                llm_alias,
+                lambda: completion_service.chat_completion(
+                    messages,
+                    stream,
+                    temperature,
+                    max_tokens,
+                    top_p,
+                    stop,
+                    **kwargs,
+                ),
+            )
+
+        # the upstream stream is metered, so that the usage of coalesced requests is counted once
+        metered_init = self._get_metered_stream_init(get_generator, messages, llm_alias)
+        if self.single_flight_config.completion:
+            key = self._get_completion_request_key(
+                llm_alias, messages, stream, temperature, max_tokens, top_p, stop, kwargs
+            )
+            completion_stream = completion_flights.stream(key, metered_init)
+        else:
+            completion_stream = metered_init()
+        for msg_chunk in completion_stream:
             msg["role"] = msg_chunk["role"]
             msg["content"] += msg_chunk["content"]
             if "name" in msg_chunk:
@@ -166,35 +313,145 @@ class LLMApi(object):
         stop: Optional[List[str]] = None,
         use_smoother: bool = True,
         llm_alias: Optional[str] = None,
+        hedge: Optional[bool] = None,
         **kwargs: Any,
     ) -> Generator[ChatMessageType, None, None]:
-        def get_generator() -> Generator[ChatMessageType, None, None]:
-            if llm_alias is not None and llm_alias != "":
-                if llm_alias in self.ext_llms:
-                    completion_service = self.ext_llms[llm_alias]
+        llm_alias = self._route(messages, llm_alias)
+
+        def get_generator(alias: Optional[str] = llm_alias) -> Generator[ChatMessageType, None, None]:
+            if alias is not None and alias != "":
+                if alias in self.ext_llms:
+                    completion_service = self.ext_llms[alias]
                 else:
                     raise ValueError(
-                        f"Cannot import extra LLM model {llm_alias}, ",
+                        f"Cannot import extra LLM model {alias}, ",
                     )
             else:
                 completion_service = self.completion_service
-            return completion_service.chat_completion(
-                messages,
-                stream,
-                temperature,
-                max_tokens,
-                top_p,
-                stop,
-                **kwargs,
+            return self._track(
+                alias,
+                lambda: completion_service.chat_completion(
+                    messages,
+                    stream,
+                    temperature,
+                    max_tokens,
+                    top_p,
+                    stop,
+                    **kwargs,
+                ),
+            )
+
+        stream_init: Callable[[], Generator[ChatMessageType, None, None]] = get_generator
+        if hedge if hedge is not None else self.hedging_config.enabled:
+            stream_init = self._get_hedged_stream_init(get_generator, llm_alias)
+        stream_init = self._get_metered_stream_init(stream_init, messages, llm_alias)
+        if self.single_flight_config.completion:
+            # identical requests share the upstream stream, which is hedged as a whole
+            key = self._get_completion_request_key(
+                llm_alias, messages, stream, temperature, max_tokens, top_p, stop, kwargs
             )
+            metered_init = stream_init
+            stream_init = lambda: completion_flights.stream(key, metered_init)  # noqa: E731
 
+        stats = get_cancellation_stats(llm_alias if llm_alias is not None else "")
+        count_tokens = self.get_tokenizer(llm_alias).count_tokens
         if use_smoother:
-            return self._stream_smoother(get_generator)
-        return get_generator()
+            return self._stream_smoother(stream_init, stats, count_tokens)
+        return cancellable_stream(stream_init, stats=stats, count_tokens=count_tokens)
+
+    def _route(self, messages: List[ChatMessageType], llm_alias: Optional[str]) -> Optional[str]:
+        """
+        Route the request of the role labelling it to the fast LLM of its routing policy if the request is easy,
+        or to the requested LLM otherwise. The decision and its features are recorded in the current span.
+        """
+        if not self.routing_enabled:
+            return llm_alias
+        labels = current_usage_labels()
+        role = labels.get("role")
+        policy = self.routing_config.get_policy(role)
+        requested_alias = llm_alias if llm_alias is not None else ""
+        if not policy.enabled or policy.fast_alias in ["", requested_alias]:
+            return llm_alias
+
+        tokenizer = self.get_tokenizer(requested_alias)
+        message_tokens = tokenizer.count_tokens(messages[-1]["content"]) if len(messages) > 0 else 0
+        prompt_tokens = tokenizer.count_message_tokens(messages)
+        turn = labels.get("turn", 0)
+        previous_failed = labels.get("previous_failed", False)
+        decision = llm_router.route(policy, requested_alias, message_tokens, prompt_tokens, turn, previous_failed)
+
+        span = get_current_span()
+        span.set_attribute("llm.routing.role", role if role is not None else "")
+        span.set_attribute("llm.routing.alias", decision.alias)
+        span.set_attribute("llm.routing.reason", decision.reason)
+        span.set_attribute("llm.routing.message_tokens", message_tokens)
+        span.set_attribute("llm.routing.prompt_tokens", prompt_tokens)
+        span.set_attribute("llm.routing.turn", turn)
+        span.set_attribute("llm.routing.previous_failed", previous_failed)
+        return decision.alias
+
+    def _track(
+        self,
+        llm_alias: Optional[str],
+        stream_init: Callable[[], Generator[ChatMessageType, None, None]],
+    ) -> Generator[ChatMessageType, None, None]:
+        if not self.routing_enabled:
+            return stream_init()
+        return tracked_stream(stream_init, llm_router.get_tracker(llm_alias if llm_alias is not None else ""))
+
+    def _get_metered_stream_init(
+        self,
+        stream_init: Callable[[], Generator[ChatMessageType, None, None]],
+        messages: List[ChatMessageType],
+        llm_alias: Optional[str],
+    ) -> Callable[[], Generator[ChatMessageType, None, None]]:
+        # the labels and the span are those of the caller, as the stream may be pulled by another thread
+        labels = current_usage_labels()
+        span = get_current_span()
+        alias = llm_alias if llm_alias is not None and llm_alias != "" else "default"
+
+        def estimate(content: str) -> TokenUsage:
+            tokenizer = self.get_tokenizer(llm_alias)
+            return TokenUsage(
+                prompt_tokens=tokenizer.count_message_tokens(messages),
+                completion_tokens=tokenizer.count_tokens(content),
+            )
+
+        def on_usage(usage: TokenUsage) -> None:
+            role = labels.get("role")
+            get_usage_tracker(alias).record(usage, role)
+            chat_round = labels.get("round")
+            if chat_round is not None:
+                chat_round.add_usage(role if role is not None else "unknown", alias, usage.to_dict())
+            for key, value in usage.to_dict().items():
+                span.set_attribute(f"llm.usage.{key}", value)
+
+        return lambda: metered_stream(stream_init, on_usage, estimate)
+
+    def _get_hedged_stream_init(
+        self,
+        get_generator: Callable[[Optional[str]], Generator[ChatMessageType, None, None]],
+        llm_alias: Optional[str],
+    ) -> Callable[[], Generator[ChatMessageType, None, None]]:
+        primary_alias = llm_alias if llm_alias is not None else ""
+        secondary_alias = self.hedging_config.alias if self.hedging_config.alias != "" else primary_alias
+        if secondary_alias != "" and secondary_alias not in self.ext_llms:
+            raise ValueError(f"Cannot hedge requests to extra LLM model {secondary_alias}")
+
+        primary_tracker = get_latency_tracker(primary_alias)
+        return lambda: hedged_stream(
+            primary_init=lambda: get_generator(primary_alias),
+            secondary_init=lambda: get_generator(secondary_alias),
+            delay=get_hedge_delay(self.hedging_config, primary_tracker),
+            budget=get_hedge_budget(self.hedging_config.budget_ratio),
+            trackers=(primary_tracker, get_latency_tracker(secondary_alias)),
+        )
 
     def _stream_smoother(
         self,
         stream_init: Callable[[], Generator[ChatMessageType, None, None]],
+        stats: Optional[CancellationStats] = None,
+        count_tokens: Optional[Callable[[str], int]] = None,
     ) -> Generator[ChatMessageType, None, None]:
         import random
         import threading
@@ -206,9 +463,10 @@ class LLMApi(object):
 
         recv_start = time.time()
         buffer_message: Optional[ChatMessageType] = None
-        buffer_content: str = ""
+        buffer_content = StringBuilder()
         finished = False
         llm_thread_interrupt: bool = False
+        llm_cancellation = CancellationToken()
         llm_source_failed: bool = False
         llm_source_error: Optional[Exception] = None
 
@@ -223,11 +481,11 @@ class LLMApi(object):
             return min(max(speed, 5), 600)
 
         def base_stream_puller():
-            nonlocal buffer_message, buffer_content, finished, cur_base_speed
+            nonlocal buffer_message, finished, cur_base_speed
             nonlocal llm_source_failed, llm_source_error, llm_thread_interrupt
             stream: Optional[Generator[ChatMessageType, None, None]] = None
             try:
-                stream = stream_init()
+                stream = cancellable_stream(stream_init, llm_cancellation, stats, count_tokens)
 
                 for msg in stream:
                     if llm_thread_interrupt:
@@ -239,7 +497,7 @@ class LLMApi(object):
 
                     with update_lock:
                         buffer_message = msg
-                        buffer_content += msg["content"]
+                        buffer_content.append(msg["content"])
                         cur_time = time.time()
 
                         new_speed = min(
@@ -271,7 +529,8 @@ class LLMApi(object):
         thread = threading.Thread(target=base_stream_puller)
         thread.start()
 
-        sent_content: str = ""
+        # the length of the content sent, read from the buffer by substring rather than copied
+        sent_size: int = 0
         sent_start: float = time.time()
         next_update_time = time.time()
         cur_update_speed = cur_base_speed
@@ -284,12 +543,10 @@ class LLMApi(object):
                         raise llm_source_error  # type:ignore
                     else:
                         raise Exception("calling LLM failed")
-                if finished and len(buffer_content) - len(sent_content) < min_chunk_size * 5:
-                    if buffer_message is not None and len(sent_content) < len(
-                        buffer_content,
-                    ):
-                        new_pack = buffer_content[len(sent_content) :]
-                        sent_content += new_pack
+                if finished and len(buffer_content) - sent_size < min_chunk_size * 5:
+                    if buffer_message is not None and sent_size < len(buffer_content):
+                        new_pack = buffer_content.substring(sent_size)
+                        sent_size += len(new_pack)
                         yield format_chat_message(
                             role=buffer_message["role"],
                             message=new_pack,
@@ -307,10 +564,10 @@ class LLMApi(object):
                 with update_lock:
                     cur_buf_message = buffer_message
                     total_len = len(buffer_content)
-                    sent_len = len(sent_content)
+                    sent_len = sent_size
                     rem_len = total_len - sent_len
 
-                if cur_buf_message is None or len(buffer_content) - len(sent_content) < min_chunk_size:
+                if cur_buf_message is None or len(buffer_content) - sent_size < min_chunk_size:
                     # wait for more buffer
                     with update_cond:
                         update_cond.wait(min_sleep_interval)
@@ -350,8 +607,8 @@ class LLMApi(object):
 
                 chunk_time = chunk_time_target / non_zero(new_pack_size_target) * new_pack_size
 
-                new_pack = buffer_content[sent_len : (sent_len + new_pack_size)]
-                sent_content += new_pack
+                new_pack = buffer_content.substring(sent_len, sent_len + new_pack_size)
+                sent_size += len(new_pack)
 
                 yield format_chat_message(
                     role=cur_buf_message["role"],
@@ -364,8 +621,9 @@ class LLMApi(object):
                     update_cond.wait(min(min_sleep_interval, chunk_time))
         finally:
             # when the exception is from drainer side (such as client side generator close)
-            # mark the label to interrupt the execution thread
+            # mark the label to interrupt the execution thread and close the upstream response
             llm_thread_interrupt = True
+            llm_cancellation.cancel()
 
             if thread.is_alive():
                 try:
@@ -374,8 +632,67 @@ class LLMApi(object):
                 except Exception:
                     pass
 
+    def get_tokenizer(self, llm_alias: Optional[str] = None) -> Tokenizer:
+        """Get the tokenizer of the primary LLM or of the extra LLM with the given alias."""
+        if llm_alias is not None and llm_alias != "":
+            model = self.ext_llm_models.get(llm_alias, self.config.model)
+        else:
+            model = self.config.model
+        return get_tokenizer(model, self.tokenizer_config.type, self.tokenizer_config.encoding)
+
+    def _get_completion_request_key(
+        self,
+        llm_alias: Optional[str],
+        messages: List[ChatMessageType],
+        stream: bool,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        top_p: Optional[float],
+        stop: Optional[List[str]],
+        kwargs: Dict[str, Any],
+    ) -> str:
+        alias = llm_alias if llm_alias is not None else ""
+        return make_request_key(
+            llm=self.llm_identities.get(alias, alias),
+            messages=messages,
+            stream=stream,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stop=stop,
+            kwargs=kwargs,
+        )
+
     def get_embedding(self, string: str) -> List[float]:
-        return self.embedding_service.get_embeddings([string])[0]
+        return self.get_embedding_list([string])[0]
 
     def get_embedding_list(self, strings: List[str]) -> List[List[float]]:
-        return self.embedding_service.get_embeddings(strings)
+        if not self.single_flight_config.embedding:
+            return self.embedding_service.get_embeddings(strings)
+        # identical embedding requests in this process share one upstream call
+        return embedding_flights.do(
+            make_request_key(
+                embedding_api_type=self.config.embedding_api_type,
+                embedding_model=self.config.embedding_model,
+                use_mock=self.config.use_mock,
+                strings=strings,
+            ),
+            lambda: self.embedding_service.get_embeddings(strings),
+            cache_size=self.single_flight_config.embedding_cache_size,
+        )
+
+    def get_single_flight_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the numbers of upstream calls and of calls saved by request coalescing in this process."""
+        return get_single_flight_stats()
+
+    def get_usage_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get the token usage of every LLM alias in this process, in total and per role."""
+        return get_usage_stats()
+
+    def get_routing_stats(self) -> Dict[str, Any]:
+        """Get the routing decisions by LLM alias and reason, and the recent success rate and latency of each LLM."""
+        return llm_router.get_stats()
+
+    def get_cancellation_stats(self, llm_alias: Optional[str] = None) -> Dict[str, float]:
+        """Get the numbers of completed and cancelled streams of the LLM, and the estimated savings of cancelling."""
+        return get_cancellation_stats(llm_alias if llm_alias is not None else "").get_stats()
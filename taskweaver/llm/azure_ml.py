@@ -4,6 +4,7 @@ import requests
 from injector import inject
 
 from taskweaver.llm.base import CompletionService, LLMServiceConfig
+from taskweaver.llm.resilience import LLMRateLimitError, LLMServerError, parse_retry_after
 from taskweaver.llm.util import ChatMessageType, format_chat_message
 
 
@@ -81,6 +82,16 @@ class AzureMLService(CompletionService):
                 headers=headers,
                 json=data,
             ) as response:
+                if response.status_code == 429:
+                    raise LLMRateLimitError(
+                        f"status code {response.status_code}: {response.text}",
+                        retry_after=parse_retry_after(response.headers),
+                    )
+                if response.status_code in [502, 503, 504]:
+                    raise LLMServerError(
+                        f"status code {response.status_code}: {response.text}",
+                        retry_after=parse_retry_after(response.headers),
+                    )
                 if response.status_code != 200:
                     raise Exception(
                         f"status code {response.status_code}: {response.text}",
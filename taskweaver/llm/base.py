@@ -1,5 +1,5 @@
 import abc
-from typing import Any, Generator, List, Optional
+from typing import Any, Dict, Generator, List, Optional
 
 from injector import inject
 
@@ -8,6 +8,19 @@ from taskweaver.config.module_config import ModuleConfig
 from taskweaver.llm.util import ChatMessageType
 
 
+def override_config(src: AppConfigSource, overrides: Dict[str, Any]) -> AppConfigSource:
+    """Clone the config source and override it with the given config values."""
+    config = src.clone()
+    for k, v in overrides.items():
+        config.set_config_value(
+            var_name=k,
+            var_type="str",
+            value=v,
+            source="override",
+        )
+    return config
+
+
 class ExtLLMModuleConfig(ModuleConfig):
     def _configure(self) -> None:
         self._set_name("ext_llms")
@@ -16,15 +29,14 @@ class ExtLLMModuleConfig(ModuleConfig):
         self.ext_llm_config_mapping = {}
 
         for key, config_dict in self.ext_llm_config_dicts.items():
-            config = self.src.clone()
-            for k, v in config_dict.items():
-                config.set_config_value(
-                    var_name=k,
-                    var_type="str",
-                    value=v,
-                    source="override",
-                )  # override the LLM config from extra llms
-            self.ext_llm_config_mapping[key] = config
+            if isinstance(config_dict, list):
+                # a list of configs makes a pool of endpoints serving the same alias
+                config_dict = {"llm.pool.endpoints": config_dict}
+            # the pool and the backup model of the primary LLM are not inherited by the extra LLMs
+            overrides: Dict[str, Any] = {"llm.pool.endpoints": [], "llm.backup_model": ""}
+            overrides.update(config_dict)
+            # override the LLM config from extra llms
+            self.ext_llm_config_mapping[key] = override_config(self.src, overrides)
 
 
 class LLMModuleConfig(ModuleConfig):
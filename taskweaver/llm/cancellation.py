@@ -0,0 +1,193 @@
+import threading
+import time
+import types
+from contextlib import contextmanager
+from typing import Callable, Dict, Generator, List, Optional
+
+from taskweaver.llm.util import ChatMessageType
+from taskweaver.utils import StringBuilder
+
+
+class CancellationToken:
+    """
+    A thread-safe token cancelling an LLM stream.
+    The completion services register the callbacks closing their HTTP responses with `on_cancel`,
+    so that cancelling the token from another thread unblocks a pending read immediately.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """Register a callback run when the token is cancelled, or immediately if it is already cancelled."""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        self._run(callback)
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run(callback)
+
+    def release(self) -> None:
+        """Drop the registered callbacks once the stream has completed."""
+        with self._lock:
+            self._callbacks = []
+
+    @staticmethod
+    def _run(callback: Callable[[], None]) -> None:
+        try:
+            callback()
+        except Exception:
+            pass
+
+
+_local = threading.local()
+
+
+@contextmanager
+def cancellation_scope(token: CancellationToken):
+    """Bind the token to the current thread, so that the streams opened in the scope register with it."""
+    if not hasattr(_local, "tokens"):
+        _local.tokens = []
+    _local.tokens.append(token)
+    try:
+        yield token
+    finally:
+        _local.tokens.pop()
+
+
+def current_token() -> Optional[CancellationToken]:
+    tokens = getattr(_local, "tokens", None)
+    return tokens[-1] if tokens else None
+
+
+def on_cancel(callback: Callable[[], None]) -> None:
+    """Register a callback with the token bound to the current thread, if any."""
+    token = current_token()
+    if token is not None:
+        token.on_cancel(callback)
+
+
+def is_cancelled() -> bool:
+    token = current_token()
+    return token is not None and token.cancelled
+
+
+class CancellationStats:
+    """
+    A thread-safe record of the completed and cancelled streams of an LLM.
+    The tokens saved by the cancellations are estimated from the average length of the completed streams.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completed_streams = 0
+        self.completed_tokens = 0
+        self.completed_seconds = 0.0
+        self.cancelled_streams = 0
+        self.cancelled_tokens = 0
+        self.cancelled_seconds = 0.0
+
+    def record(self, tokens: int, duration: float, cancelled: bool) -> None:
+        with self._lock:
+            if cancelled:
+                self.cancelled_streams += 1
+                self.cancelled_tokens += tokens
+                self.cancelled_seconds += duration
+            else:
+                self.completed_streams += 1
+                self.completed_tokens += tokens
+                self.completed_seconds += duration
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            saved_tokens = 0.0
+            saved_seconds = 0.0
+            if self.completed_streams > 0:
+                average_tokens = self.completed_tokens / self.completed_streams
+                average_seconds = self.completed_seconds / self.completed_streams
+                saved_tokens = max(0.0, average_tokens * self.cancelled_streams - self.cancelled_tokens)
+                saved_seconds = max(0.0, average_seconds * self.cancelled_streams - self.cancelled_seconds)
+            return {
+                "completed_streams": self.completed_streams,
+                "completed_tokens": self.completed_tokens,
+                "cancelled_streams": self.cancelled_streams,
+                "cancelled_tokens": self.cancelled_tokens,
+                "estimated_saved_tokens": round(saved_tokens),
+                "estimated_saved_seconds": round(saved_seconds, 3),
+            }
+
+
+_registry_lock = threading.Lock()
+_cancellation_stats: Dict[str, CancellationStats] = {}
+
+
+def get_cancellation_stats(llm_alias: str) -> CancellationStats:
+    """Get the cancellation stats of the LLM alias, which are shared in this process."""
+    with _registry_lock:
+        if llm_alias not in _cancellation_stats:
+            _cancellation_stats[llm_alias] = CancellationStats()
+        return _cancellation_stats[llm_alias]
+
+
+def cancellable_stream(
+    stream_init: Callable[[], Generator[ChatMessageType, None, None]],
+    token: Optional[CancellationToken] = None,
+    stats: Optional[CancellationStats] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+) -> Generator[ChatMessageType, None, None]:
+    """
+    Stream from `stream_init` with the token bound while the upstream stream runs.
+    Closing this generator before the upstream stream ends cancels the token, which closes the HTTP response,
+    and cancelling the token from another thread interrupts the upstream stream, even while it waits for a chunk.
+    """
+    token = token if token is not None else CancellationToken()
+    start_time = time.time()
+    content = StringBuilder()
+    completed = False
+    failed = False
+    stream: Optional[Generator[ChatMessageType, None, None]] = None
+    try:
+        with cancellation_scope(token):
+            stream = stream_init()
+        while not token.cancelled:
+            with cancellation_scope(token):
+                try:
+                    chunk = next(stream)
+                except StopIteration:
+                    completed = True
+                    return
+            content.append(chunk["content"])
+            yield chunk
+    except Exception:
+        if token.cancelled:
+            # the upstream stream fails once its response is closed
+            return
+        failed = True
+        raise
+    finally:
+        if completed:
+            token.release()
+        else:
+            token.cancel()
+        if stream is not None and isinstance(stream, types.GeneratorType):
+            try:
+                stream.close()
+            except Exception:
+                pass
+        if stats is not None and not failed:
+            tokens = count_tokens(str(content)) if count_tokens is not None else len(content)
+            stats.record(tokens, time.time() - start_time, cancelled=not completed)
@@ -0,0 +1,206 @@
+"""
+A local embedding server holding one SentenceTransformer model for all the processes on the host.
+
+Start it with `python -m taskweaver.llm.embedding_server --model all-mpnet-base-v2 --port 8765` and set
+`llm.sentence_transformers.server_url` to `http://127.0.0.1:8765`. Concurrent requests from all callers are
+micro-batched into a single `encode` call.
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, List, Optional
+
+EncodeFunction = Callable[[List[str]], List[List[float]]]
+
+
+class _EmbeddingRequest:
+    def __init__(self, inputs: List[str]):
+        self.inputs = inputs
+        self.done = threading.Event()
+        self.result: Optional[List[List[float]]] = None
+        self.error: Optional[Exception] = None
+
+
+class MicroBatcher:
+    """
+    MicroBatcher merges the requests submitted within `batch_window` seconds, up to `max_batch_size` inputs,
+    into one call of `encode`, and splits the embeddings back to the requests.
+    """
+
+    def __init__(
+        self,
+        encode: EncodeFunction,
+        batch_window: float = 0.01,
+        max_batch_size: int = 64,
+    ):
+        self.encode = encode
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._requests: "queue.Queue[_EmbeddingRequest]" = queue.Queue()
+        self.batch_count = 0
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, inputs: List[str]) -> List[List[float]]:
+        if len(inputs) == 0:
+            return []
+        request = _EmbeddingRequest(inputs)
+        self._requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        assert request.result is not None
+        return request.result
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._requests.get()]
+            input_count = len(batch[0].inputs)
+            deadline = time.time() + self.batch_window
+            while input_count < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                input_count += len(request.inputs)
+
+            try:
+                embeddings = self.encode([s for request in batch for s in request.inputs])
+                self.batch_count += 1
+                offset = 0
+                for request in batch:
+                    request.result = embeddings[offset : offset + len(request.inputs)]
+                    offset += len(request.inputs)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finally:
+                for request in batch:
+                    request.done.set()
+
+
+class EmbeddingServer:
+    """An HTTP server on localhost serving the embeddings of one model through a MicroBatcher."""
+
+    def __init__(
+        self,
+        model: str,
+        encode: EncodeFunction,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        batch_window: float = 0.01,
+        max_batch_size: int = 64,
+    ):
+        self.model = model
+        self.batcher = MicroBatcher(encode, batch_window, max_batch_size)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def _reply(self, status: int, body: Any) -> None:
+                content = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self) -> None:
+                if self.path == "/health":
+                    self._reply(200, {"model": server.model})
+                else:
+                    self._reply(404, {"error": f"unknown path {self.path}"})
+
+            def do_POST(self) -> None:
+                if self.path != "/embed":
+                    self._reply(404, {"error": f"unknown path {self.path}"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    request = json.loads(self.rfile.read(length))
+                    inputs = request["inputs"]
+                    assert isinstance(inputs, list) and all(isinstance(s, str) for s in inputs), "invalid inputs"
+                except Exception as e:
+                    self._reply(400, {"error": f"invalid request: {e}"})
+                    return
+                if request.get("model", server.model) != server.model:
+                    self._reply(400, {"error": f"the server serves model {server.model}, not {request['model']}"})
+                    return
+                try:
+                    self._reply(200, {"embeddings": server.batcher.submit(inputs)})
+                except Exception as e:
+                    self._reply(500, {"error": str(e)})
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self) -> None:
+        self.httpd.serve_forever()
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def load_sentence_transformer(model: str, num_threads: int = 0, batch_size: int = 64) -> EncodeFunction:
+    """Load the SentenceTransformer model, using `num_threads` intra-op threads (all cores if 0)."""
+    try:
+        import torch
+        from sentence_transformers import SentenceTransformer  # type: ignore
+    except Exception:
+        raise Exception(
+            "Package sentence_transformers is required for using embedding. "
+            "Please install it using pip install sentence_transformers",
+        )
+
+    torch.set_num_threads(num_threads if num_threads > 0 else (os.cpu_count() or 1))
+    embedding_model: Any = SentenceTransformer(model)
+
+    def encode(strings: List[str]) -> List[List[float]]:
+        return embedding_model.encode(strings, batch_size=batch_size).tolist()
+
+    return encode
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the embeddings of a SentenceTransformer model.")
+    parser.add_argument("--model", type=str, default="all-mpnet-base-v2", help="The embedding model.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="The host to listen on.")
+    parser.add_argument("--port", type=int, default=8765, help="The port to listen on.")
+    parser.add_argument("--batch_window", type=float, default=0.01, help="The seconds to wait to fill a batch.")
+    parser.add_argument("--max_batch_size", type=int, default=64, help="The maximum number of inputs in a batch.")
+    parser.add_argument("--num_threads", type=int, default=0, help="The intra-op threads, 0 for all cores.")
+    args = parser.parse_args()
+
+    server = EmbeddingServer(
+        args.model,
+        load_sentence_transformer(args.model, args.num_threads, args.max_batch_size),
+        host=args.host,
+        port=args.port,
+        batch_window=args.batch_window,
+        max_batch_size=args.max_batch_size,
+    )
+    print(f"Embedding server of {args.model} is listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
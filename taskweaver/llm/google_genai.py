@@ -3,6 +3,8 @@ from typing import Any, Generator, List, Optional
 from injector import inject
 
 from taskweaver.llm.base import CompletionService, EmbeddingService, LLMServiceConfig
+from taskweaver.llm.cancellation import on_cancel
+from taskweaver.llm.usage import report_usage
 from taskweaver.llm.util import ChatMessageType, format_chat_message
 
 
@@ -147,11 +149,39 @@ class GoogleGenAIService(CompletionService, EmbeddingService):
 
         if stream is False:
             response: GenerateContentResponse = self.model.generate_content(genai_messages, stream=False)
+            self._report_usage(response)
             yield format_chat_message("assistant", response.text)
         else:
             response: GenerateContentResponse = self.model.generate_content(genai_messages, stream=True)
+            # cancel the streaming call, and stop the generation, as soon as the stream is cancelled
+            on_cancel(lambda: self._cancel_stream(response))
             for chunk_obj in response:
                 yield format_chat_message("assistant", chunk_obj.text)
+            # the usage metadata of a stream is aggregated once it is resolved
+            self._report_usage(response)
+
+    @staticmethod
+    def _cancel_stream(response: Any) -> None:
+        # the streaming call is only exposed by the private iterator of the response, which may change in a new
+        # version of the package, so the response is closed instead if the iterator cannot be cancelled
+        cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+        if callable(cancel):
+            cancel()
+            return
+        close = getattr(response, "close", None)
+        if callable(close):
+            close()
+
+    @staticmethod
+    def _report_usage(response: Any) -> None:
+        usage_metadata = getattr(response, "usage_metadata", None)
+        if usage_metadata is None:
+            return
+        report_usage(
+            usage_metadata.prompt_token_count,
+            usage_metadata.candidates_token_count,
+            getattr(usage_metadata, "cached_content_token_count", 0),
+        )
 
     def get_embeddings(self, strings: List[str]) -> List[List[float]]:
         genai = self.import_genai_module()
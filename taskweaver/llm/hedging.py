@@ -0,0 +1,210 @@
+import queue
+import threading
+import time
+import types
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Generator, List, Optional, Tuple
+
+from taskweaver.llm.base import LLMServiceConfig
+from taskweaver.llm.cancellation import CancellationToken, cancellable_stream, current_token
+from taskweaver.llm.usage import current_usage_recorder, usage_recorder_scope
+from taskweaver.llm.util import ChatMessageType
+
+
+class LLMHedgingConfig(LLMServiceConfig):
+    def _configure(self) -> None:
+        self._set_name("hedging")
+
+        self.enabled = self._get_bool("enabled", False)
+        # the alias of the LLM receiving the hedged request, empty means the same LLM as the original request
+        self.alias = self._get_str("alias", "", required=False)
+
+        # a request is hedged if its first chunk has not arrived after this percentile of the first-chunk latencies
+        self.delay_percentile = self._get_float("delay_percentile", 95.0)
+        # the delay used before enough latencies have been observed
+        self.initial_delay = self._get_float("initial_delay", 5.0)
+        self.min_delay = self._get_float("min_delay", 1.0)
+        self.max_delay = self._get_float("max_delay", 30.0)
+        self.min_samples = self._get_int("min_samples", 20)
+
+        # the maximum ratio of hedged requests to all requests in this process
+        self.budget_ratio = self._get_float("budget_ratio", 0.05)
+
+        assert 0 < self.delay_percentile <= 100, "delay_percentile must be in (0, 100]"
+        assert 0 <= self.budget_ratio <= 1, "budget_ratio must be in [0, 1]"
+
+
+class LatencyTracker:
+    """A thread-safe tracker of the recent first-chunk latencies of an LLM."""
+
+    def __init__(self, window_size: int = 200):
+        self._lock = threading.Lock()
+        self._samples: Deque[float] = deque(maxlen=window_size)
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) == 0:
+                return None
+            samples = sorted(self._samples)
+        index = min(len(samples) - 1, max(0, int(round(p / 100 * len(samples))) - 1))
+        return samples[index]
+
+
+class HedgeBudget:
+    """
+    A thread-safe budget bounding the ratio of hedged requests.
+    Each request earns `ratio` credits and each hedged request costs one credit.
+    """
+
+    def __init__(self, ratio: float, max_credits: float = 10.0):
+        self._lock = threading.Lock()
+        self.ratio = ratio
+        self.max_credits = max_credits
+        self.credits = 0.0
+
+    def on_request(self) -> None:
+        with self._lock:
+            self.credits = min(self.max_credits, self.credits + self.ratio)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.credits < 1:
+                return False
+            self.credits -= 1
+            return True
+
+
+_registry_lock = threading.Lock()
+_latency_trackers: Dict[str, LatencyTracker] = {}
+_hedge_budget: Optional[HedgeBudget] = None
+
+
+def get_latency_tracker(llm_alias: str) -> LatencyTracker:
+    """Get the first-chunk latency tracker of the LLM alias, which is shared in this process."""
+    with _registry_lock:
+        if llm_alias not in _latency_trackers:
+            _latency_trackers[llm_alias] = LatencyTracker()
+        return _latency_trackers[llm_alias]
+
+
+def get_hedge_budget(ratio: float) -> HedgeBudget:
+    """Get the hedge budget of this process. The first configured ratio wins."""
+    global _hedge_budget
+    with _registry_lock:
+        if _hedge_budget is None:
+            _hedge_budget = HedgeBudget(ratio)
+        return _hedge_budget
+
+
+def get_hedge_delay(config: LLMHedgingConfig, tracker: LatencyTracker) -> float:
+    delay = tracker.percentile(config.delay_percentile) if len(tracker) >= config.min_samples else None
+    if delay is None:
+        delay = config.initial_delay
+    return min(config.max_delay, max(config.min_delay, delay))
+
+
+def hedged_stream(
+    primary_init: Callable[[], Generator[ChatMessageType, None, None]],
+    secondary_init: Callable[[], Generator[ChatMessageType, None, None]],
+    delay: float,
+    budget: HedgeBudget,
+    trackers: Tuple[LatencyTracker, LatencyTracker],
+) -> Generator[ChatMessageType, None, None]:
+    """
+    Stream from `primary_init`, and if its first chunk does not arrive within `delay` seconds and the budget
+    allows, send a duplicate request with `secondary_init`. The stream whose first chunk arrives first is used
+    and the other one is cancelled, which closes its response immediately.
+    """
+    events: "queue.Queue[Tuple[int, str, Any]]" = queue.Queue()
+    cancelled = [CancellationToken(), CancellationToken()]
+    parent_token = current_token()
+    if parent_token is not None:
+        for token in cancelled:
+            parent_token.on_cancel(token.cancel)
+    # the usage of both requests is reported to the caller, as the cancelled one is billed as well
+    usage_recorder = current_usage_recorder()
+    start_times: List[float] = [0.0, 0.0]
+
+    def pull(index: int, stream_init: Callable[[], Generator[ChatMessageType, None, None]]):
+        stream: Optional[Generator[ChatMessageType, None, None]] = None
+        try:
+            stream = cancellable_stream(stream_init, cancelled[index])
+            while True:
+                with usage_recorder_scope(usage_recorder):
+                    chunk = next(stream, None)
+                if chunk is None:
+                    break
+                events.put((index, "chunk", chunk))
+            if cancelled[index].cancelled:
+                return
+            events.put((index, "end", None))
+        except Exception as e:
+            events.put((index, "error", e))
+        finally:
+            if stream is not None and isinstance(stream, types.GeneratorType):
+                with usage_recorder_scope(usage_recorder):
+                    try:
+                        stream.close()
+                    except Exception:
+                        pass
+
+    def start(index: int, stream_init: Callable[[], Generator[ChatMessageType, None, None]]):
+        start_times[index] = time.time()
+        threading.Thread(target=pull, args=(index, stream_init), daemon=True).start()
+
+    budget.on_request()
+    start(0, primary_init)
+    deadline = start_times[0] + delay
+    started = 1
+    can_hedge = True
+    errors: Dict[int, Exception] = {}
+    winner: Optional[int] = None
+
+    try:
+        # wait for the first chunk of either request
+        while winner is None:
+            timeout = max(0.0, deadline - time.time()) if can_hedge else None
+            try:
+                index, kind, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                can_hedge = False
+                if budget.try_acquire():
+                    start(1, secondary_init)
+                    started = 2
+                continue
+
+            if kind == "error":
+                errors[index] = payload
+                if len(errors) == started:
+                    raise errors[0] if 0 in errors else payload
+                continue
+
+            winner = index
+            cancelled[1 - winner].cancel()
+            trackers[winner].record(time.time() - start_times[winner])
+            if kind == "end":
+                return
+            yield payload
+
+        # forward the rest of the winning stream
+        while True:
+            index, kind, payload = events.get()
+            if index != winner:
+                continue
+            if kind == "chunk":
+                yield payload
+            elif kind == "end":
+                return
+            else:
+                raise payload
+    finally:
+        for token in cancelled:
+            token.cancel()
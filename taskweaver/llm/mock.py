@@ -265,18 +265,25 @@ class MockApiService(CompletionService, EmbeddingService):
             if self.base_completion_service is None:
                 raise LLMMockApiException("base_completion_service is not set")
             new_value = format_chat_message("assistant", "")
-            for chunk in self.base_completion_service.chat_completion(
-                messages,
-                stream,
-                temperature,
-                max_tokens,
-                top_p,
-                stop,
-                **kwargs,
-            ):
-                new_value["role"] = chunk["role"]
-                new_value["content"] += chunk["content"]
-                yield chunk
+            try:
+                for chunk in self.base_completion_service.chat_completion(
+                    messages,
+                    stream,
+                    temperature,
+                    max_tokens,
+                    top_p,
+                    stop,
+                    **kwargs,
+                ):
+                    new_value["role"] = chunk["role"]
+                    new_value["content"] += chunk["content"]
+                    yield chunk
+            except GeneratorExit:
+                # the consumer stopped early (e.g., the translator's early stop), and it would stop
+                # at the same point when the received part is played back
+                if new_value["content"] != "":
+                    self.cache.set_completion(messages, new_value)
+                raise
 
             self.cache.set_completion(messages, new_value)
 
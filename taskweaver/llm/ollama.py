@@ -1,11 +1,21 @@
 import json
+import threading
 from contextlib import contextmanager
-from typing import Any, Generator, List, Optional
+from typing import Any, Dict, Generator, List, Optional
 
 import requests
 from injector import inject
 
 from taskweaver.llm.base import CompletionService, EmbeddingService, LLMServiceConfig
+from taskweaver.llm.cancellation import on_cancel
+from taskweaver.llm.resilience import (
+    LLMConnectionError,
+    LLMRateLimitError,
+    LLMServerError,
+    LLMTimeoutError,
+    parse_retry_after,
+)
+from taskweaver.llm.usage import report_usage
 from taskweaver.llm.util import ChatMessageType, format_chat_message
 
 
@@ -44,11 +54,23 @@ class OllamaServiceConfig(LLMServiceConfig):
         if self.response_format == "json_object":
             self.response_format = "json"
 
+        # how long the models stay loaded after a request, e.g., "30m", or -1 to keep them loaded
+        self.keep_alive = self._get_str("keep_alive", "30m", required=False)
+        # the completion API, `auto` detects whether the server supports `/api/chat` on the first request
+        self.api_mode = self._get_enum("api_mode", options=["auto", "chat", "generate"], default="auto")
+        self.embedding_batch_size = self._get_int("embedding_batch_size", 128)
+        self.timeout = self._get_float("timeout", 600.0)
+
 
 class OllamaService(CompletionService, EmbeddingService):
     @inject
     def __init__(self, config: OllamaServiceConfig):
         self.config = config
+        # the connections to the server are reused across requests
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._api_mode: Optional[str] = None if self.config.api_mode == "auto" else self.config.api_mode
+        self._batch_embedding: Optional[bool] = None
 
     def chat_completion(
         self,
@@ -60,46 +82,35 @@ class OllamaService(CompletionService, EmbeddingService):
         stop: Optional[List[str]] = None,
         **kwargs: Any,
     ) -> Generator[ChatMessageType, None, None]:
-        try:
-            return self._chat_completion(
-                messages=messages,
-                stream=stream,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p,
-                stop=stop,
-                **kwargs,
-            )
-        except Exception:
-            return self._completion(
-                messages=messages,
-                stream=stream,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p,
-                stop=stop,
-                **kwargs,
-            )
-
-    def _chat_completion(
-        self,
-        messages: List[ChatMessageType],
-        stream: bool = True,
-        temperature: Optional[float] = None,
-        max_tokens: Optional[int] = None,
-        top_p: Optional[float] = None,
-        stop: Optional[List[str]] = None,
-        **kwargs: Any,
-    ) -> Generator[ChatMessageType, None, None]:
-        api_endpoint = "/api/chat"
-        payload = {
-            "model": self.config.model,
-            "messages": messages,
-            "stream": stream,
-        }
+        if self._get_api_mode() == "chat":
+            api_endpoint = "/api/chat"
+            payload: Dict[str, Any] = {"model": self.config.model, "messages": messages}
+        else:
+            api_endpoint = "/api/generate"
+            payload = {"model": self.config.model, "prompt": ""}
+            for message in messages:
+                content: str = message["content"]
+                if message["role"] == "system":
+                    payload["system"] = f"{payload['system']}\n{content}" if "system" in payload else content
+                else:
+                    payload["prompt"] = f"{payload['prompt']}\n{content}"
 
+        payload["stream"] = stream
         if self.config.response_format == "json":
             payload["format"] = "json"
+        if self.config.keep_alive not in [None, ""]:
+            payload["keep_alive"] = self._get_keep_alive()
+        options: Dict[str, Any] = {}
+        if temperature is not None:
+            options["temperature"] = temperature
+        if max_tokens is not None:
+            options["num_predict"] = max_tokens
+        if top_p is not None:
+            options["top_p"] = top_p
+        if stop is not None:
+            options["stop"] = stop
+        if len(options) > 0:
+            payload["options"] = options
 
         if stream is False:
             with self._request_api(api_endpoint, payload) as resp:
@@ -107,8 +118,10 @@ class OllamaService(CompletionService, EmbeddingService):
                     raise Exception(
                         f"Failed to get completion with error code {resp.status_code}: {resp.text}",
                     )
-                response: str = resp.json()["response"]
-            yield format_chat_message("assistant", response)
+                response_obj = resp.json()
+            self._report_usage(response_obj)
+            yield format_chat_message("assistant", self._get_content(response_obj))
+            return
 
         with self._request_api(api_endpoint, payload, stream=True) as resp:
             if resp.status_code != 200:
@@ -117,65 +130,81 @@ class OllamaService(CompletionService, EmbeddingService):
                 )
             for chunk_obj in self._stream_process(resp):
                 if "error" in chunk_obj:
-                    raise Exception(
+                    # the server reports the failures after the response has started, e.g., a crashed model runner
+                    raise LLMServerError(
                         f"Failed to get completion with error: {chunk_obj['error']}",
                     )
-                if "message" in chunk_obj:
-                    message = chunk_obj["message"]
-                    yield format_chat_message("assistant", message["content"])
+                if chunk_obj.get("done", False):
+                    self._report_usage(chunk_obj)
+                content = self._get_content(chunk_obj)
+                if content != "":
+                    yield format_chat_message("assistant", content)
 
-    def _completion(
-        self,
-        messages: List[ChatMessageType],
-        stream: bool = True,
-        temperature: Optional[float] = None,
-        max_tokens: Optional[int] = None,
-        top_p: Optional[float] = None,
-        stop: Optional[List[str]] = None,
-        **kwargs: Any,
-    ) -> Generator[ChatMessageType, None, None]:
-        api_endpoint = "/api/generate"
-        payload = {
-            "model": self.config.model,
-            "prompt": "",
-            "stream": stream,
-        }
+    def get_embeddings(self, strings: List[str]) -> List[List[float]]:
+        if not self._supports_batch_embedding():
+            return [self._get_embedding(string) for string in strings]
+        embeddings: List[List[float]] = []
+        batch_size = max(1, self.config.embedding_batch_size)
+        for i in range(0, len(strings), batch_size):
+            embeddings.extend(self._get_batch_embeddings(strings[i : i + batch_size]))
+        return embeddings
 
-        if self.config.response_format == "json":
-            payload["format"] = "json"
+    def _get_api_mode(self) -> str:
+        """
+        Detect once whether the server supports `/api/chat`, which older servers do not have.
+        The probe sends no message, which only loads the model, so that the first completion does not wait for it.
+        """
+        if self._api_mode is not None:
+            return self._api_mode
+        # the probe is sent out of the lock, which is not held by the other requests while the model is loaded
+        payload: Dict[str, Any] = {"model": self.config.model, "messages": []}
+        if self.config.keep_alive not in [None, ""]:
+            payload["keep_alive"] = self._get_keep_alive()
+        with self._request_api("/api/chat", payload) as resp:
+            api_mode = "generate" if self._is_unknown_endpoint(resp) else "chat"
+        with self._lock:
+            if self._api_mode is None:
+                self._api_mode = api_mode
+            return self._api_mode
 
-        for message in messages:
-            content: str = message["content"]
-            if message["role"] == "system":
-                payload["system"] = content
-            else:
-                payload["prompt"] = f"{payload['prompt']}\n{content}"
+    def _supports_batch_embedding(self) -> bool:
+        if self._batch_embedding is not None:
+            return self._batch_embedding
+        with self._request_api("/api/embed", {"model": self.config.embedding_model, "input": []}) as resp:
+            batch_embedding = not self._is_unknown_endpoint(resp)
+        with self._lock:
+            if self._batch_embedding is None:
+                self._batch_embedding = batch_embedding
+            return self._batch_embedding
 
-        if stream is False:
-            with self._request_api(api_endpoint, payload) as resp:
-                if resp.status_code != 200:
-                    raise Exception(
-                        f"Failed to get completion with error code {resp.status_code}: {resp.text}",
-                    )
-                response: str = resp.json()["response"]
-            yield format_chat_message("assistant", response)
+    @staticmethod
+    def _is_unknown_endpoint(resp: requests.Response) -> bool:
+        # an unknown endpoint is a plain text 404, while an unknown model is a 404 with a JSON error
+        if resp.status_code != 404:
+            return False
+        try:
+            return "error" not in resp.json()
+        except ValueError:
+            return True
 
-        with self._request_api(api_endpoint, payload, stream=True) as resp:
-            if resp.status_code != 200:
-                raise Exception(
-                    f"Failed to get completion with error code {resp.status_code}: {resp.text}",
-                )
-            for chunk_obj in self._stream_process(resp):
-                if "error" in chunk_obj:
-                    raise Exception(
-                        f"Failed to get completion with error: {chunk_obj['error']}",
-                    )
-                if "response" in chunk_obj:
-                    response = chunk_obj["response"]
-                    yield format_chat_message("assistant", response)
+    def _get_keep_alive(self) -> Any:
+        # a duration without unit is a number of seconds, which the server only accepts as a number
+        try:
+            return int(self.config.keep_alive)
+        except ValueError:
+            return self.config.keep_alive
 
-    def get_embeddings(self, strings: List[str]) -> List[List[float]]:
-        return [self._get_embedding(string) for string in strings]
+    @staticmethod
+    def _get_content(response_obj: Dict[str, Any]) -> str:
+        if "message" in response_obj:
+            return response_obj["message"].get("content", "")
+        return response_obj.get("response", "")
+
+    @staticmethod
+    def _report_usage(response_obj: Any) -> None:
+        # the token counts are only in the final response, and prompt_eval_count is omitted on a prompt cache hit
+        if "eval_count" in response_obj:
+            report_usage(response_obj.get("prompt_eval_count", 0), response_obj["eval_count"])
 
     def _stream_process(self, resp: requests.Response) -> Generator[Any, None, None]:
         for line in resp.iter_lines():
@@ -183,8 +212,22 @@ class OllamaService(CompletionService, EmbeddingService):
             if line_str and line_str.strip() != "":
                 yield json.loads(line_str)
 
+    def _get_batch_embeddings(self, strings: List[str]) -> List[List[float]]:
+        payload: Dict[str, Any] = {"model": self.config.embedding_model, "input": strings}
+        if self.config.keep_alive not in [None, ""]:
+            payload["keep_alive"] = self._get_keep_alive()
+
+        with self._request_api("/api/embed", payload) as resp:
+            if resp.status_code != 200:
+                raise Exception(
+                    f"Failed to get embedding with error code {resp.status_code}: {resp.text}",
+                )
+            return resp.json()["embeddings"]
+
     def _get_embedding(self, string: str) -> List[float]:
-        payload = {"model": self.config.embedding_model, "prompt": string}
+        payload: Dict[str, Any] = {"model": self.config.embedding_model, "prompt": string}
+        if self.config.keep_alive not in [None, ""]:
+            payload["keep_alive"] = self._get_keep_alive()
 
         with self._request_api("/api/embeddings", payload) as resp:
             if resp.status_code != 200:
@@ -196,6 +239,25 @@ class OllamaService(CompletionService, EmbeddingService):
     @contextmanager
     def _request_api(self, api_path: str, payload: Any, stream: bool = False):
         url = f"{self.config.api_base}{api_path}"
-        with requests.Session() as session:
-            with session.post(url, json=payload, stream=stream) as resp:
-                yield resp
+        try:
+            post_ctx = self.session.post(url, json=payload, stream=stream, timeout=self.config.timeout)
+        except requests.exceptions.Timeout as e:
+            raise LLMTimeoutError(f"Ollama API request timed out: {e}")
+        except requests.exceptions.ConnectionError as e:
+            raise LLMConnectionError(f"Ollama API request failed to connect: {e}")
+        with post_ctx as resp:
+            if stream:
+                # close the HTTP response, and stop the generation, as soon as the stream is cancelled
+                on_cancel(resp.close)
+            if resp.status_code == 429:
+                raise LLMRateLimitError(
+                    f"Ollama API request exceeded rate limit: {resp.text}",
+                    retry_after=parse_retry_after(resp.headers),
+                )
+            # the server errors are retried or failed over, while the client errors, e.g., an unknown model, are not
+            if resp.status_code >= 500:
+                raise LLMServerError(
+                    f"Ollama API request failed with error code {resp.status_code}: {resp.text}",
+                    retry_after=parse_retry_after(resp.headers),
+                )
+            yield resp
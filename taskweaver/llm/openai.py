@@ -1,10 +1,22 @@
 import os
-from typing import Any, Generator, List, Optional
+from typing import Any, Dict, Generator, List, Optional
 
 import openai
 from injector import inject
 from openai import AzureOpenAI, OpenAI
 
+from taskweaver.llm.cancellation import on_cancel
+from taskweaver.llm.resilience import (
+    LLMConnectionError,
+    LLMRateLimitError,
+    LLMResilienceConfig,
+    LLMServerError,
+    LLMTimeoutError,
+    endpoint_key,
+    observe_rate_limit_headers,
+    parse_retry_after,
+)
+from taskweaver.llm.usage import report_usage
 from taskweaver.llm.util import ChatMessageType, format_chat_message
 
 from .base import CompletionService, EmbeddingService, LLMServiceConfig
@@ -101,29 +113,37 @@ class OpenAIServiceConfig(LLMServiceConfig):
         self.frequency_penalty = self._get_float("frequency_penalty", 0)
         self.presence_penalty = self._get_float("presence_penalty", 0)
         self.seed = self._get_int("seed", 123456)
+        # ask for the token usage in the last chunk of a stream, which not every OpenAI compatible endpoint supports
+        self.stream_usage = self._get_bool("stream_usage", self.api_type == "openai")
 
 
 class OpenAIService(CompletionService, EmbeddingService):
     @inject
-    def __init__(self, config: OpenAIServiceConfig):
+    def __init__(self, config: OpenAIServiceConfig, resilience_config: LLMResilienceConfig):
         self.config = config
 
         api_type = self.config.api_type
 
         assert api_type in ["openai", "azure", "azure_ad"], "Invalid API type"
 
+        # the retries of the client would bypass the rate limiter and the retry budget of the resilience layer,
+        # and retry the same endpoint when a pool should fail over to another one
+        client_kwargs: Dict[str, Any] = {"max_retries": 0} if resilience_config.enabled else {}
         self.client: OpenAI = (
             OpenAI(
                 base_url=self.config.api_base,
                 api_key=self.config.api_key,
+                **client_kwargs,
             )
             if api_type == "openai"
             else AzureOpenAI(
                 api_version=self.config.api_version,
                 azure_endpoint=self.config.api_base,
                 api_key=(self.config.api_key if api_type == "azure" else self._get_aad_token()),
+                **client_kwargs,
             )
         )
+        self.endpoint = endpoint_key(self.config.api_base, self.config.model)
 
     def chat_completion(
         self,
@@ -155,8 +175,10 @@ class OpenAIService(CompletionService, EmbeddingService):
                 response_format = {"type": "json_object"}
             else:
                 response_format = None
+            # passed in the body, as older clients do not have the `stream_options` argument
+            extra_body = {"stream_options": {"include_usage": True}} if stream and self.config.stream_usage else None
 
-            res: Any = self.client.chat.completions.create(
+            raw_res: Any = self.client.chat.completions.with_raw_response.create(
                 model=engine,
                 messages=messages,  # type: ignore
                 temperature=temperature,
@@ -168,23 +190,35 @@ class OpenAIService(CompletionService, EmbeddingService):
                 stream=stream,
                 seed=seed,
                 response_format=response_format,
+                extra_body=extra_body,
                 **tools_kwargs,
             )
+            observe_rate_limit_headers(self.endpoint, raw_res.headers)
+            res: Any = raw_res.parse()
             if stream:
+                # close the HTTP response, and stop the generation, as soon as the stream is cancelled
+                on_cancel(res.close)
                 role: Any = None
-                for stream_res in res:
-                    if not stream_res.choices:
-                        continue
-                    delta = stream_res.choices[0].delta
-                    if delta is None:
-                        continue
-
-                    role = delta.role if delta.role is not None else role
-                    content = delta.content if delta.content is not None else ""
-                    if content is None:
-                        continue
-                    yield format_chat_message(role, content)
+                try:
+                    for stream_res in res:
+                        if getattr(stream_res, "usage", None) is not None:
+                            self._report_usage(stream_res.usage)
+                        if not stream_res.choices:
+                            continue
+                        delta = stream_res.choices[0].delta
+                        if delta is None:
+                            continue
+
+                        role = delta.role if delta.role is not None else role
+                        content = delta.content if delta.content is not None else ""
+                        if content is None:
+                            continue
+                        yield format_chat_message(role, content)
+                finally:
+                    res.close()
             else:
+                if res.usage is not None:
+                    self._report_usage(res.usage)
                 oai_response = res.choices[0].message
                 if oai_response is None:
                     raise Exception("OpenAI API returned an empty response")
@@ -208,11 +242,11 @@ class OpenAIService(CompletionService, EmbeddingService):
                 yield response
 
         except openai.APITimeoutError as e:
-            # Handle timeout error, e.g. retry or log
-            raise Exception(f"OpenAI API request timed out: {e}")
+            # Handle timeout error, retried by the resilience layer
+            raise LLMTimeoutError(f"OpenAI API request timed out: {e}")
         except openai.APIConnectionError as e:
-            # Handle connection error, e.g. check network or log
-            raise Exception(f"OpenAI API request failed to connect: {e}")
+            # Handle connection error, retried by the resilience layer
+            raise LLMConnectionError(f"OpenAI API request failed to connect: {e}")
         except openai.BadRequestError as e:
             # Handle invalid request error, e.g. validate parameters or log
             raise Exception(f"OpenAI API request was invalid: {e}")
@@ -223,12 +257,32 @@ class OpenAIService(CompletionService, EmbeddingService):
             # Handle permission error, e.g. check scope or log
             raise Exception(f"OpenAI API request was not permitted: {e}")
         except openai.RateLimitError as e:
-            # Handle rate limit error, e.g. wait or log
-            raise Exception(f"OpenAI API request exceeded rate limit: {e}")
+            # Handle rate limit error, retried by the resilience layer after the Retry-After period
+            observe_rate_limit_headers(self.endpoint, e.response.headers)
+            raise LLMRateLimitError(
+                f"OpenAI API request exceeded rate limit: {e}",
+                retry_after=parse_retry_after(e.response.headers),
+            )
+        except openai.InternalServerError as e:
+            # Handle server side error, retried by the resilience layer
+            raise LLMServerError(
+                f"OpenAI API returned a server error: {e}",
+                retry_after=parse_retry_after(e.response.headers),
+            )
         except openai.APIError as e:
             # Handle API error, e.g. retry or log
             raise Exception(f"OpenAI API returned an API Error: {e}")
 
+    @staticmethod
+    def _report_usage(usage: Any) -> None:
+        prompt_tokens_details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(prompt_tokens_details, "cached_tokens", None) if prompt_tokens_details else None
+        report_usage(
+            usage.prompt_tokens or 0,
+            usage.completion_tokens or 0,
+            cached_tokens or 0,
+        )
+
     def get_embeddings(self, strings: List[str]) -> List[List[float]]:
         embedding_results = self.client.embeddings.create(
             input=strings,
@@ -0,0 +1,200 @@
+import random
+import threading
+import time
+import types
+from typing import Any, Generator, List, Optional, Set
+
+from taskweaver.llm.base import CompletionService, LLMServiceConfig
+from taskweaver.llm.cancellation import is_cancelled
+from taskweaver.llm.resilience import (
+    CircuitBreaker,
+    LLMServerError,
+    TokenBucket,
+    get_circuit_breaker,
+    get_rate_limiter,
+    service_endpoint,
+)
+from taskweaver.llm.util import ChatMessageType
+
+
+class LLMPoolConfig(LLMServiceConfig):
+    def _configure(self) -> None:
+        self._set_name("pool")
+
+        # each endpoint is a dict of llm config overrides, e.g., {"llm.api_base": ..., "llm.model": ...},
+        # with an optional "weight" (default 1); an empty list means the llm config is the only endpoint
+        self.endpoints = self._get_list("endpoints", [])
+        self.strategy = self._get_enum(
+            "strategy",
+            options=["weighted_round_robin", "least_outstanding"],
+            default="weighted_round_robin",
+        )
+
+        for endpoint in self.endpoints:
+            assert isinstance(endpoint, dict), "llm.pool.endpoints must be a list of config dicts"
+            assert float(endpoint.get("weight", 1)) > 0, "endpoint weight must be positive"
+
+
+class PoolMember:
+    def __init__(
+        self,
+        service: CompletionService,
+        weight: float,
+        endpoint: str,
+        circuit_breaker: CircuitBreaker,
+        rate_limiter: TokenBucket,
+    ):
+        self.service = service
+        self.weight = weight
+        self.endpoint = endpoint
+        self.circuit_breaker = circuit_breaker
+        self.rate_limiter = rate_limiter
+        self.outstanding = 0
+        self.current_weight = 0.0
+
+
+class CompletionServicePool(CompletionService):
+    """
+    CompletionServicePool spreads requests across several endpoints serving the same LLM alias.
+
+    Endpoints are picked by smooth weighted round-robin or by the least outstanding requests per weight.
+    Endpoints with an open circuit breaker or an active Retry-After block are skipped. A failed request
+    is failed over to the next endpoint as long as no output has been yielded; the fallback endpoints
+    (e.g., the backup model) are only used when no primary endpoint is available.
+    """
+
+    def __init__(
+        self,
+        members: List[PoolMember],
+        fallback_members: Optional[List[PoolMember]] = None,
+        strategy: str = "weighted_round_robin",
+        max_retries: int = 0,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+        retry_budget: float = 60.0,
+    ):
+        assert len(members) > 0, "a completion service pool requires at least one endpoint"
+        self.members = members
+        self.fallback_members = fallback_members if fallback_members is not None else []
+        self.strategy = strategy
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_budget = retry_budget
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def create_member(
+        service: CompletionService,
+        weight: float = 1.0,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+    ) -> PoolMember:
+        # the resilience wrapper knows the endpoint of the service it wraps
+        endpoint = getattr(service, "endpoint", None) or service_endpoint(service)
+        return PoolMember(
+            service=service,
+            weight=weight,
+            endpoint=endpoint,
+            circuit_breaker=get_circuit_breaker(endpoint, failure_threshold, recovery_timeout),
+            rate_limiter=get_rate_limiter(endpoint),
+        )
+
+    def _select(self, candidates: List[PoolMember]) -> PoolMember:
+        if self.strategy == "least_outstanding":
+            return min(candidates, key=lambda m: m.outstanding / m.weight)
+
+        # smooth weighted round-robin, which interleaves the endpoints instead of sending bursts to one
+        total = sum(m.weight for m in candidates)
+        for m in candidates:
+            m.current_weight += m.weight
+        selected = max(candidates, key=lambda m: m.current_weight)
+        selected.current_weight -= total
+        return selected
+
+    def _acquire_member(self, tried: Set[int]) -> Optional[PoolMember]:
+        with self._lock:
+            for group in [self.members, self.fallback_members]:
+                untried = [m for m in group if id(m) not in tried]
+                healthy = [m for m in untried if m.circuit_breaker.is_available()]
+                # prefer the endpoints that are not blocked by the server's Retry-After
+                candidates = [m for m in healthy if not m.rate_limiter.is_blocked()] or healthy
+                while len(candidates) > 0:
+                    member = self._select(candidates)
+                    if member.circuit_breaker.allow_request():
+                        member.outstanding += 1
+                        return member
+                    candidates.remove(member)
+        return None
+
+    def chat_completion(
+        self,
+        messages: List[ChatMessageType],
+        stream: bool = True,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        top_p: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Generator[ChatMessageType, None, None]:
+        last_error: Optional[Exception] = None
+        backoff_spent = 0.0
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                retry_after = getattr(last_error, "retry_after", None)
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+                delay = max(delay, retry_after or 0.0)
+                if backoff_spent + delay > self.retry_budget:
+                    break
+                time.sleep(delay)
+                backoff_spent += delay
+
+            # try each endpoint at most once per attempt
+            tried: Set[int] = set()
+            while True:
+                member = self._acquire_member(tried)
+                if member is None:
+                    break
+                tried.add(id(member))
+
+                output_sent = False
+                try:
+                    upstream = member.service.chat_completion(
+                        messages,
+                        stream,
+                        temperature,
+                        max_tokens,
+                        top_p,
+                        stop,
+                        **kwargs,
+                    )
+                    try:
+                        for chunk in upstream:
+                            output_sent = True
+                            yield chunk
+                    finally:
+                        if isinstance(upstream, types.GeneratorType):
+                            upstream.close()
+                    member.circuit_breaker.record_success()
+                    return
+                except GeneratorExit:
+                    # the consumer stopped reading, so the endpoint is considered healthy
+                    member.circuit_breaker.record_success()
+                    raise
+                except BaseException as e:
+                    if is_cancelled():
+                        # the error is caused by the cancellation closing the response
+                        member.circuit_breaker.record_success()
+                        raise
+                    # the services which do not raise the typed errors, e.g., on an HTTP 5xx, fail over as well
+                    member.circuit_breaker.record_failure()
+                    if output_sent or not isinstance(e, Exception):
+                        raise
+                    last_error = e
+                finally:
+                    with self._lock:
+                        member.outstanding -= 1
+
+        if last_error is not None:
+            raise last_error
+        raise LLMServerError("No healthy endpoint is available in the completion service pool")
@@ -1,9 +1,11 @@
+import types
 from http import HTTPStatus
 from typing import Any, Generator, List, Optional
 
 from injector import inject
 
 from taskweaver.llm.base import CompletionService, EmbeddingService, LLMServiceConfig
+from taskweaver.llm.usage import report_usage
 from taskweaver.llm.util import ChatMessageType
 
 
@@ -76,14 +78,25 @@ class QWenService(CompletionService, EmbeddingService):
             incremental_output=True,
         )
 
-        for msg_chunk in response:
-            if msg_chunk.status_code == HTTPStatus.OK:
-                yield msg_chunk.output.choices[0]["message"]
-
-            else:
-                raise Exception(
-                    f"QWen API call failed with status code {msg_chunk.status_code} and error message {msg_chunk.code}",
-                )
+        usage: Any = None
+        try:
+            for msg_chunk in response:
+                if msg_chunk.status_code == HTTPStatus.OK:
+                    # the usage of every chunk counts all the tokens generated so far
+                    usage = msg_chunk.usage if msg_chunk.usage else usage
+                    yield msg_chunk.output.choices[0]["message"]
+
+                else:
+                    raise Exception(
+                        f"QWen API call failed with status code {msg_chunk.status_code} "
+                        f"and error message {msg_chunk.code}",
+                    )
+            if usage is not None:
+                report_usage(usage["input_tokens"], usage["output_tokens"])
+        finally:
+            # dashscope does not expose the HTTP response, so the stream is closed between chunks
+            if isinstance(response, types.GeneratorType):
+                response.close()
 
     def get_embeddings(self, strings: List[str]) -> List[List[float]]:
         resp = QWenService.dashscope.TextEmbedding.call(
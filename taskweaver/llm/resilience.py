@@ -0,0 +1,418 @@
+import random
+import re
+import threading
+import time
+import types
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Generator, List, Mapping, Optional
+
+from taskweaver.llm.base import CompletionService, LLMServiceConfig
+from taskweaver.llm.cancellation import is_cancelled
+from taskweaver.llm.util import ChatMessageType
+
+
+class LLMRetryableError(Exception):
+    """
+    Base class for transient errors raised by completion services.
+    The resilience layer retries requests failing with these errors, as long as
+    no output has been sent to the consumer yet.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMRateLimitError(LLMRetryableError):
+    pass
+
+
+class LLMTimeoutError(LLMRetryableError):
+    pass
+
+
+class LLMConnectionError(LLMRetryableError):
+    pass
+
+
+class LLMServerError(LLMRetryableError):
+    pass
+
+
+class LLMResilienceConfig(LLMServiceConfig):
+    def _configure(self) -> None:
+        self._set_name("resilience")
+
+        self.enabled = self._get_bool("enabled", True)
+
+        # retry policy
+        self.max_retries = self._get_int("max_retries", 3)
+        # total time (in seconds) a single request is allowed to spend in backoff
+        self.retry_budget = self._get_float("retry_budget", 60.0)
+        self.backoff_base = self._get_float("backoff_base", 0.5)
+        self.backoff_max = self._get_float("backoff_max", 20.0)
+
+        # client-side rate limiting per endpoint, 0 means the limit is only learned from response headers
+        self.requests_per_minute = self._get_float("requests_per_minute", 0.0)
+        self.rate_limit_timeout = self._get_float("rate_limit_timeout", 60.0)
+
+        # maximum number of concurrent requests in this process, 0 means unlimited
+        self.max_concurrency = self._get_int("max_concurrency", 0)
+
+        # circuit breaker of each endpoint, 0 failure_threshold disables it
+        self.failure_threshold = self._get_int("failure_threshold", 5)
+        self.recovery_timeout = self._get_float("recovery_timeout", 30.0)
+
+        assert self.max_retries >= 0, "max_retries must not be negative"
+        assert self.backoff_base >= 0, "backoff_base must not be negative"
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """
+    Parse a duration like "1s", "6m0s", "20ms" or "0.5" (seconds) into seconds.
+    """
+    value = value.strip()
+    if value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    units = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if len(parts) == 0 or "".join(num + unit for num, unit in parts) != value:
+        return None
+    return sum(float(num) * units[unit] for num, unit in parts)
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """
+    Get the number of seconds to wait before retrying from the response headers.
+    Both `retry-after-ms` and `retry-after` (in seconds or as HTTP date) are supported.
+    """
+    if headers is None:
+        return None
+    headers = {k.lower(): v for k, v in headers.items()}
+
+    if "retry-after-ms" in headers:
+        try:
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        except ValueError:
+            pass
+
+    if "retry-after" in headers:
+        retry_after = headers["retry-after"]
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    return None
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket limiting the request rate of one endpoint.
+    A bucket with rate 0 does not limit requests until it is tuned by the response headers.
+    """
+
+    def __init__(self, rate: float = 0.0, capacity: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self._last_refill = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Take one token, waiting for at most `timeout` seconds. Return False if timed out."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and (self.rate <= 0 or self.tokens >= 1):
+                    if self.rate > 0:
+                        self.tokens -= 1
+                    return True
+                wait = max(
+                    self.blocked_until - now,
+                    (1 - self.tokens) / self.rate if self.rate > 0 else 0.0,
+                )
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(max(wait, 0.001))
+
+    def block_for(self, seconds: float) -> None:
+        """Stop handing out tokens for the given number of seconds, e.g., after being throttled."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_blocked(self) -> bool:
+        with self._lock:
+            return time.monotonic() < self.blocked_until
+
+    def update(
+        self,
+        limit_per_minute: Optional[float] = None,
+        remaining: Optional[float] = None,
+        reset_after: Optional[float] = None,
+    ) -> None:
+        """Tune the bucket with the limits reported by the server."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if limit_per_minute is not None and limit_per_minute > 0:
+                self.rate = limit_per_minute / 60.0
+                self.capacity = max(1.0, limit_per_minute)
+            if remaining is not None:
+                self.tokens = min(self.tokens, max(0.0, remaining))
+                if remaining <= 0 and reset_after is not None:
+                    self.blocked_until = max(self.blocked_until, now + reset_after)
+
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker of one endpoint.
+    The circuit opens after `failure_threshold` consecutive failures and rejects requests for
+    `recovery_timeout` seconds. After that, a single trial request is let through (half-open):
+    the circuit closes if it succeeds and opens again if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self._lock = threading.Lock()
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._state = CircuitBreaker.CLOSED
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == CircuitBreaker.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self._state = CircuitBreaker.HALF_OPEN
+                self._trial_in_flight = False
+            return self._state
+
+    def is_available(self) -> bool:
+        """Whether a request may be sent without taking the trial slot of a half-open circuit."""
+        state = self.state
+        with self._lock:
+            return state == CircuitBreaker.CLOSED or (state == CircuitBreaker.HALF_OPEN and not self._trial_in_flight)
+
+    def allow_request(self) -> bool:
+        if self.failure_threshold <= 0:
+            return True
+        state = self.state
+        with self._lock:
+            if state == CircuitBreaker.CLOSED:
+                return True
+            if state == CircuitBreaker.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self._state = CircuitBreaker.CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._state == CircuitBreaker.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self._state = CircuitBreaker.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+_rate_limiter_lock = threading.Lock()
+_rate_limiters: Dict[str, TokenBucket] = {}
+
+_circuit_breaker_lock = threading.Lock()
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+_semaphore_lock = threading.Lock()
+_process_semaphore: Optional[threading.BoundedSemaphore] = None
+
+
+def endpoint_key(api_base: Optional[str], model: Optional[str]) -> str:
+    return f"{api_base or ''}#{model or ''}"
+
+
+def service_endpoint(service: CompletionService) -> str:
+    """Get the endpoint key of a completion service from its config."""
+    service_config = getattr(service, "config", None)
+    return endpoint_key(
+        getattr(service_config, "api_base", None),
+        getattr(service_config, "model", None),
+    )
+
+
+def get_rate_limiter(endpoint: str, requests_per_minute: float = 0.0) -> TokenBucket:
+    """Get the token bucket shared by all services in this process calling the given endpoint."""
+    with _rate_limiter_lock:
+        if endpoint not in _rate_limiters:
+            _rate_limiters[endpoint] = TokenBucket(rate=requests_per_minute / 60.0)
+        return _rate_limiters[endpoint]
+
+
+def get_circuit_breaker(
+    endpoint: str,
+    failure_threshold: int = 5,
+    recovery_timeout: float = 30.0,
+) -> CircuitBreaker:
+    """Get the circuit breaker shared by all services in this process calling the given endpoint."""
+    with _circuit_breaker_lock:
+        if endpoint not in _circuit_breakers:
+            _circuit_breakers[endpoint] = CircuitBreaker(failure_threshold, recovery_timeout)
+        return _circuit_breakers[endpoint]
+
+
+def get_process_semaphore(max_concurrency: int) -> Optional[threading.BoundedSemaphore]:
+    """
+    Get the semaphore bounding the concurrent LLM requests in this process.
+    The first non-zero `max_concurrency` configured in the process wins.
+    """
+    global _process_semaphore
+    if max_concurrency <= 0:
+        return _process_semaphore
+    with _semaphore_lock:
+        if _process_semaphore is None:
+            _process_semaphore = threading.BoundedSemaphore(max_concurrency)
+        return _process_semaphore
+
+
+def observe_rate_limit_headers(endpoint: str, headers: Optional[Mapping[str, str]]) -> None:
+    """Tune the rate limiter of the endpoint with the `x-ratelimit-*` response headers."""
+    if headers is None:
+        return
+    headers = {k.lower(): v for k, v in headers.items()}
+
+    def get_float(name: str) -> Optional[float]:
+        try:
+            return float(headers[name]) if name in headers else None
+        except ValueError:
+            return None
+
+    limit = get_float("x-ratelimit-limit-requests")
+    remaining = get_float("x-ratelimit-remaining-requests")
+    reset_after = (
+        parse_duration(headers["x-ratelimit-reset-requests"]) if "x-ratelimit-reset-requests" in headers else None
+    )
+    if limit is None and remaining is None:
+        return
+    get_rate_limiter(endpoint).update(
+        limit_per_minute=limit,
+        remaining=remaining,
+        reset_after=reset_after,
+    )
+
+
+class ResilientCompletionService(CompletionService):
+    """
+    ResilientCompletionService wraps a completion service with client-side rate limiting,
+    a per-process concurrency limit and retries with jittered exponential backoff.
+    A request is only retried before any output has been yielded to the consumer.
+    """
+
+    def __init__(
+        self,
+        service: CompletionService,
+        config: LLMResilienceConfig,
+        endpoint: Optional[str] = None,
+        max_retries: Optional[int] = None,
+    ):
+        self.service = service
+        self.config = config
+        self.max_retries = max_retries if max_retries is not None else config.max_retries
+        self.endpoint = endpoint if endpoint is not None else service_endpoint(service)
+        self.rate_limiter = get_rate_limiter(self.endpoint, config.requests_per_minute)
+        self.semaphore = get_process_semaphore(config.max_concurrency)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+        delay = random.uniform(0, min(self.config.backoff_max, self.config.backoff_base * (2**attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def chat_completion(
+        self,
+        messages: List[ChatMessageType],
+        stream: bool = True,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        top_p: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Generator[ChatMessageType, None, None]:
+        attempt = 0
+        backoff_spent = 0.0
+        while True:
+            if not self.rate_limiter.acquire(timeout=self.config.rate_limit_timeout):
+                raise LLMRateLimitError(
+                    f"Client-side rate limit of {self.endpoint} not released "
+                    f"within {self.config.rate_limit_timeout} seconds",
+                )
+
+            if self.semaphore is not None:
+                self.semaphore.acquire()
+            output_sent = False
+            try:
+                upstream = self.service.chat_completion(
+                    messages,
+                    stream,
+                    temperature,
+                    max_tokens,
+                    top_p,
+                    stop,
+                    **kwargs,
+                )
+                try:
+                    for chunk in upstream:
+                        output_sent = True
+                        yield chunk
+                finally:
+                    if isinstance(upstream, types.GeneratorType):
+                        upstream.close()
+                return
+            except LLMRetryableError as e:
+                if output_sent or is_cancelled():
+                    raise
+
+                if isinstance(e, LLMRateLimitError) and e.retry_after is not None:
+                    self.rate_limiter.block_for(e.retry_after)
+
+                delay = self.backoff_delay(attempt, e.retry_after)
+                if attempt >= self.max_retries or backoff_spent + delay > self.config.retry_budget:
+                    raise
+            finally:
+                if self.semaphore is not None:
+                    self.semaphore.release()
+
+            time.sleep(delay)
+            backoff_spent += delay
+            attempt += 1
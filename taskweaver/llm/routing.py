@@ -0,0 +1,199 @@
+import threading
+import time
+import types
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Generator, Optional, Tuple
+
+from taskweaver.llm.base import LLMServiceConfig
+from taskweaver.llm.cancellation import is_cancelled
+from taskweaver.llm.util import ChatMessageType
+
+
+@dataclass
+class RoutingPolicy:
+    """The routing policy of a role, deciding whether a request is easy enough for the fast LLM."""
+
+    enabled: bool
+    # the alias of the fast LLM receiving the easy requests, empty disables the routing
+    fast_alias: str
+    # the maximum number of tokens of the last message, i.e., the new input of the role, in an easy request
+    max_message_tokens: int
+    # the maximum number of tokens of the whole prompt in an easy request
+    max_prompt_tokens: int
+    # the maximum number of turns already taken in the round before an easy request
+    max_turns: int
+    # whether a request following a failed step goes to the requested LLM
+    escalate_on_failure: bool
+    # the fast LLM is bypassed while its recent success rate is below this rate
+    min_success_rate: float
+    # the number of outcomes of the fast LLM observed before its success rate and latency are trusted
+    min_samples: int
+
+
+class LLMRoutingConfig(LLMServiceConfig):
+    def _configure(self) -> None:
+        self._set_name("routing")
+
+        self.enabled = self._get_bool("enabled", False)
+        self.fast_alias = self._get_str("fast_alias", "", required=False)
+        self.max_message_tokens = self._get_int("max_message_tokens", 200)
+        self.max_prompt_tokens = self._get_int("max_prompt_tokens", 8000)
+        self.max_turns = self._get_int("max_turns", 2)
+        self.escalate_on_failure = self._get_bool("escalate_on_failure", True)
+        self.min_success_rate = self._get_float("min_success_rate", 0.9)
+        self.min_samples = self._get_int("min_samples", 10)
+        # the policies of the roles overriding the settings above, e.g., {"Planner": {"fast_alias": "small"}}
+        self.roles = self._get_dict("roles", {})
+
+        assert 0 <= self.min_success_rate <= 1, "min_success_rate must be in [0, 1]"
+
+    def get_policy(self, role: Optional[str]) -> RoutingPolicy:
+        overrides: Dict[str, Any] = self.roles.get(role, {}) if role is not None else {}
+        return RoutingPolicy(
+            enabled=bool(overrides.get("enabled", self.enabled)),
+            fast_alias=str(overrides.get("fast_alias", self.fast_alias)),
+            max_message_tokens=int(overrides.get("max_message_tokens", self.max_message_tokens)),
+            max_prompt_tokens=int(overrides.get("max_prompt_tokens", self.max_prompt_tokens)),
+            max_turns=int(overrides.get("max_turns", self.max_turns)),
+            escalate_on_failure=bool(overrides.get("escalate_on_failure", self.escalate_on_failure)),
+            min_success_rate=float(overrides.get("min_success_rate", self.min_success_rate)),
+            min_samples=int(overrides.get("min_samples", self.min_samples)),
+        )
+
+
+class AliasTracker:
+    """A thread-safe tracker of the recent outcomes of an LLM: whether each request succeeded and its latency."""
+
+    def __init__(self, window_size: int = 100):
+        self._lock = threading.Lock()
+        self._outcomes: Deque[Tuple[bool, Optional[float]]] = deque(maxlen=window_size)
+
+    def record(self, success: bool, first_chunk_latency: Optional[float]) -> None:
+        with self._lock:
+            self._outcomes.append((success, first_chunk_latency))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            outcomes = list(self._outcomes)
+        latencies = sorted(latency for success, latency in outcomes if success and latency is not None)
+        return {
+            "samples": len(outcomes),
+            "success_rate": sum(success for success, _ in outcomes) / len(outcomes) if outcomes else None,
+            "median_latency": latencies[len(latencies) // 2] if latencies else None,
+        }
+
+
+@dataclass
+class RoutingDecision:
+    alias: str
+    reason: str
+
+
+class LLMRouter:
+    """
+    A thread-safe router picking the LLM of each request of a role from cheap features of the request:
+    its token counts, the turn of the round and whether the previous step failed,
+    and from the recent success rate and latency of the fast LLM.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trackers: Dict[str, AliasTracker] = {}
+        self._decisions: Dict[str, Dict[str, int]] = {}
+
+    def get_tracker(self, llm_alias: str) -> AliasTracker:
+        with self._lock:
+            if llm_alias not in self._trackers:
+                self._trackers[llm_alias] = AliasTracker()
+            return self._trackers[llm_alias]
+
+    def route(
+        self,
+        policy: RoutingPolicy,
+        requested_alias: str,
+        message_tokens: int,
+        prompt_tokens: int,
+        turn: int,
+        previous_failed: bool,
+    ) -> RoutingDecision:
+        decision = self._decide(policy, requested_alias, message_tokens, prompt_tokens, turn, previous_failed)
+        with self._lock:
+            counts = self._decisions.setdefault(decision.alias, {})
+            counts[decision.reason] = counts.get(decision.reason, 0) + 1
+        return decision
+
+    def _decide(
+        self,
+        policy: RoutingPolicy,
+        requested_alias: str,
+        message_tokens: int,
+        prompt_tokens: int,
+        turn: int,
+        previous_failed: bool,
+    ) -> RoutingDecision:
+        if policy.escalate_on_failure and previous_failed:
+            return RoutingDecision(requested_alias, "previous_failed")
+        if message_tokens > policy.max_message_tokens:
+            return RoutingDecision(requested_alias, "long_message")
+        if prompt_tokens > policy.max_prompt_tokens:
+            return RoutingDecision(requested_alias, "long_prompt")
+        if turn > policy.max_turns:
+            return RoutingDecision(requested_alias, "late_turn")
+
+        fast_stats = self.get_tracker(policy.fast_alias).get_stats()
+        if fast_stats["samples"] >= policy.min_samples:
+            if fast_stats["success_rate"] < policy.min_success_rate:
+                return RoutingDecision(requested_alias, "fast_unhealthy")
+            requested_stats = self.get_tracker(requested_alias).get_stats()
+            if (
+                requested_stats["samples"] >= policy.min_samples
+                and fast_stats["median_latency"] is not None
+                and requested_stats["median_latency"] is not None
+                and fast_stats["median_latency"] > requested_stats["median_latency"]
+            ):
+                return RoutingDecision(requested_alias, "fast_slower")
+        return RoutingDecision(policy.fast_alias, "easy")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            trackers = dict(self._trackers)
+            decisions = {alias: dict(counts) for alias, counts in self._decisions.items()}
+        return {
+            "decisions": decisions,
+            "llm_aliases": {alias: tracker.get_stats() for alias, tracker in trackers.items()},
+        }
+
+
+def tracked_stream(
+    stream_init: Callable[[], Generator[ChatMessageType, None, None]],
+    tracker: AliasTracker,
+) -> Generator[ChatMessageType, None, None]:
+    """Stream from `stream_init` and record whether it succeeded and the latency of its first chunk."""
+    start_time = time.time()
+    first_chunk_latency: Optional[float] = None
+    stream: Optional[Generator[ChatMessageType, None, None]] = None
+    try:
+        stream = stream_init()
+        for chunk in stream:
+            if first_chunk_latency is None:
+                first_chunk_latency = time.time() - start_time
+            yield chunk
+    except GeneratorExit:
+        # closed by the caller, which tells nothing about the LLM
+        raise
+    except Exception:
+        if not is_cancelled():
+            tracker.record(False, first_chunk_latency)
+        raise
+    else:
+        tracker.record(True, first_chunk_latency)
+    finally:
+        if stream is not None and isinstance(stream, types.GeneratorType):
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+llm_router = LLMRouter()
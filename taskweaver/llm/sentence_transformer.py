@@ -1,5 +1,10 @@
+import subprocess
+import sys
+import time
 from typing import Any, List
+from urllib.parse import urlparse
 
+import requests
 from injector import inject
 
 from taskweaver.llm.base import EmbeddingService, LLMServiceConfig
@@ -28,6 +33,12 @@ class SentenceTransformerServiceConfig(LLMServiceConfig):
             self.embedding_model in self.embedding_model_candidates
         ), f"embedding model {self.embedding_model} is not supported"
 
+        # the url of the local embedding server, e.g., http://127.0.0.1:8765; empty to load the model in process
+        self.server_url = self._get_str("server_url", "", required=False)
+        # start the embedding server in a separate process if it is not running
+        self.start_server = self._get_bool("start_server", False)
+        self.server_timeout = self._get_float("server_timeout", 60.0)
+
 
 class SentenceTransformerService(EmbeddingService):
     @inject
@@ -47,7 +58,58 @@ class SentenceTransformerService(EmbeddingService):
             )
         self._initialized = True
 
+    def _is_server_running(self) -> bool:
+        try:
+            response = requests.get(f"{self.config.server_url}/health", timeout=1)
+        except requests.exceptions.RequestException:
+            return False
+        return response.status_code == 200
+
+    def _start_server(self):
+        if self._is_server_running():
+            return
+        url = urlparse(self.config.server_url)
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "taskweaver.llm.embedding_server",
+                "--model",
+                self.config.embedding_model,
+                "--host",
+                url.hostname or "127.0.0.1",
+                "--port",
+                str(url.port or 8765),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        deadline = time.time() + self.config.server_timeout
+        while not self._is_server_running():
+            if time.time() > deadline:
+                raise Exception(f"Failed to start the embedding server at {self.config.server_url}")
+            time.sleep(0.5)
+
+    def _get_server_embeddings(self, strings: List[str]) -> List[List[float]]:
+        if not self._initialized:
+            if self.config.start_server:
+                self._start_server()
+            self._initialized = True
+
+        response = requests.post(
+            f"{self.config.server_url}/embed",
+            json={"model": self.config.embedding_model, "inputs": strings},
+            timeout=self.config.server_timeout,
+        )
+        if response.status_code != 200:
+            raise Exception(f"Failed to get embeddings from {self.config.server_url}: {response.text}")
+        return response.json()["embeddings"]
+
     def get_embeddings(self, strings: List[str]) -> List[List[float]]:
+        if self.config.server_url:
+            return self._get_server_embeddings(strings)
+
         if not self._initialized:
             self._load_model()
 
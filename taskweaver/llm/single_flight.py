@@ -0,0 +1,203 @@
+import hashlib
+import json
+import threading
+import types
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generator, List, Optional, TypeVar
+
+from taskweaver.llm.base import LLMServiceConfig
+from taskweaver.llm.cancellation import CancellationToken, cancellable_stream
+from taskweaver.llm.util import ChatMessageType
+
+T = TypeVar("T")
+
+
+class LLMSingleFlightConfig(LLMServiceConfig):
+    def _configure(self) -> None:
+        self._set_name("single_flight")
+
+        # share one upstream call among identical concurrent completion requests;
+        # off by default as identical sampled requests would otherwise get different responses
+        self.completion = self._get_bool("completion", False)
+        # share one upstream call among identical concurrent embedding requests
+        self.embedding = self._get_bool("embedding", True)
+        # the number of recent embedding results reused by identical sequential requests, 0 to disable
+        self.embedding_cache_size = self._get_int("embedding_cache_size", 256)
+
+
+def make_request_key(**kwargs: Any) -> str:
+    """Make the key identifying a request from its parameters."""
+    payload = json.dumps(kwargs, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.done = False
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.chunks: List[ChatMessageType] = []
+        self.subscribers = 0
+        self.token = CancellationToken()
+
+
+class SingleFlight:
+    """
+    SingleFlight coalesces identical concurrent calls: the first caller of a key makes the upstream call
+    and the callers arriving while it is in flight wait for its result instead of making their own.
+    A flight ends with its upstream call, so later callers make a new call, unless `do` is asked to keep
+    the recent results.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._recent_results: "OrderedDict[str, Any]" = OrderedDict()
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+        self.cached_calls = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "upstream_calls": self.upstream_calls,
+                "coalesced_calls": self.coalesced_calls,
+                "cached_calls": self.cached_calls,
+                "saved_calls": self.coalesced_calls + self.cached_calls,
+            }
+
+    def do(self, key: str, fn: Callable[[], T], cache_size: int = 0) -> T:
+        """
+        Return the result of `fn`, sharing it among the concurrent calls with the same key.
+        With a non-zero `cache_size`, the results of the latest calls are also reused, which only suits
+        deterministic calls like embeddings.
+        """
+        with self._lock:
+            if cache_size > 0 and key in self._recent_results:
+                self._recent_results.move_to_end(key)
+                self.cached_calls += 1
+                return self._recent_results[key]
+
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.upstream_calls += 1
+            else:
+                self.coalesced_calls += 1
+
+        if is_leader:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+            with self._lock:
+                del self._flights[key]
+                if cache_size > 0 and flight.error is None:
+                    self._recent_results[key] = flight.result
+                    while len(self._recent_results) > cache_size:
+                        self._recent_results.popitem(last=False)
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+        else:
+            with flight.cond:
+                while not flight.done:
+                    flight.cond.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stream(
+        self,
+        key: str,
+        stream_init: Callable[[], Generator[ChatMessageType, None, None]],
+    ) -> Generator[ChatMessageType, None, None]:
+        """
+        Stream the chunks of `stream_init`, fanning the upstream stream out to every concurrent caller
+        with the same key. A caller joining late first receives the chunks already streamed.
+        The upstream stream is pulled by a separate thread, so a slow caller does not slow down the others,
+        and it is cancelled once all callers have stopped reading.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.upstream_calls += 1
+            else:
+                self.coalesced_calls += 1
+            with flight.cond:
+                flight.subscribers += 1
+        if is_leader:
+            threading.Thread(target=self._pump, args=(key, flight, stream_init), daemon=True).start()
+
+        index = 0
+        try:
+            while True:
+                with flight.cond:
+                    while index >= len(flight.chunks) and not flight.done:
+                        flight.cond.wait()
+                    if index < len(flight.chunks):
+                        chunk = flight.chunks[index]
+                        index += 1
+                    elif flight.error is not None:
+                        raise flight.error
+                    else:
+                        return
+                yield dict(chunk)  # type: ignore
+        finally:
+            with self._lock:
+                with flight.cond:
+                    flight.subscribers -= 1
+                    abandoned = flight.subscribers == 0 and not flight.done
+                if abandoned and self._flights.get(key) is flight:
+                    # new callers must not join a flight that is being cancelled
+                    del self._flights[key]
+            if abandoned:
+                flight.token.cancel()
+
+    def _pump(
+        self,
+        key: str,
+        flight: _Flight,
+        stream_init: Callable[[], Generator[ChatMessageType, None, None]],
+    ) -> None:
+        stream: Optional[Generator[ChatMessageType, None, None]] = None
+        try:
+            stream = cancellable_stream(stream_init, flight.token)
+            for chunk in stream:
+                with flight.cond:
+                    if flight.subscribers == 0:
+                        break
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            if stream is not None and isinstance(stream, types.GeneratorType):
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+
+completion_flights = SingleFlight("completion")
+embedding_flights = SingleFlight("embedding")
+
+
+def get_single_flight_stats() -> Dict[str, Dict[str, int]]:
+    """Get the numbers of upstream and saved calls of the single-flight layer in this process."""
+    return {
+        completion_flights.name: completion_flights.get_stats(),
+        embedding_flights.name: embedding_flights.get_stats(),
+    }
@@ -0,0 +1,125 @@
+import abc
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from taskweaver.llm.base import LLMServiceConfig
+from taskweaver.llm.util import ChatMessageType
+
+
+class TokenizerConfig(LLMServiceConfig):
+    def _configure(self) -> None:
+        self._set_name("tokenizer")
+
+        # auto: use tiktoken if it is installed and knows the encoding, otherwise estimate the token count locally
+        self.type = self._get_enum(
+            "type",
+            options=["auto", "tiktoken", "estimate"],
+            default="auto",
+        )
+        # the tiktoken encoding, e.g., cl100k_base; by default it is derived from the model name
+        self.encoding = self._get_str("encoding", None, required=False)
+
+
+class Tokenizer(abc.ABC):
+    # the tokens added by the chat format to every message and to prime the reply, following OpenAI's counting
+    tokens_per_message: int = 4
+    tokens_per_reply: int = 3
+
+    @abc.abstractmethod
+    def count_tokens(self, text: str) -> int:
+        """Count the tokens of the text."""
+
+    def count_message_tokens(self, messages: List[ChatMessageType], with_reply: bool = True) -> int:
+        """
+        Count the tokens of the chat messages, including the chat format overhead.
+        Set `with_reply` to False to count a part of a prompt, which is not followed by the reply.
+        """
+        if len(messages) == 0:
+            return 0
+        return sum(self.tokens_per_message + self.count_tokens(message["content"]) for message in messages) + (
+            self.tokens_per_reply if with_reply else 0
+        )
+
+    def truncate(self, text: str, max_tokens: int, marker: str = "\n...[truncated]...\n") -> str:
+        """Shorten the text to about `max_tokens` tokens by keeping its head and tail."""
+        token_count = self.count_tokens(text)
+        if token_count <= max_tokens:
+            return text
+        keep_tokens = max(0, max_tokens - self.count_tokens(marker))
+        keep_chars = int(len(text) * keep_tokens / token_count)
+        head_chars = keep_chars * 2 // 3
+        tail_chars = keep_chars - head_chars
+        return text[:head_chars] + marker + (text[-tail_chars:] if tail_chars > 0 else "")
+
+
+class EstimatedTokenizer(Tokenizer):
+    """
+    A local tokenizer estimating the token count without a vocabulary.
+    Words count as one token per 4 characters, while each CJK character and punctuation mark counts as a token.
+    """
+
+    _token_pattern = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]|[^\W\d_]+|\d+|[^\w\s]")
+
+    def count_tokens(self, text: str) -> int:
+        count = 0
+        for token in self._token_pattern.findall(text):
+            count += math.ceil(len(token) / 4)
+        return count
+
+
+class TiktokenTokenizer(Tokenizer):
+    def __init__(self, encoding: str):
+        import tiktoken
+
+        self.encoding = tiktoken.get_encoding(encoding)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+_tokenizer_lock = threading.Lock()
+_tokenizers: Dict[Tuple[str, Optional[str], Optional[str]], Tokenizer] = {}
+
+
+def _get_tiktoken_encoding(model: Optional[str], encoding: Optional[str]) -> str:
+    if encoding is not None:
+        return encoding
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_name_for_model(model) if model is not None else "cl100k_base"
+    except KeyError:
+        return "cl100k_base"
+
+
+def get_tokenizer(
+    model: Optional[str] = None,
+    tokenizer_type: str = "auto",
+    encoding: Optional[str] = None,
+) -> Tokenizer:
+    """Get the tokenizer of the model, which is shared in this process."""
+    key = (tokenizer_type, model, encoding)
+    with _tokenizer_lock:
+        if key in _tokenizers:
+            return _tokenizers[key]
+
+        tokenizer: Tokenizer
+        if tokenizer_type == "estimate":
+            tokenizer = EstimatedTokenizer()
+        else:
+            try:
+                tokenizer = TiktokenTokenizer(_get_tiktoken_encoding(model, encoding))
+            except ImportError:
+                if tokenizer_type == "tiktoken":
+                    raise ImportError("Please install tiktoken first.")
+                tokenizer = EstimatedTokenizer()
+            except Exception:
+                # the encoding is unknown or cannot be downloaded
+                if tokenizer_type == "tiktoken":
+                    raise
+                tokenizer = EstimatedTokenizer()
+
+        _tokenizers[key] = tokenizer
+        return tokenizer
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import threading
+import types
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Generator, Optional
+
+from taskweaver.llm.util import ChatMessageType
+from taskweaver.utils import StringBuilder
+
+
+@dataclass
+class TokenUsage:
+    """The token usage of one or more LLM requests."""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # the prompt tokens served from the prompt cache of the provider
+    cached_tokens: int = 0
+    requests: int = 0
+    # the requests whose usage is estimated locally as the provider did not report it
+    estimated_requests: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other: TokenUsage) -> None:
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cached_tokens += other.cached_tokens
+        self.requests += other.requests
+        self.estimated_requests += other.estimated_requests
+
+    def to_dict(self) -> Dict[str, int]:
+        return {**asdict(self), "total_tokens": self.total_tokens}
+
+    @staticmethod
+    def from_dict(content: Dict[str, Any]) -> TokenUsage:
+        return TokenUsage(
+            prompt_tokens=content.get("prompt_tokens", 0),
+            completion_tokens=content.get("completion_tokens", 0),
+            cached_tokens=content.get("cached_tokens", 0),
+            requests=content.get("requests", 0),
+            estimated_requests=content.get("estimated_requests", 0),
+        )
+
+
+class _UsageRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.usage: Optional[TokenUsage] = None
+
+    def report(self, usage: TokenUsage) -> None:
+        with self._lock:
+            if self.usage is None:
+                self.usage = TokenUsage()
+            self.usage.add(usage)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def usage_recorder_scope(recorder: Optional[_UsageRecorder]):
+    """Bind the recorder to the current thread, so that the usage reported by the completion services reaches it."""
+    if not hasattr(_local, "recorders"):
+        _local.recorders = []
+    _local.recorders.append(recorder)
+    try:
+        yield recorder
+    finally:
+        _local.recorders.pop()
+
+
+def current_usage_recorder() -> Optional[_UsageRecorder]:
+    recorders = getattr(_local, "recorders", None)
+    return recorders[-1] if recorders else None
+
+
+def report_usage(prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> None:
+    """Report the token usage of a request. Called by the completion services when the provider returns it."""
+    recorder = current_usage_recorder()
+    if recorder is not None:
+        recorder.report(TokenUsage(prompt_tokens, completion_tokens, cached_tokens, requests=1))
+
+
+@contextmanager
+def usage_context(**labels: Any):
+    """
+    Label the LLM requests made in the scope, e.g., with the `role` making them and the `round` to attach them to.
+    The labels are also the features routing the requests, see `taskweaver.llm.routing`.
+    The labels of nested scopes override the outer ones.
+    """
+    if not hasattr(_local, "labels"):
+        _local.labels = []
+    _local.labels.append({**current_usage_labels(), **labels})
+    try:
+        yield
+    finally:
+        _local.labels.pop()
+
+
+def current_usage_labels() -> Dict[str, Any]:
+    labels = getattr(_local, "labels", None)
+    return labels[-1] if labels else {}
+
+
+def metered_stream(
+    stream_init: Callable[[], Generator[ChatMessageType, None, None]],
+    on_usage: Callable[[TokenUsage], None],
+    estimate: Callable[[str], TokenUsage],
+) -> Generator[ChatMessageType, None, None]:
+    """
+    Stream from `stream_init` and pass its usage to `on_usage` when it ends: the usage reported by the provider,
+    or a local estimate from the received content when it is not reported, e.g., when the stream is cancelled.
+    """
+    recorder = _UsageRecorder()
+    content = StringBuilder()
+    stream: Optional[Generator[ChatMessageType, None, None]] = None
+    try:
+        with usage_recorder_scope(recorder):
+            stream = stream_init()
+        while True:
+            with usage_recorder_scope(recorder):
+                try:
+                    chunk = next(stream)
+                except StopIteration:
+                    return
+            content.append(chunk["content"])
+            yield chunk
+    finally:
+        if stream is not None and isinstance(stream, types.GeneratorType):
+            with usage_recorder_scope(recorder):
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+        if recorder.usage is not None:
+            on_usage(recorder.usage)
+        elif len(content) > 0:
+            usage = estimate(str(content))
+            usage.requests = usage.estimated_requests = 1
+            on_usage(usage)
+
+
+class UsageTracker:
+    """A thread-safe aggregate of the token usage of an LLM, in total and per role."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = TokenUsage()
+        self.roles: Dict[str, TokenUsage] = {}
+
+    def record(self, usage: TokenUsage, role: Optional[str] = None) -> None:
+        with self._lock:
+            self.total.add(usage)
+            role_usage = self.roles.setdefault(role if role is not None else "unknown", TokenUsage())
+            role_usage.add(usage)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total": self.total.to_dict(),
+                "roles": {role: usage.to_dict() for role, usage in self.roles.items()},
+            }
+
+
+_registry_lock = threading.Lock()
+_usage_trackers: Dict[str, UsageTracker] = {}
+
+
+def get_usage_tracker(llm_alias: str) -> UsageTracker:
+    """Get the usage tracker of the LLM alias, which is shared in this process."""
+    with _registry_lock:
+        if llm_alias not in _usage_trackers:
+            _usage_trackers[llm_alias] = UsageTracker()
+        return _usage_trackers[llm_alias]
+
+
+def get_usage_stats() -> Dict[str, Dict[str, Any]]:
+    """Get the token usage of every LLM alias in this process."""
+    with _registry_lock:
+        trackers = dict(_usage_trackers)
+    return {llm_alias: tracker.get_stats() for llm_alias, tracker in trackers.items()}
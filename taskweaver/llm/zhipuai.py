@@ -2,6 +2,8 @@ from typing import Any, Generator, List, Optional
 
 from injector import inject
 
+from taskweaver.llm.cancellation import on_cancel
+from taskweaver.llm.usage import report_usage
 from taskweaver.llm.util import ChatMessageType, format_chat_message
 
 from .base import CompletionService, EmbeddingService, LLMServiceConfig
@@ -111,20 +113,30 @@ class ZhipuAIService(CompletionService, EmbeddingService):
                 **tools_kwargs,
             )
             if stream:
+                # close the HTTP response, and stop the generation, as soon as the stream is cancelled
+                on_cancel(res.response.close)
                 role: Any = None
-                for stream_res in res:
-                    if not stream_res.choices:
-                        continue
-                    delta = stream_res.choices[0].delta
-                    if delta is None:
-                        continue
-
-                    role = delta.role if delta.role is not None else role
-                    content = delta.content if delta.content is not None else ""
-                    if content is None:
-                        continue
-                    yield format_chat_message(role, content)
+                try:
+                    for stream_res in res:
+                        # the usage is only in the last chunk
+                        if getattr(stream_res, "usage", None) is not None:
+                            report_usage(stream_res.usage.prompt_tokens, stream_res.usage.completion_tokens)
+                        if not stream_res.choices:
+                            continue
+                        delta = stream_res.choices[0].delta
+                        if delta is None:
+                            continue
+
+                        role = delta.role if delta.role is not None else role
+                        content = delta.content if delta.content is not None else ""
+                        if content is None:
+                            continue
+                        yield format_chat_message(role, content)
+                finally:
+                    res.response.close()
             else:
+                if res.usage is not None:
+                    report_usage(res.usage.prompt_tokens, res.usage.completion_tokens)
                 zhipuai_response = res.choices[0].message
                 if zhipuai_response is None:
                     raise Exception("ZhipuAI API returned an empty response")
@@ -56,6 +56,14 @@ class TelemetryLogger:
             )
 
         if not self.is_remote:
+            from taskweaver.logging.event_log import current_event_log
+
+            event_log = current_event_log()
+            if event_log is not None:
+                # appended to the event log of the session by its writer thread, instead of written to a file
+                event_log.log_file(os.path.basename(file_path), dumped_obj)
+                return
+
             import json
 
             with open(file_path, "w", encoding="utf-8") as log_file:
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import IO, TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from taskweaver.utils import json_dumps
+
+if TYPE_CHECKING:
+    from taskweaver.memory import Conversation, Post, Round
+
+logger = logging.getLogger(__name__)
+
+
+class EventLogWriter:
+    """
+    A writer appending JSON lines to the event logs from a background thread, so that the serialization
+    and the file writes are off the critical path. The files are kept open and flushed when the queue is drained.
+    The compressed files are closed instead, so that each drain appends a complete gzip member
+    and the file is readable while the session is alive or after a crash.
+    """
+
+    def __init__(self) -> None:
+        self._queue: queue.Queue[Tuple[str, str, bool, Any]] = queue.Queue()
+        self._files: Dict[str, IO[str]] = {}
+        self._compressed: Set[str] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def append(self, path: str, record: Dict[str, Any], compress: bool = False) -> None:
+        self._submit(("append", path, compress, record))
+
+    def close(self, path: str) -> None:
+        self._submit(("close", path, False, None))
+
+    def flush(self) -> None:
+        """Wait until the records appended so far are written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def shutdown(self) -> None:
+        """Write the records appended so far and close the files, e.g., when the process exits."""
+        if self._thread is not None:
+            self._submit(("close_all", "", False, None))
+            self.flush()
+
+    def _submit(self, item: Tuple[str, str, bool, Any]) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="event_log_writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.shutdown)
+        self._queue.put(item)
+
+    def _run(self) -> None:
+        while True:
+            op, path, compress, record = self._queue.get()
+            try:
+                if op == "append":
+                    self._get_file(path, compress).write(json_dumps(record) + "\n")
+                elif op == "close_all":
+                    for file_path in list(self._files.keys()):
+                        self._close_file(file_path)
+                elif path in self._files:
+                    self._close_file(path)
+            except Exception as e:
+                logger.warning(f"Failed to write the event log {path}: {e}")
+            finally:
+                if self._queue.unfinished_tasks == 1:
+                    self._drain_files()
+                self._queue.task_done()
+
+    def _drain_files(self) -> None:
+        for file_path in list(self._files.keys()):
+            try:
+                if file_path in self._compressed:
+                    self._close_file(file_path)
+                else:
+                    self._files[file_path].flush()
+            except Exception as e:
+                logger.warning(f"Failed to write the event log {file_path}: {e}")
+
+    def _close_file(self, path: str) -> None:
+        self._compressed.discard(path)
+        self._files.pop(path).close()
+
+    def _get_file(self, path: str, compress: bool) -> IO[str]:
+        f = self._files.get(path)
+        if f is None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            if compress:
+                # appending to a gzip file starts a new member, which the readers decompress in sequence
+                f = gzip.open(path, "at", encoding="utf-8")
+                self._compressed.add(path)
+            else:
+                f = open(path, "a", encoding="utf-8")
+            self._files[path] = f
+        return f
+
+
+_writer_lock = threading.Lock()
+_writer: Optional[EventLogWriter] = None
+
+
+def get_event_log_writer() -> EventLogWriter:
+    """Get the event log writer shared in this process."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = EventLogWriter()
+        return _writer
+
+
+class SessionEventLog:
+    """
+    The append-only event log of a session: one JSON line for the session, each round creation and state change,
+    each post and each attachment, and each log file, e.g., the prompt of a role, dumped in the session.
+    The records are snapshots taken by the caller and written by the event log writer.
+    """
+
+    def __init__(self, path: str, compress: bool = False) -> None:
+        self.path = path
+        self.compress = compress
+        self.writer = get_event_log_writer()
+
+    def log_session(self, session: Dict[str, Any]) -> None:
+        self._append({"type": "session", **session})
+
+    def log_round(self, round: Round) -> None:
+        self._append({"type": "round", "round_id": round.id, "user_query": round.user_query, "state": round.state})
+
+    def log_round_state(self, round: Round) -> None:
+        usage = {role: {alias: dict(u) for alias, u in role_usage.items()} for role, role_usage in round.usage.items()}
+        self._append({"type": "round_state", "round_id": round.id, "state": round.state, "usage": usage})
+
+    def log_post(self, round_id: str, post: Post) -> None:
+        self._append(
+            {
+                "type": "post",
+                "round_id": round_id,
+                "post_id": post.id,
+                "message": post.message,
+                "send_from": post.send_from,
+                "send_to": post.send_to,
+            },
+        )
+        for attachment in post.attachment_list:
+            self._append({"type": "attachment", "post_id": post.id, "attachment": attachment.to_dict()})
+
+    def log_file(self, name: str, content: Any) -> None:
+        self._append({"type": "file", "name": name, "content": content})
+
+    def close(self) -> None:
+        self.writer.close(self.path)
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        self.writer.append(self.path, record, self.compress)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def event_log_scope(event_log: Optional[SessionEventLog]):
+    """Bind the event log to the current thread, so that the log files dumped in the scope are appended to it."""
+    if not hasattr(_local, "event_logs"):
+        _local.event_logs = []
+    _local.event_logs.append(event_log)
+    try:
+        yield event_log
+    finally:
+        _local.event_logs.pop()
+
+
+def current_event_log() -> Optional[SessionEventLog]:
+    event_logs = getattr(_local, "event_logs", None)
+    return event_logs[-1] if event_logs else None
+
+
+def read_events(path: str) -> Iterator[Dict[str, Any]]:
+    """Read the records of an event log, skipping a last line truncated by a crash."""
+    opener: Any = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        lines = iter(f)
+        while True:
+            try:
+                line = next(lines)
+            except StopIteration:
+                return
+            except (EOFError, gzip.BadGzipFile, zlib.error):
+                # the last gzip member of a log being written or cut by a crash is incomplete
+                return
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def load_conversation(path: str) -> Conversation:
+    """Rebuild the conversation of a session from its event log."""
+    from taskweaver.memory import Conversation, Post, Round
+    from taskweaver.memory.attachment import Attachment
+
+    conversation = Conversation.init()
+    rounds: Dict[str, Round] = {}
+    posts: Dict[str, Post] = {}
+    for record in read_events(path):
+        record_type = record["type"]
+        if record_type == "round":
+            chat_round = Round.create(user_query=record["user_query"], id=record["round_id"], state=record["state"])
+            rounds[chat_round.id] = chat_round
+            conversation.add_round(chat_round)
+        elif record_type == "round_state" and record["round_id"] in rounds:
+            rounds[record["round_id"]].state = record["state"]
+            rounds[record["round_id"]].usage = record["usage"]
+        elif record_type == "post" and record["round_id"] in rounds:
+            post = Post.create(message=record["message"], send_from=record["send_from"], send_to=record["send_to"])
+            post.id = record["post_id"]
+            posts[post.id] = post
+            rounds[record["round_id"]].add_post(post)
+        elif record_type == "attachment" and record["post_id"] in posts:
+            posts[record["post_id"]].add_attachment(Attachment.from_dict(record["attachment"]))
+    return conversation
+
+
+def export_log_files(path: str, output_dir: str) -> List[str]:
+    """
+    Produce the log files of a session from its event log, as they were written before the event log:
+    the session file, a file for each round and the other log files, e.g., the prompts of the roles.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    files: Dict[str, Any] = {}
+    session_id: Optional[str] = None
+    for record in read_events(path):
+        if record["type"] == "session":
+            session_id = record["session_id"]
+            files[f"{session_id}.json"] = {k: v for k, v in record.items() if k != "type"}
+        elif record["type"] == "file":
+            files[record["name"]] = record["content"]
+    if session_id is not None:
+        for chat_round in load_conversation(path).rounds:
+            files[f"{session_id}_{chat_round.id}.json"] = chat_round.to_dict()
+
+    file_paths: List[str] = []
+    for name, content in files.items():
+        file_path = os.path.join(output_dir, name)
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(content, f)
+        file_paths.append(file_path)
+    return file_paths
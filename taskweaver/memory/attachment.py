@@ -1,8 +1,9 @@
 from __future__ import annotations
 
+import copy
 from dataclasses import dataclass
 from enum import Enum
-from typing import TYPE_CHECKING, Any, Optional, TypedDict
+from typing import TYPE_CHECKING, Any, Dict, Optional, TypedDict
 
 from taskweaver.utils import create_id
 
@@ -42,7 +43,7 @@ class AttachmentType(Enum):
     invalid_response = "invalid_response"
 
 
-@dataclass
+@dataclass(slots=True)
 class Attachment:
     if TYPE_CHECKING:
         AttachmentDict = TypedDict(
@@ -106,3 +107,30 @@ class Attachment:
             id=content["id"] if "id" in content else None,
             extra=content["extra"] if "extra" in content else None,
         )
+
+
+class AttachmentView(Attachment):
+    """A read-only view of an attachment. Its deep copy is a writable attachment."""
+
+    __slots__ = ()
+
+    @staticmethod
+    def of(attachment: Attachment) -> AttachmentView:
+        view = object.__new__(AttachmentView)
+        for name in ["id", "type", "content", "extra"]:
+            object.__setattr__(view, name, getattr(attachment, name))
+        return view
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"AttachmentView is read-only, deepcopy it to modify {name}")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"AttachmentView is read-only, deepcopy it to modify {name}")
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Attachment:
+        return Attachment(
+            id=self.id,
+            type=self.type,
+            content=copy.deepcopy(self.content, memo),
+            extra=copy.deepcopy(self.extra, memo),
+        )
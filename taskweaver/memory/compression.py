@@ -1,13 +1,26 @@
 import json
-from typing import Callable, List, Set, Tuple
+import threading
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, FrozenSet, List, Optional, Tuple
 
 from injector import inject
 
 from taskweaver.config.module_config import ModuleConfig
 from taskweaver.llm import LLMApi
+from taskweaver.llm.cancellation import CancellationToken, cancellation_scope
+from taskweaver.llm.usage import usage_context
 from taskweaver.llm.util import format_chat_message
 from taskweaver.logging import TelemetryLogger
 from taskweaver.memory import Round
+from taskweaver.module.event_emitter import (
+    PostEventType,
+    RoundEventType,
+    SessionEventEmitter,
+    SessionEventHandlerBase,
+    SessionEventType,
+)
 from taskweaver.module.tracing import Tracing, get_tracer, tracing_decorator
 
 
@@ -22,8 +35,36 @@ class RoundCompressorConfig(ModuleConfig):
 
         self.llm_alias = self._get_str("llm_alias", default="", required=False)
 
+        # summarize the rounds in the background when a round ends, instead of in the turn crossing the threshold
+        self.background = self._get_bool("background", True)
+        # the number of the threads summarizing the rounds in the background, shared by all the sessions
+        self.max_workers = self._get_int("max_workers", 2)
 
-class RoundCompressor:
+        assert self.max_workers > 0, "max_workers must be greater than 0"
+
+
+@dataclass(frozen=True)
+class _CompressionState:
+    """The latest summary and the rounds it covers, which are published together."""
+
+    summary: str
+    processed_rounds: FrozenSet[str]
+
+
+_executor_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor(max_workers: int) -> ThreadPoolExecutor:
+    """Get the worker pool compressing the rounds in the background. The first configured size wins."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="round_compressor")
+        return _executor
+
+
+class RoundCompressor(SessionEventHandlerBase):
     @inject
     def __init__(
         self,
@@ -31,16 +72,32 @@ class RoundCompressor:
         config: RoundCompressorConfig,
         logger: TelemetryLogger,
         tracing: Tracing,
+        event_emitter: SessionEventEmitter,
     ):
         self.config = config
-        self.processed_rounds: Set[str] = set()
         self.rounds_to_compress = self.config.rounds_to_compress
         self.rounds_to_retain = self.config.rounds_to_retain
-        self.previous_summary: str = "None"
         self.llm_api = llm_api
         self.logger = logger
         self.tracing = tracing
 
+        self._state = _CompressionState(summary="None", processed_rounds=frozenset())
+        self._lock = threading.Lock()
+        # the rounds, formatter and template of the last call, which are compressed when the round ends
+        self._latest: Optional[Tuple[List[Round], Callable, str]] = None
+        self._future: Optional[Future] = None
+        self._token: Optional[CancellationToken] = None
+        if self.config.background:
+            event_emitter.register(self)
+
+    @property
+    def previous_summary(self) -> str:
+        return self._state.summary
+
+    @property
+    def processed_rounds(self) -> FrozenSet[str]:
+        return self._state.processed_rounds
+
     @tracing_decorator
     def compress_rounds(
         self,
@@ -48,30 +105,119 @@ class RoundCompressor:
         rounds_formatter: Callable,
         prompt_template: str = "{PREVIOUS_SUMMARY}, please compress the following rounds",
     ) -> Tuple[str, List[Round]]:
+        state = self._state
+        remaining_rounds = self._count_remaining_rounds(rounds, state)
+
+        if self.config.background:
+            # use the latest finished summary without waiting, and compress the rounds off the critical path
+            self._latest = (rounds, rounds_formatter, prompt_template)
+            if remaining_rounds >= (self.rounds_to_compress + self.rounds_to_retain):
+                self._schedule(rounds, rounds_formatter, prompt_template)
+            return state.summary, rounds[-remaining_rounds:]
+
+        # not enough rounds to compress
+        if remaining_rounds < (self.rounds_to_compress + self.rounds_to_retain):
+            return state.summary, rounds[-remaining_rounds:]
+
+        new_state = self._compress(rounds, rounds_formatter, prompt_template, state)
+        if new_state is None:
+            return state.summary, rounds[-remaining_rounds:]
+        self._state = new_state
+        return new_state.summary, rounds[-self.rounds_to_retain :]
+
+    def handle_session(self, type: SessionEventType, msg: str, extra: Any, **kwargs: Any):
+        if type == SessionEventType.session_end:
+            self.cancel()
+
+    def handle_round(self, type: RoundEventType, msg: str, extra: Any, round_id: str, **kwargs: Any):
+        if type != RoundEventType.round_end or self._latest is None:
+            return
+        rounds, rounds_formatter, prompt_template = self._latest
+        remaining_rounds = self._count_remaining_rounds(rounds, self._state)
+        if remaining_rounds >= (self.rounds_to_compress + self.rounds_to_retain):
+            self._schedule(rounds, rounds_formatter, prompt_template)
+
+    def handle_post(self, type: PostEventType, msg: str, extra: Any, post_id: str, round_id: str, **kwargs: Any):
+        pass
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Wait for the compression running in the background, if any."""
+        future = self._future
+        if future is not None:
+            futures.wait([future], timeout=timeout)
+
+    def cancel(self) -> None:
+        """Cancel the compression running in the background, if any, closing its LLM request."""
+        with self._lock:
+            if self._future is not None:
+                self._future.cancel()
+            if self._token is not None:
+                self._token.cancel()
+            self._latest = None
+
+    def _count_remaining_rounds(self, rounds: List[Round], state: _CompressionState) -> int:
         remaining_rounds = len(rounds)
         for _round in rounds:
-            if _round.id in self.processed_rounds:
+            if _round.id in state.processed_rounds:
                 remaining_rounds -= 1
                 continue
             break
+        return remaining_rounds
+
+    def _schedule(self, rounds: List[Round], rounds_formatter: Callable, prompt_template: str) -> None:
+        with self._lock:
+            if self._future is not None and not self._future.done():
+                # the rounds left out are compressed by the next call once this one is published
+                return
+            token = self._token = CancellationToken()
+            self._future = _get_executor(self.config.max_workers).submit(
+                self._compress_in_background,
+                rounds,
+                rounds_formatter,
+                prompt_template,
+                token,
+            )
 
-        # not enough rounds to compress
-        if remaining_rounds < (self.rounds_to_compress + self.rounds_to_retain):
-            return self.previous_summary, rounds[-remaining_rounds:]
-
+    def _compress_in_background(
+        self,
+        rounds: List[Round],
+        rounds_formatter: Callable,
+        prompt_template: str,
+        token: CancellationToken,
+    ) -> None:
+        if token.cancelled:
+            return
+        state = self._state
+        with cancellation_scope(token):
+            new_state = self._compress(rounds, rounds_formatter, prompt_template, state)
+        if new_state is not None and not token.cancelled:
+            # the summary and the rounds it covers are published at once
+            self._state = new_state
+
+    def _compress(
+        self,
+        rounds: List[Round],
+        rounds_formatter: Callable,
+        prompt_template: str,
+        state: _CompressionState,
+    ) -> Optional[_CompressionState]:
+        remaining_rounds = self._count_remaining_rounds(rounds, state)
+        rounds_to_summarize = rounds[-remaining_rounds : -self.rounds_to_retain]
         chat_summary = self._summarize(
-            rounds[-remaining_rounds : -self.rounds_to_retain],
+            rounds_to_summarize,
             rounds_formatter,
             prompt_template=prompt_template,
+            previous_summary=state.summary,
         )
 
         self.tracing.set_span_attribute("chat_summary", chat_summary)
 
-        if len(chat_summary) > 0:  # if the compression is successful
-            self.previous_summary = chat_summary
-            return chat_summary, rounds[-self.rounds_to_retain :]
-        else:
-            return self.previous_summary, rounds[-remaining_rounds:]
+        if len(chat_summary) == 0:  # the compression failed
+            return None
+        return _CompressionState(
+            summary=chat_summary,
+            processed_rounds=state.processed_rounds | frozenset(_round.id for _round in rounds_to_summarize),
+        )
 
     @tracing_decorator
     def _summarize(
@@ -79,24 +225,26 @@ class RoundCompressor:
         rounds: List[Round],
         rounds_formatter: Callable,
         prompt_template: str = "{PREVIOUS_SUMMARY}, please compress the following rounds",
+        previous_summary: str = "None",
     ) -> str:
         assert "{PREVIOUS_SUMMARY}" in prompt_template, "Prompt template must contain {PREVIOUS_SUMMARY}"
         try:
             chat_history_str = rounds_formatter(rounds)
             system_instruction = prompt_template.format(
-                PREVIOUS_SUMMARY=self.previous_summary,
+                PREVIOUS_SUMMARY=previous_summary,
             )
             prompt = [
                 format_chat_message("system", system_instruction),
                 format_chat_message("user", chat_history_str),
             ]
 
-            with get_tracer().start_as_current_span("RoundCompressor.reply.chat_completion") as span:
+            with get_tracer().start_as_current_span("RoundCompressor.reply.chat_completion") as span, usage_context(
+                role="RoundCompressor",
+            ):
                 span.set_attribute("prompt", json.dumps(prompt, indent=2))
                 new_summary = self.llm_api.chat_completion(prompt, llm_alias=self.config.llm_alias)["content"]
                 span.set_attribute("summary", new_summary)
 
-            self.processed_rounds.update([_round.id for _round in rounds])
             return new_summary
         except Exception as e:
             self.logger.warning(f"Failed to compress rounds: {e}")
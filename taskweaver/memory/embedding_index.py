@@ -0,0 +1,391 @@
+import os
+import threading
+from typing import Callable, Dict, Generic, Hashable, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+
+from taskweaver.config.module_config import ModuleConfig
+
+KeyType = TypeVar("KeyType", bound=Hashable)
+
+
+class EmbeddingIndexConfig(ModuleConfig):
+    def _configure(self) -> None:
+        self._set_name("embedding_index")
+
+        # `exact` compares the query with all the embeddings, `ivf` only with the embeddings in the clusters
+        # closest to the query, which is approximate and scales to tens of thousands of embeddings
+        self.type = self._get_enum("type", ["exact", "ivf"], "exact")
+        # the number of clusters of the ivf index, 0 for the square root of the number of embeddings
+        self.ivf_nlist = self._get_int("ivf_nlist", 0)
+        # the number of clusters searched for a query, a larger number gives a better recall and a slower search
+        self.ivf_nprobe = self._get_int("ivf_nprobe", 16)
+        # the ivf index searches exactly until it has this number of embeddings to train the clusters
+        self.ivf_min_train_size = self._get_int("ivf_min_train_size", 2048)
+
+
+class EmbeddingIndex(Generic[KeyType]):
+    """
+    A thread-safe exact index of embeddings for cosine similarity search.
+    The embeddings are normalized once when they are added and kept in a contiguous float32 matrix,
+    so that a search is a single matrix-vector product followed by a partial sort of the top k.
+    Adding and removing an embedding updates the matrix in place.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._keys: List[KeyType] = []
+        self._rows: Dict[KeyType, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: KeyType) -> bool:
+        return key in self._rows
+
+    def keys(self) -> List[KeyType]:
+        with self._lock:
+            return list(self._keys)
+
+    def add(self, key: KeyType, embedding: Sequence[float]) -> None:
+        """Add the embedding of the key, or replace it if the key is already in the index."""
+        self.add_many([key], [embedding])
+
+    def add_many(self, keys: Sequence[KeyType], embeddings: Sequence[Sequence[float]]) -> None:
+        assert len(keys) == len(embeddings), "the number of keys and embeddings must be the same"
+        if len(keys) == 0:
+            return
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(keys), -1))
+        with self._lock:
+            self._add_vectors(keys, vectors)
+
+    def _add_vectors(self, keys: Sequence[KeyType], vectors: np.ndarray) -> List[int]:
+        """Put the normalized vectors into the matrix and return their rows. The lock must be held."""
+        if len(self._keys) == 0:
+            self._matrix = np.zeros((max(len(keys), 16), vectors.shape[1]), dtype=np.float32)
+        assert vectors.shape[1] == self._matrix.shape[1], (
+            f"the dimension of the embeddings {vectors.shape[1]} "
+            f"does not match the index dimension {self._matrix.shape[1]}"
+        )
+        rows: List[int] = []
+        for key, vector in zip(keys, vectors):
+            row = self._rows.get(key)
+            if row is None:
+                row = len(self._keys)
+                if row == self._matrix.shape[0]:
+                    # grow the capacity geometrically, so that adding is amortized O(d)
+                    grown = np.zeros((2 * row, self._matrix.shape[1]), dtype=np.float32)
+                    grown[:row] = self._matrix[:row]
+                    self._matrix = grown
+                self._keys.append(key)
+                self._rows[key] = row
+            self._matrix[row] = vector
+            rows.append(row)
+        return rows
+
+    def remove(self, key: KeyType) -> bool:
+        """Remove the key from the index by moving the last row into its place. Return whether it was present."""
+        with self._lock:
+            return self._remove_key(key)
+
+    def _remove_key(self, key: KeyType) -> bool:
+        row = self._rows.pop(key, None)
+        if row is None:
+            return False
+        last = len(self._keys) - 1
+        if row != last:
+            last_key = self._keys[last]
+            self._matrix[row] = self._matrix[last]
+            self._keys[row] = last_key
+            self._rows[last_key] = row
+        self._keys.pop()
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+            self._keys = []
+            self._rows = {}
+
+    def search(
+        self,
+        query: Sequence[float],
+        top_k: Optional[int] = None,
+        threshold: Optional[float] = None,
+    ) -> List[Tuple[KeyType, float]]:
+        """
+        Find the keys most similar to the query, in descending order of cosine similarity.
+
+        Args:
+            query: the query embedding.
+            top_k: the maximum number of keys to return, None for no limit.
+            threshold: the minimum similarity of the keys to return, None for no limit.
+        """
+        vector = self._normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        with self._lock:
+            if len(self._keys) == 0 or (top_k is not None and top_k <= 0):
+                return []
+            rows = self._probe(vector)
+            if rows is None:
+                rows = np.arange(len(self._keys))
+                similarities = self._matrix[: len(self._keys)] @ vector
+            else:
+                similarities = self._matrix[rows] @ vector
+
+            count = len(rows)
+            if top_k is not None and top_k < count:
+                candidates = np.argpartition(-similarities, top_k - 1)[:top_k]
+            else:
+                candidates = np.arange(count)
+            if threshold is not None:
+                candidates = candidates[similarities[candidates] >= threshold]
+            candidates = candidates[np.argsort(-similarities[candidates], kind="stable")]
+            return [(self._keys[rows[i]], float(similarities[i])) for i in candidates]
+
+    def _probe(self, vector: np.ndarray) -> Optional[np.ndarray]:
+        """The rows to compare with the normalized query, None for all the rows. The lock must be held."""
+        return None
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+class IVFEmbeddingIndex(EmbeddingIndex[KeyType]):
+    """
+    An approximate index of embeddings with an inverted file: the embeddings are clustered by spherical k-means,
+    and a search compares the query only with the embeddings in the `nprobe` clusters closest to it.
+
+    The index searches exactly until it has `min_train_size` embeddings. It is trained then, and trained again
+    whenever the number of embeddings doubles, while an added embedding is put in the cluster closest to it.
+    The clusters and the cluster of each key can be saved to a file, so that loading the index does not cluster
+    the embeddings again.
+    """
+
+    KMEANS_ITERATIONS = 10
+    # the number of embeddings sampled per cluster to train the clusters
+    TRAIN_SAMPLE_PER_LIST = 64
+    # the number of embeddings assigned to the clusters at once, which bounds the memory of the assignment
+    ASSIGN_CHUNK_SIZE = 8192
+
+    def __init__(self, nlist: int = 0, nprobe: int = 16, min_train_size: int = 2048, seed: int = 0) -> None:
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = max(min_train_size, 1)
+        self.seed = seed
+        self._centroids: Optional[np.ndarray] = None
+        self._trained_size = 0
+        # the cluster of each row, and the rows of each cluster
+        self._row_lists: List[int] = []
+        self._lists: List[List[int]] = []
+        self._list_arrays: Dict[int, np.ndarray] = {}
+        # the clusters of the keys loaded from a file, used when the keys are added
+        self._saved_lists: Dict[KeyType, int] = {}
+        self._dirty = False
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    @property
+    def is_dirty(self) -> bool:
+        """Whether the clusters changed since they were saved or loaded."""
+        return self._dirty
+
+    def train(self) -> None:
+        """Cluster the embeddings in the index, and assign the embeddings to the clusters."""
+        with self._lock:
+            self._train()
+
+    def clear(self) -> None:
+        super().clear()
+        with self._lock:
+            self._centroids = None
+            self._trained_size = 0
+            self._row_lists = []
+            self._lists = []
+            self._list_arrays = {}
+
+    def _add_vectors(self, keys: Sequence[KeyType], vectors: np.ndarray) -> List[int]:
+        rows = super()._add_vectors(keys, vectors)
+        if self._centroids is None:
+            self._row_lists.extend([-1] * (len(self._keys) - len(self._row_lists)))
+            if len(self._keys) >= self.min_train_size:
+                self._train()
+        elif len(self._keys) >= 2 * self._trained_size:
+            self._train()
+        else:
+            self._row_lists.extend([-1] * (len(self._keys) - len(self._row_lists)))
+            saved = [self._saved_lists.pop(key, -1) for key in keys]
+            nearest = self._nearest_lists(vectors)
+            for row, saved_list, nearest_list in zip(rows, saved, nearest):
+                if saved_list < 0 or saved_list >= len(self._lists):
+                    saved_list = int(nearest_list)
+                    self._dirty = True
+                self._assign_row(row, saved_list)
+        return rows
+
+    def _remove_key(self, key: KeyType) -> bool:
+        row = self._rows.get(key)
+        if row is None:
+            return False
+        last = len(self._keys) - 1
+        if self._centroids is not None:
+            self._lists[self._row_lists[row]].remove(row)
+            self._list_arrays.pop(self._row_lists[row], None)
+            if row != last:
+                # the last row is moved into the place of the removed row
+                last_list = self._lists[self._row_lists[last]]
+                last_list[last_list.index(last)] = row
+                self._list_arrays.pop(self._row_lists[last], None)
+            self._dirty = True
+        self._row_lists[row] = self._row_lists[last]
+        self._row_lists.pop()
+        return super()._remove_key(key)
+
+    def _probe(self, vector: np.ndarray) -> Optional[np.ndarray]:
+        if self._centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(self._lists))
+        scores = self._centroids @ vector
+        probed = np.argpartition(-scores, nprobe - 1)[:nprobe] if nprobe < len(self._lists) else range(nprobe)
+        return np.concatenate([self._get_list_array(int(list_id)) for list_id in probed])
+
+    def _get_list_array(self, list_id: int) -> np.ndarray:
+        array = self._list_arrays.get(list_id)
+        if array is None:
+            array = np.asarray(self._lists[list_id], dtype=np.int64)
+            self._list_arrays[list_id] = array
+        return array
+
+    def _assign_row(self, row: int, list_id: int) -> None:
+        previous = self._row_lists[row]
+        if previous == list_id:
+            return
+        if previous >= 0:
+            self._lists[previous].remove(row)
+            self._list_arrays.pop(previous, None)
+        self._row_lists[row] = list_id
+        self._lists[list_id].append(row)
+        self._list_arrays.pop(list_id, None)
+
+    def _nearest_lists(self, vectors: np.ndarray) -> np.ndarray:
+        assert self._centroids is not None
+        nearest = [
+            np.argmax(vectors[start : start + self.ASSIGN_CHUNK_SIZE] @ self._centroids.T, axis=1)
+            for start in range(0, len(vectors), self.ASSIGN_CHUNK_SIZE)
+        ]
+        return np.concatenate(nearest) if len(nearest) > 0 else np.zeros(0, dtype=np.int64)
+
+    def _train(self) -> None:
+        count = len(self._keys)
+        nlist = self.nlist if self.nlist > 0 else int(np.sqrt(count))
+        nlist = max(1, min(nlist, count))
+        data = self._matrix[:count]
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(count, nlist * self.TRAIN_SAMPLE_PER_LIST)
+        sample = data[rng.choice(count, sample_size, replace=False)] if sample_size < count else data
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.KMEANS_ITERATIONS):
+            assigned = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assigned, sample)
+            empty = np.bincount(assigned, minlength=nlist) == 0
+            # an empty cluster is restarted from a random embedding
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = self._normalize(sums)
+
+        self._centroids = centroids.astype(np.float32)
+        self._trained_size = count
+        self._saved_lists = {}
+        self._lists = [[] for _ in range(nlist)]
+        self._list_arrays = {}
+        self._row_lists = [int(list_id) for list_id in self._nearest_lists(data)]
+        for row, list_id in enumerate(self._row_lists):
+            self._lists[list_id].append(row)
+        self._dirty = True
+
+    def save(self, path: str, fingerprint: str = "") -> None:
+        """
+        Save the clusters and the cluster of each key. The keys are saved as strings.
+
+        Args:
+            path: the file path.
+            fingerprint: a string identifying the embeddings, e.g., the embedding model,
+                to discard the file when the embeddings change.
+        """
+        with self._lock:
+            if self._centroids is None:
+                return
+            keys = np.asarray([str(key) for key in self._keys], dtype=np.str_)
+            lists = np.asarray(self._row_lists, dtype=np.int32)
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp_path = f"{path}.tmp.npz"
+            np.savez(
+                tmp_path,
+                centroids=self._centroids,
+                trained_size=np.asarray(self._trained_size),
+                keys=keys,
+                lists=lists,
+                fingerprint=np.asarray(fingerprint, dtype=np.str_),
+            )
+            os.replace(tmp_path, path)
+            self._dirty = False
+
+    def load(self, path: str, fingerprint: str = "") -> bool:
+        """
+        Load the clusters saved with the same fingerprint into the empty index before the embeddings are added,
+        so that the embeddings of the saved keys are put in their saved clusters. Return whether it is loaded.
+        """
+        if not os.path.exists(path):
+            return False
+        with np.load(path, allow_pickle=False) as saved:
+            if str(saved["fingerprint"]) != fingerprint:
+                return False
+            with self._lock:
+                if len(self._keys) > 0:
+                    return False
+                self._centroids = saved["centroids"]
+                self._trained_size = int(saved["trained_size"])
+                self._lists = [[] for _ in range(len(self._centroids))]
+                self._list_arrays = {}
+                self._saved_lists = dict(zip(saved["keys"].tolist(), saved["lists"].tolist()))
+                self._dirty = False
+        return True
+
+
+def create_embedding_index(config: EmbeddingIndexConfig) -> EmbeddingIndex[str]:
+    if config.type == "ivf":
+        return IVFEmbeddingIndex(
+            nlist=config.ivf_nlist,
+            nprobe=config.ivf_nprobe,
+            min_train_size=config.ivf_min_train_size,
+        )
+    return EmbeddingIndex()
+
+
+class QueryEmbeddingCache:
+    """
+    The embeddings of the queries in the current round, so that the searches of a role in a round,
+    e.g., the plugin selection and the experience retrieval, embed a query once.
+    The embeddings are dropped when the round changes.
+    """
+
+    def __init__(self, embed: Callable[[str], List[float]]) -> None:
+        self.embed = embed
+        self._round_id: Optional[str] = None
+        self._embeddings: Dict[str, List[float]] = {}
+
+    def get(self, round_id: str, query: str) -> List[float]:
+        if round_id != self._round_id:
+            self._round_id = round_id
+            self._embeddings = {}
+        embedding = self._embeddings.get(query)
+        if embedding is None:
+            embedding = self.embed(query)
+            self._embeddings[query] = embedding
+        return embedding
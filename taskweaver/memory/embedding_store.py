@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+
+@dataclass
+class EmbeddingRecord:
+    key: str
+    embedding: Union[Sequence[float], np.ndarray]
+    model: Optional[str] = None
+    # the hash of the content the embedding is computed from, to find the stale embeddings
+    hash: Optional[str] = None
+    text: Optional[str] = None
+
+
+class EmbeddingStore:
+    """
+    A binary store of embeddings in a directory: one float32 `.npy` matrix opened memory-mapped,
+    the texts concatenated in one UTF-8 file, and a JSON manifest with the key, row, model, hash
+    and text offset of each embedding. Opening the store parses only the manifest.
+
+    A write produces new matrix and text files and then replaces the manifest atomically,
+    so that the readers, including other processes, always see a consistent store.
+    """
+
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, store_dir: str) -> None:
+        self.store_dir = store_dir
+        self._lock = threading.Lock()
+        self._version = 0
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._texts: Optional[np.ndarray] = None
+        self._load()
+
+    @staticmethod
+    def exists(store_dir: str) -> bool:
+        return os.path.exists(os.path.join(store_dir, EmbeddingStore.MANIFEST_FILE))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def keys(self) -> List[str]:
+        return list(self._entries.keys())
+
+    def get(self, key: str) -> Optional[EmbeddingRecord]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return self._to_record(key, entry)
+
+    def get_embeddings(self, keys: Sequence[str]) -> np.ndarray:
+        """Get the embeddings of the keys as a matrix, read from the memory-mapped file."""
+        with self._lock:
+            assert self._matrix is not None or len(keys) == 0, "the store is empty"
+            if len(keys) == 0:
+                return np.zeros((0, 0), dtype=np.float32)
+            rows = [self._entries[key]["row"] for key in keys]
+            return np.asarray(self._matrix[rows])  # type: ignore
+
+    def put_many(self, records: Iterable[EmbeddingRecord]) -> None:
+        """Add the records, or replace the records with the same keys."""
+        self.update(records, [])
+
+    def remove_many(self, keys: Iterable[str]) -> None:
+        self.update([], keys)
+
+    def update(self, records: Iterable[EmbeddingRecord], removed_keys: Iterable[str]) -> None:
+        records = list(records)
+        with self._lock:
+            replaced = set(record.key for record in records) | set(removed_keys)
+            kept = [(key, entry) for key, entry in self._entries.items() if key not in replaced]
+            if len(records) == 0 and len(kept) == len(self._entries):
+                return
+            all_records = [self._to_record(key, entry) for key, entry in kept] + records
+            self._write(all_records)
+
+    def _to_record(self, key: str, entry: Dict[str, Any]) -> EmbeddingRecord:
+        text: Optional[str] = None
+        if "text_offset" in entry:
+            start, length = entry["text_offset"], entry["text_length"]
+            text = bytes(self._texts[start : start + length]).decode("utf-8") if length > 0 else ""  # type: ignore
+        return EmbeddingRecord(
+            key=key,
+            embedding=self._matrix[entry["row"]],  # type: ignore
+            model=entry.get("model"),
+            hash=entry.get("hash"),
+            text=text,
+        )
+
+    def _load(self) -> None:
+        manifest_path = os.path.join(self.store_dir, self.MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        self._version = manifest["version"]
+        self._entries = {entry["key"]: entry for entry in manifest["entries"]}
+        self._matrix = np.load(os.path.join(self.store_dir, manifest["matrix"]), mmap_mode="r")
+        text_path = os.path.join(self.store_dir, manifest["texts"])
+        self._texts = np.memmap(text_path, dtype=np.uint8, mode="r") if os.path.getsize(text_path) > 0 else None
+
+    def _write(self, records: List[EmbeddingRecord]) -> None:
+        os.makedirs(self.store_dir, exist_ok=True)
+        version = self._version + 1
+        matrix_file = f"embeddings.{version}.npy"
+        text_file = f"texts.{version}.bin"
+
+        dim = len(records[0].embedding) if len(records) > 0 else 0
+        matrix = np.zeros((len(records), dim), dtype=np.float32)
+        entries: List[Dict[str, Any]] = []
+        text_offset = 0
+        with open(os.path.join(self.store_dir, text_file), "wb") as f:
+            for row, record in enumerate(records):
+                assert len(record.embedding) == dim, f"the dimension of the embedding of {record.key} is not {dim}"
+                matrix[row] = np.asarray(record.embedding, dtype=np.float32)
+                entry: Dict[str, Any] = {"key": record.key, "row": row, "model": record.model, "hash": record.hash}
+                if record.text is not None:
+                    encoded = record.text.encode("utf-8")
+                    f.write(encoded)
+                    entry["text_offset"] = text_offset
+                    entry["text_length"] = len(encoded)
+                    text_offset += len(encoded)
+                entries.append(entry)
+        np.save(os.path.join(self.store_dir, matrix_file), matrix)
+
+        manifest = {"version": version, "dim": dim, "matrix": matrix_file, "texts": text_file, "entries": entries}
+        manifest_path = os.path.join(self.store_dir, self.MANIFEST_FILE)
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+        # the files of the previous versions stay readable by the processes having them mapped
+        for name in os.listdir(self.store_dir):
+            if name.startswith(("embeddings.", "texts.")) and name not in (matrix_file, text_file):
+                try:
+                    os.remove(os.path.join(self.store_dir, name))
+                except OSError:
+                    pass
+        self._load()
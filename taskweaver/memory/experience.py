@@ -1,17 +1,25 @@
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Literal, Optional, Tuple
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
 
-import numpy as np
 from injector import inject
-from sklearn.metrics.pairwise import cosine_similarity
 
 from taskweaver.config.module_config import ModuleConfig
 from taskweaver.llm import LLMApi, format_chat_message
+from taskweaver.llm.usage import usage_context
 from taskweaver.logging import TelemetryLogger
+from taskweaver.memory.embedding_index import (
+    EmbeddingIndex,
+    EmbeddingIndexConfig,
+    IVFEmbeddingIndex,
+    create_embedding_index,
+)
+from taskweaver.memory.embedding_store import EmbeddingRecord, EmbeddingStore
 from taskweaver.module.tracing import Tracing, tracing_decorator
-from taskweaver.utils import read_yaml, write_yaml
+from taskweaver.utils import generate_md5_hash, read_yaml, write_yaml
 
 
 @dataclass
@@ -21,6 +29,8 @@ class Experience:
     raw_experience_path: Optional[str] = None
     embedding_model: Optional[str] = None
     embedding: List[float] = field(default_factory=list)
+    # the hash of the raw or handcrafted experience the experience is built from
+    source_hash: Optional[str] = None
 
     def to_dict(self):
         return {
@@ -29,6 +39,7 @@ class Experience:
             "raw_experience_path": self.raw_experience_path,
             "embedding_model": self.embedding_model,
             "embedding": self.embedding,
+            "source_hash": self.source_hash,
         }
 
     @staticmethod
@@ -39,6 +50,7 @@ class Experience:
             raw_experience_path=d["raw_experience_path"] if "raw_experience_path" in d else None,
             embedding_model=d["embedding_model"] if "embedding_model" in d else None,
             embedding=d["embedding"] if "embedding" in d else [],
+            source_hash=d["source_hash"] if "source_hash" in d else None,
         )
 
 
@@ -58,9 +70,23 @@ class ExperienceConfig(ModuleConfig):
             ),
         )
         self.retrieve_threshold = self._get_float("retrieve_threshold", 0.2)
+        # the maximum number of experiences retrieved for a query, 0 for no limit
+        self.retrieve_top_k = self._get_int("retrieve_top_k", 0)
 
         self.llm_alias = self._get_str("llm_alias", default="", required=False)
 
+        # the number of experiences summarized concurrently in a refresh
+        self.refresh_concurrency = self._get_int("refresh_concurrency", 4)
+        # the retries of a failed summarization, with an exponential backoff from the delay in seconds
+        self.refresh_max_retries = self._get_int("refresh_max_retries", 2)
+        self.refresh_retry_delay = self._get_float("refresh_retry_delay", 1.0)
+        # the number of summarized experiences embedded and saved at once
+        self.refresh_batch_size = self._get_int("refresh_batch_size", 8)
+
+        # the summarized experiences and their embeddings are in a yaml file per experience,
+        # or in a binary embedding store per role, which is opened without parsing
+        self.storage = self._get_enum("storage", ["yaml", "npy"], "yaml")
+
 
 class ExperienceGenerator:
     @inject
@@ -70,6 +96,7 @@ class ExperienceGenerator:
         config: ExperienceConfig,
         logger: TelemetryLogger,
         tracing: Tracing,
+        index_config: EmbeddingIndexConfig,
     ):
         self.config = config
         self.llm_api = llm_api
@@ -78,13 +105,28 @@ class ExperienceGenerator:
 
         self.default_prompt_template = read_yaml(self.config.default_exp_prompt_path)["content"]
 
-        self.experience_list: List[Experience] = []
+        self.experiences: Dict[str, Experience] = {}
+        self.experience_index: EmbeddingIndex[str] = create_embedding_index(index_config)
 
         self.exception_message_for_refresh = (
             "Please cd to the `script` directory and "
             "run `python -m experience_mgt --refresh` to refresh the experience."
         )
 
+    @property
+    def experience_list(self) -> List[Experience]:
+        return list(self.experiences.values())
+
+    def add_experience(self, experience: Experience) -> None:
+        """Add the experience to the index, or replace the experience with the same id."""
+        self.experiences[experience.exp_id] = experience
+        self.experience_index.add(experience.exp_id, experience.embedding)
+
+    def remove_experience(self, exp_id: str) -> None:
+        """Remove the experience from the index."""
+        self.experiences.pop(exp_id, None)
+        self.experience_index.remove(exp_id)
+
     @staticmethod
     def _preprocess_conversation_data(
         conv_data: dict,
@@ -124,7 +166,8 @@ class ExperienceGenerator:
             format_chat_message("user", json.dumps(conversation)),
         ]
         self.tracing.set_span_attribute("prompt", json.dumps(prompt, indent=2))
-        summarized_experience = self.llm_api.chat_completion(prompt, llm_alias=self.config.llm_alias)["content"]
+        with usage_context(role="ExperienceGenerator"):
+            summarized_experience = self.llm_api.chat_completion(prompt, llm_alias=self.config.llm_alias)["content"]
 
         return summarized_experience
 
@@ -133,25 +176,37 @@ class ExperienceGenerator:
         self,
         target_role: Literal["Planner", "CodeInterpreter", "All"],
         prompt: Optional[str] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
     ):
+        """
+        Summarize and embed the experiences which are new or whose source has changed.
+
+        The summarizations run concurrently, and the experiences are embedded and saved in batches as they finish,
+        so that an interrupted refresh resumes from the experiences not saved yet.
+
+        Args:
+            target_role: the role to summarize the experiences for.
+            prompt: the prompt to summarize the raw experiences, defaults to the default prompt.
+            progress: a callback called with the number of the experiences done and the total.
+        """
         if not os.path.exists(self.config.experience_dir):
             raise ValueError(f"Experience directory {self.config.experience_dir} does not exist.")
 
-        exp_files = os.listdir(self.config.experience_dir)
+        exp_files = set(os.listdir(self.config.experience_dir))
 
-        raw_exp_ids = [
+        raw_exp_ids = set(
             os.path.splitext(os.path.basename(exp_file))[0].split("_")[2]
             for exp_file in exp_files
             if exp_file.startswith("raw_exp")
-        ]
+        )
 
-        handcrafted_exp_ids = [
+        handcrafted_exp_ids = set(
             os.path.splitext(os.path.basename(exp_file))[0].split("_")[2]
             for exp_file in exp_files
             if exp_file.startswith("handcrafted_exp")
-        ]
+        )
 
-        exp_ids = raw_exp_ids + handcrafted_exp_ids
+        exp_ids = sorted(raw_exp_ids | handcrafted_exp_ids)
 
         if len(exp_ids) == 0:
             self.logger.warning(
@@ -161,56 +216,133 @@ class ExperienceGenerator:
             )
             return
 
-        to_be_embedded = []
-        for idx, exp_id in enumerate(exp_ids):
-            rebuild_flag = False
-            exp_file_name = f"{target_role}_exp_{exp_id}.yaml"
-            if exp_file_name not in os.listdir(self.config.experience_dir):
-                rebuild_flag = True
-            else:
-                exp_file_path = os.path.join(self.config.experience_dir, exp_file_name)
-                experience = read_yaml(exp_file_path)
-                if (
-                    experience["embedding_model"] != self.llm_api.embedding_service.config.embedding_model
-                    or len(experience["embedding"]) == 0
-                ):
-                    rebuild_flag = True
+        store = self._get_store(target_role) if self.config.storage == "npy" else None
+        embedding_model = self.llm_api.embedding_service.config.embedding_model
 
+        # the experience is summarized again when its source changes
+        stale: Dict[str, str] = {}
+        for exp_id in exp_ids:
+            source_hash = self._get_source_hash(exp_id, exp_id in raw_exp_ids)
+            if store is not None:
+                record = store.get(exp_id)
+                rebuild_flag = record is None or record.model != embedding_model or record.hash != source_hash
+            else:
+                exp_file_name = f"{target_role}_exp_{exp_id}.yaml"
+                rebuild_flag = exp_file_name not in exp_files or self._is_stale_yaml(
+                    os.path.join(self.config.experience_dir, exp_file_name),
+                    embedding_model,
+                    source_hash,
+                )
             if rebuild_flag:
-                if exp_id in raw_exp_ids:
-                    summarized_experience = self.summarize_experience(exp_id, prompt, target_role)
-                    experience_obj = Experience(
-                        experience_text=summarized_experience,
-                        exp_id=exp_id,
-                        raw_experience_path=os.path.join(
-                            self.config.experience_dir,
-                            f"raw_exp_{exp_id}.yaml",
-                        ),
-                    )
-                elif exp_id in handcrafted_exp_ids:
-                    handcrafted_exp_file_path = os.path.join(
-                        self.config.experience_dir,
-                        f"handcrafted_exp_{exp_id}.yaml",
-                    )
-                    experience_obj = Experience.from_dict(read_yaml(handcrafted_exp_file_path))
-                else:
-                    raise ValueError(f"Experience {exp_id} not found in raw or handcrafted experience.")
-
-                to_be_embedded.append(experience_obj)
-
-        if len(to_be_embedded) == 0:
+                stale[exp_id] = source_hash
+
+        if len(stale) == 0:
             return
-        else:
-            exp_embeddings = self.llm_api.get_embedding_list(
-                [exp.experience_text for exp in to_be_embedded],
+
+        self.logger.info(f"Refreshing {len(stale)} of {len(exp_ids)} experiences for {target_role}.")
+        done = 0
+        failed: List[str] = []
+        batch: List[Experience] = []
+        with ThreadPoolExecutor(
+            max_workers=self.config.refresh_concurrency,
+            thread_name_prefix="experience_refresh",
+        ) as executor:
+            futures = {
+                executor.submit(self._build_experience, exp_id, exp_id in raw_exp_ids, prompt, target_role): exp_id
+                for exp_id in stale
+            }
+            for future in as_completed(futures):
+                exp_id = futures[future]
+                try:
+                    experience = future.result()
+                    experience.source_hash = stale[exp_id]
+                    batch.append(experience)
+                except Exception as e:
+                    self.logger.warning(f"Failed to summarize experience {exp_id}: {e}")
+                    failed.append(exp_id)
+                if len(batch) >= self.config.refresh_batch_size:
+                    self._save_experiences(batch, target_role, store, embedding_model)
+                    batch = []
+                done += 1
+                self.logger.info(f"Refreshed {done}/{len(stale)} experiences for {target_role}.")
+                if progress is not None:
+                    progress(done, len(stale))
+            if len(batch) > 0:
+                self._save_experiences(batch, target_role, store, embedding_model)
+
+        if len(failed) > 0:
+            raise ValueError(
+                f"Failed to summarize experiences {sorted(failed)}. "
+                "The other experiences are saved, and the failed ones are retried in the next refresh.",
             )
-            for i, exp in enumerate(to_be_embedded):
-                exp.embedding = exp_embeddings[i]
-                exp.embedding_model = self.llm_api.embedding_service.config.embedding_model
+        self.logger.info("Experience obj saved.")
+
+    @staticmethod
+    def _is_stale_yaml(exp_file_path: str, embedding_model: str, source_hash: str) -> bool:
+        experience = read_yaml(exp_file_path)
+        return (
+            experience["embedding_model"] != embedding_model
+            or len(experience["embedding"]) == 0
+            # the experiences saved before the source hash is recorded are kept
+            or experience.get("source_hash", source_hash) != source_hash
+        )
+
+    def _build_experience(
+        self,
+        exp_id: str,
+        is_raw: bool,
+        prompt: Optional[str],
+        target_role: Literal["Planner", "CodeInterpreter", "All"],
+    ) -> Experience:
+        if not is_raw:
+            handcrafted_exp_file_path = os.path.join(self.config.experience_dir, f"handcrafted_exp_{exp_id}.yaml")
+            return Experience.from_dict(read_yaml(handcrafted_exp_file_path))
+
+        attempt = 0
+        while True:
+            try:
+                summarized_experience = self.summarize_experience(exp_id, prompt, target_role)
+                break
+            except Exception as e:
+                if attempt >= self.config.refresh_max_retries:
+                    raise
+                delay = self.config.refresh_retry_delay * (2**attempt)
+                attempt += 1
+                self.logger.warning(f"Retrying to summarize experience {exp_id} in {delay:.1f}s: {e}")
+                time.sleep(delay)
+        return Experience(
+            experience_text=summarized_experience,
+            exp_id=exp_id,
+            raw_experience_path=os.path.join(self.config.experience_dir, f"raw_exp_{exp_id}.yaml"),
+        )
+
+    def _save_experiences(
+        self,
+        experiences: List[Experience],
+        target_role: str,
+        store: Optional[EmbeddingStore],
+        embedding_model: str,
+    ):
+        exp_embeddings = self.llm_api.get_embedding_list([exp.experience_text for exp in experiences])
+        records: List[EmbeddingRecord] = []
+        for exp, embedding in zip(experiences, exp_embeddings):
+            exp.embedding = embedding
+            exp.embedding_model = embedding_model
+            if store is not None:
+                records.append(
+                    EmbeddingRecord(
+                        key=exp.exp_id,
+                        embedding=exp.embedding,
+                        model=exp.embedding_model,
+                        hash=exp.source_hash,
+                        text=exp.experience_text,
+                    ),
+                )
+            else:
                 experience_file_path = os.path.join(self.config.experience_dir, f"{target_role}_exp_{exp.exp_id}.yaml")
                 write_yaml(experience_file_path, exp.to_dict())
-
-            self.logger.info("Experience obj saved.")
+        if store is not None:
+            store.put_many(records)
 
     @tracing_decorator
     def load_experience(
@@ -234,47 +366,134 @@ class ExperienceGenerator:
             )
             return
 
-        for exp_id in exp_ids:
-            exp_file = f"{target_role}_exp_{exp_id}.yaml"
-            exp_file_path = os.path.join(self.config.experience_dir, exp_file)
-            assert os.path.exists(exp_file_path), (
-                f"Experience {exp_file} for {target_role} not found. " + self.exception_message_for_refresh
-            )
+        embedding_model = self.llm_api.embedding_service.config.embedding_model
+        index_path = self._get_index_path(target_role)
+        if isinstance(self.experience_index, IVFEmbeddingIndex):
+            # the saved clusters are reused, so that the experiences are not clustered again
+            self.experience_index.load(index_path, embedding_model)
+
+        if self.config.storage == "npy":
+            self._load_experience_from_store(target_role, exp_ids)
+        else:
+            experiences: List[Experience] = []
+            for exp_id in exp_ids:
+                exp_file = f"{target_role}_exp_{exp_id}.yaml"
+                exp_file_path = os.path.join(self.config.experience_dir, exp_file)
+                assert os.path.exists(exp_file_path), (
+                    f"Experience {exp_file} for {target_role} not found. " + self.exception_message_for_refresh
+                )
 
-            experience = read_yaml(exp_file_path)
+                experience = read_yaml(exp_file_path)
 
-            assert len(experience["embedding"]) > 0, (
-                f"Experience {exp_file} has no embedding." + self.exception_message_for_refresh
+                assert len(experience["embedding"]) > 0, (
+                    f"Experience {exp_file} has no embedding." + self.exception_message_for_refresh
+                )
+                assert experience["embedding_model"] == embedding_model, (
+                    f"Experience {exp_file} has different embedding model. " + self.exception_message_for_refresh
+                )
+
+                experiences.append(Experience(**experience))
+            for experience in experiences:
+                self.experiences[experience.exp_id] = experience
+            self.experience_index.add_many(exp_ids, [experience.embedding for experience in experiences])
+
+        if isinstance(self.experience_index, IVFEmbeddingIndex) and self.experience_index.is_dirty:
+            self.experience_index.save(index_path, embedding_model)
+
+    def _load_experience_from_store(self, target_role: str, exp_ids: List[str]):
+        store = self._get_store(target_role)
+        embedding_model = self.llm_api.embedding_service.config.embedding_model
+        experiences: List[Experience] = []
+        for exp_id in exp_ids:
+            record = store.get(exp_id)
+            assert record is not None, (
+                f"Experience {exp_id} for {target_role} not found. " + self.exception_message_for_refresh
             )
-            assert experience["embedding_model"] == self.llm_api.embedding_service.config.embedding_model, (
-                f"Experience {exp_file} has different embedding model. " + self.exception_message_for_refresh
+            assert record.model == embedding_model, (
+                f"Experience {exp_id} has different embedding model. " + self.exception_message_for_refresh
             )
+            raw_experience_path = os.path.join(self.config.experience_dir, f"raw_exp_{exp_id}.yaml")
+            experiences.append(
+                Experience(
+                    experience_text=record.text or "",
+                    exp_id=exp_id,
+                    raw_experience_path=raw_experience_path if os.path.exists(raw_experience_path) else None,
+                    embedding_model=record.model,
+                    embedding=record.embedding,  # type: ignore
+                ),
+            )
+        # the embeddings are added to the index at once from the memory-mapped matrix
+        for experience in experiences:
+            self.experiences[experience.exp_id] = experience
+        self.experience_index.add_many(exp_ids, store.get_embeddings(exp_ids))
+
+    def migrate_experience(self, target_role: Literal["Planner", "CodeInterpreter", "All"]):
+        """Copy the experiences of the role in the yaml files to the binary embedding store."""
+        assert self.config.storage == "npy", "experience.storage must be npy to migrate the experiences"
+        prefix = f"{target_role}_exp_"
+        records: List[EmbeddingRecord] = []
+        for exp_file in os.listdir(self.config.experience_dir):
+            if not (exp_file.startswith(prefix) and exp_file.endswith(".yaml")):
+                continue
+            experience = Experience.from_dict(read_yaml(os.path.join(self.config.experience_dir, exp_file)))
+            if len(experience.embedding) == 0:
+                continue
+            is_raw = os.path.exists(os.path.join(self.config.experience_dir, f"raw_exp_{experience.exp_id}.yaml"))
+            records.append(
+                EmbeddingRecord(
+                    key=experience.exp_id,
+                    embedding=experience.embedding,
+                    model=experience.embedding_model,
+                    hash=self._get_source_hash(experience.exp_id, is_raw),
+                    text=experience.experience_text,
+                ),
+            )
+        self._get_store(target_role).put_many(records)
+        self.logger.info(f"Migrated {len(records)} experiences of {target_role}.")
 
-            self.experience_list.append(Experience(**experience))
+    def _get_store(self, target_role: str) -> EmbeddingStore:
+        return EmbeddingStore(os.path.join(self.config.experience_dir, "embeddings", target_role))
 
-    @tracing_decorator
-    def retrieve_experience(self, user_query: str) -> List[Tuple[Experience, float]]:
-        user_query_embedding = np.array(self.llm_api.get_embedding(user_query))
+    def _get_index_path(self, target_role: str) -> str:
+        return os.path.join(self.config.experience_dir, "embeddings", target_role, "ivf_index.npz")
 
-        similarities = []
+    def _get_source_hash(self, exp_id: str, is_raw: bool) -> str:
+        source_file = f"raw_exp_{exp_id}.yaml" if is_raw else f"handcrafted_exp_{exp_id}.yaml"
+        source_path = os.path.join(self.config.experience_dir, source_file)
+        if not os.path.exists(source_path):
+            return ""
+        with open(source_path, "r", encoding="utf-8") as f:
+            return generate_md5_hash(f.read())
 
-        for experience in self.experience_list:
-            similarity = cosine_similarity(
-                user_query_embedding.reshape(
-                    1,
-                    -1,
-                ),
-                np.array(experience.embedding).reshape(1, -1),
+    @tracing_decorator
+    def retrieve_experience(
+        self,
+        user_query: str,
+        top_k: Optional[int] = None,
+        query_embedding: Optional[List[float]] = None,
+    ) -> List[Tuple[Experience, float]]:
+        """
+        Retrieve the experiences similar to the query, in descending order of similarity.
+
+        Args:
+            user_query: the query.
+            top_k: the maximum number of experiences to retrieve, defaults to `experience.retrieve_top_k`.
+            query_embedding: the embedding of the query if it is already computed, e.g., for plugin selection.
+        """
+        if top_k is None and self.config.retrieve_top_k > 0:
+            top_k = self.config.retrieve_top_k
+        if len(self.experience_index) == 0:
+            selected = []
+        else:
+            if query_embedding is None:
+                query_embedding = self.llm_api.get_embedding(user_query)
+            selected = self.experience_index.search(
+                query_embedding,
+                top_k=top_k,
+                threshold=self.config.retrieve_threshold,
             )
-            similarities.append((experience, similarity))
-
-        experience_rank = sorted(
-            similarities,
-            key=lambda x: x[1],
-            reverse=True,
-        )
 
-        selected_experiences = [(exp, sim) for exp, sim in experience_rank if sim >= self.config.retrieve_threshold]
+        selected_experiences = [(self.experiences[exp_id], sim) for exp_id, sim in selected]
         self.logger.info(f"Retrieved {len(selected_experiences)} experiences.")
         self.logger.info(f"Retrieved experiences: {[exp.exp_id for exp, sim in selected_experiences]}")
         return selected_experiences
@@ -289,6 +508,9 @@ class ExperienceGenerator:
     def delete_experience(self, exp_id: str, target_role: Literal["Planner", "CodeInterpreter"]):
         exp_file_name = f"{target_role}_exp_{exp_id}.yaml"
         self._delete_exp_file(exp_file_name)
+        if self.config.storage == "npy":
+            self._get_store(target_role).remove_many([exp_id])
+        self.remove_experience(exp_id)
 
     def delete_raw_experience(self, exp_id: str):
         exp_file_name = f"raw_exp_{exp_id}.yaml"
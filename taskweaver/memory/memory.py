@@ -1,17 +1,84 @@
 from __future__ import annotations
 
-import copy
 import os
-from typing import List
+import threading
+from typing import Dict, List, Optional, Tuple
 
-from taskweaver.memory.attachment import AttachmentType
+from taskweaver.memory.attachment import AttachmentType, AttachmentView
 from taskweaver.memory.conversation import Conversation
-from taskweaver.memory.round import Round
+from taskweaver.memory.post import Post, PostView
+from taskweaver.memory.round import Round, RoundView
 from taskweaver.memory.type_vars import RoleName
 from taskweaver.module.prompt_util import PromptUtil
 from taskweaver.utils import write_yaml
 
 
+class _RoleRound:
+    """
+    The posts of a round sent from or to a role, maintained incrementally: the new posts of the round are
+    appended when the round is read, and each post is sanitized once for each of the two forms of the rounds,
+    i.e., the last round with the delimiters removed and the earlier rounds with the temporal parts removed.
+    A form is built when it is first read, and the form of the last round is dropped when the round is read as
+    an earlier round, so that a round usually keeps one form. The two forms share the views of the attachments.
+    """
+
+    def __init__(self, role: RoleName, source: Round) -> None:
+        self.role = role
+        self.source = source
+        self.scanned = 0
+        self.posts: List[Post] = []
+        self.attachments: List[Tuple[AttachmentView, ...]] = []
+        self.current: Optional[List[PostView]] = None
+        self.history: Optional[List[PostView]] = None
+        self.views: Dict[bool, RoundView] = {}
+
+    def sync(self) -> None:
+        new_posts = self.source.post_list[self.scanned :]
+        if len(new_posts) == 0:
+            return
+        self.scanned += len(new_posts)
+        for post in new_posts:
+            if post.send_from != self.role and post.send_to != self.role:
+                continue
+            attachments = tuple(AttachmentView.of(a) for a in post.attachment_list)
+            self.posts.append(post)
+            self.attachments.append(attachments)
+            if self.current is not None:
+                self.current.append(self._to_current(post, attachments))
+            if self.history is not None:
+                self.history.append(self._to_history(post, attachments))
+        self.views.clear()
+
+    def get_view(self, is_last: bool) -> RoundView:
+        view = self.views.get(is_last)
+        if view is None or view.state != self.source.state:
+            if is_last:
+                if self.current is None:
+                    self.current = [self._to_current(p, a) for p, a in zip(self.posts, self.attachments)]
+                post_list = self.current
+            else:
+                if self.history is None:
+                    self.history = [self._to_history(p, a) for p, a in zip(self.posts, self.attachments)]
+                    # a round read as an earlier round is rarely the last round again
+                    self.current = None
+                    self.views.pop(True, None)
+                post_list = self.history
+            view = self.views[is_last] = RoundView.of(self.source, post_list)
+        return view
+
+    @staticmethod
+    def _to_current(post: Post, attachments: Tuple[AttachmentView, ...]) -> PostView:
+        return PostView.of(post, PromptUtil.remove_all_delimiters(post.message), attachments)
+
+    @staticmethod
+    def _to_history(post: Post, attachments: Tuple[AttachmentView, ...]) -> PostView:
+        return PostView.of(
+            post,
+            PromptUtil.remove_parts(post.message, delimiter=PromptUtil.DELIMITER_TEMPORAL),
+            attachments,
+        )
+
+
 class Memory:
     """
     Memory is used to store all the conversations in the system,
@@ -21,6 +88,8 @@ class Memory:
     def __init__(self, session_id: str) -> None:
         self.session_id = session_id
         self.conversation = Conversation.init()
+        self._role_rounds: Dict[Tuple[RoleName, str], _RoleRound] = {}
+        self._role_rounds_lock = threading.Lock()
 
     def create_round(self, user_query: str) -> Round:
         """Create a round with the given query."""
@@ -30,33 +99,30 @@ class Memory:
 
     def get_role_rounds(self, role: RoleName, include_failure_rounds: bool = False) -> List[Round]:
         """Get all the rounds of the given role in the memory.
-        TODO: better do cache here to avoid recreating the round list (new object) every time.
+        The temporal parts are removed from the messages of the rounds except the last one,
+        whose messages only have the delimiters removed.
+        The rounds are read-only views maintained incrementally, so that only the posts added since the last call
+        are processed. Deep copy a round to modify it.
 
         Args:
             role: the role of the memory.
             include_failure_rounds: whether to include the failure rounds.
         """
-        rounds_from_role: List[Round] = []
-        for round in self.conversation.rounds:
-            if round.state == "failed" and not include_failure_rounds:
-                continue
-            new_round = Round.create(user_query=round.user_query, id=round.id, state=round.state)
-            for post in round.post_list:
-                if post.send_from == role or post.send_to == role:
-                    new_round.add_post(copy.deepcopy(post))
-            rounds_from_role.append(new_round)
-        # Remove the temporal parts from the text of the posts of rounds
-        for round in rounds_from_role[:-1]:
-            for post in round.post_list:
-                post.message = PromptUtil.remove_parts(
-                    post.message,
-                    delimiter=PromptUtil.DELIMITER_TEMPORAL,
-                )
-        # Remove the delimiters from the text of the posts of the last round
-        for post in rounds_from_role[-1].post_list:
-            post.message = PromptUtil.remove_all_delimiters(post.message)
-
-        return rounds_from_role
+        rounds = [round for round in self.conversation.rounds if include_failure_rounds or round.state != "failed"]
+        with self._role_rounds_lock:
+            if len(self._role_rounds) > 2 * len(self.conversation.rounds) + 8:
+                # drop the rounds removed from the conversation
+                round_ids = set(round.id for round in self.conversation.rounds)
+                self._role_rounds = {k: v for k, v in self._role_rounds.items() if k[1] in round_ids}
+
+            rounds_from_role: List[Round] = []
+            for index, round in enumerate(rounds):
+                role_round = self._role_rounds.get((role, round.id))
+                if role_round is None or role_round.source is not round:
+                    role_round = self._role_rounds[(role, round.id)] = _RoleRound(role, round)
+                role_round.sync()
+                rounds_from_role.append(role_round.get_view(is_last=index == len(rounds) - 1))
+            return rounds_from_role
 
     def save_experience(self, exp_dir: str, thin_mode: bool = True) -> None:
         raw_exp_path = os.path.join(exp_dir, f"raw_exp_{self.session_id}.yaml")
@@ -181,11 +181,11 @@ class PluginEntry:
     meta_data: Optional[PluginMetaData] = None
 
     @staticmethod
-    def from_yaml_file(path: str) -> Optional["PluginEntry"]:
+    def from_yaml_file(path: str, load_meta_data: bool = True) -> Optional["PluginEntry"]:
         content = read_yaml(path)
         yaml_file_name = os.path.basename(path)
         meta_file_path = os.path.join(os.path.dirname(path), ".meta", f"meta_{yaml_file_name}")
-        if os.path.exists(meta_file_path):
+        if load_meta_data and os.path.exists(meta_file_path):
             meta_data = PluginMetaData.from_dict(read_yaml(meta_file_path))
             meta_data.path = meta_file_path
         else:
@@ -264,11 +264,17 @@ class PluginRegistry(ComponentRegistry[PluginEntry]):
         self,
         file_glob: str,
         ttl: Optional[timedelta] = None,
+        embedding_storage: str = "yaml",
     ) -> None:
         super().__init__(file_glob, ttl)
+        # the embeddings are in the meta yaml files of the plugins, or in a binary embedding store
+        self.embedding_storage = embedding_storage
 
     def _load_component(self, path: str) -> Tuple[str, PluginEntry]:
-        entry: Optional[PluginEntry] = PluginEntry.from_yaml_file(path)
+        entry: Optional[PluginEntry] = PluginEntry.from_yaml_file(
+            path,
+            load_meta_data=self.embedding_storage == "yaml",
+        )
         if entry is None:
             raise Exception(f"failed to loading plugin from {path}")
         if not entry.enabled:
@@ -287,6 +293,7 @@ class PluginModuleConfig(ModuleConfig):
                 "plugins",
             ),
         )
+        self.embedding_storage = self._get_enum("embedding_storage", ["yaml", "npy"], "yaml")
 
 
 class PluginModule(Module):
@@ -301,4 +308,5 @@ class PluginModule(Module):
         return PluginRegistry(
             file_glob=file_glob,
             ttl=timedelta(minutes=10),
+            embedding_storage=config.embedding_storage,
         )
@@ -1,15 +1,17 @@
 from __future__ import annotations
 
+import copy
 import secrets
+import sys
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from taskweaver.memory.attachment import Attachment, AttachmentType
+from taskweaver.memory.attachment import Attachment, AttachmentType, AttachmentView
 from taskweaver.memory.type_vars import RoleName
 from taskweaver.utils import create_id
 
 
-@dataclass
+@dataclass(slots=True)
 class Post:
     """
     A post is the message used to communicate between two roles.
@@ -32,6 +34,11 @@ class Post:
     message: str
     attachment_list: List[Attachment]
 
+    def __post_init__(self) -> None:
+        # the role names are repeated in every post, so that a session loaded from a file shares them
+        self.send_from = sys.intern(self.send_from)
+        self.send_to = sys.intern(self.send_to)
+
     @staticmethod
     def create(
         message: Optional[str],
@@ -94,3 +101,47 @@ class Post:
     def del_attachment(self, type_list: List[AttachmentType]) -> None:
         """Delete all the attachments of the given type."""
         self.attachment_list = [attachment for attachment in self.attachment_list if attachment.type not in type_list]
+
+
+class PostView(Post):
+    """
+    A read-only view of a post, which can be shared by the callers without copying it.
+    Its deep copy is a writable post, so that a caller only pays for copying the posts it modifies.
+    """
+
+    __slots__ = ()
+
+    @staticmethod
+    def of(
+        post: Post,
+        message: Optional[str] = None,
+        attachment_list: Optional[Tuple[AttachmentView, ...]] = None,
+    ) -> PostView:
+        """
+        Create a view of the post, optionally with another message, e.g., with the temporal parts removed,
+        and with the views of its attachments shared with another view of the post.
+        """
+        view = object.__new__(PostView)
+        object.__setattr__(view, "id", post.id)
+        object.__setattr__(view, "send_from", post.send_from)
+        object.__setattr__(view, "send_to", post.send_to)
+        object.__setattr__(view, "message", message if message is not None else post.message)
+        if attachment_list is None:
+            attachment_list = tuple(AttachmentView.of(a) for a in post.attachment_list)
+        object.__setattr__(view, "attachment_list", attachment_list)
+        return view
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"PostView is read-only, deepcopy it to modify {name}")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"PostView is read-only, deepcopy it to modify {name}")
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Post:
+        return Post(
+            id=self.id,
+            send_from=self.send_from,
+            send_to=self.send_to,
+            message=self.message,
+            attachment_list=[copy.deepcopy(a, memo) for a in self.attachment_list],
+        )
@@ -1,28 +1,35 @@
 from __future__ import annotations
 
+import copy
 import secrets
-from dataclasses import dataclass
-from typing import Any, Dict, List, Literal, Optional, Union
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Literal, Optional, Sequence, Union
 
 from taskweaver.memory.type_vars import RoundState
 from taskweaver.utils import create_id
 
-from .post import Post
+from .post import Post, PostView
 
 
-@dataclass
+@dataclass(slots=True)
 class Round:
     """A round is the basic unit of conversation in the project, which is a collection of posts.
 
     Args:
         id: the unique id of the round.
         post_list: a list of posts in the round.
+        usage: the token usage of the LLM requests in the round, by role and LLM alias.
     """
 
     id: str
     user_query: str
     state: RoundState
     post_list: List[Post]
+    usage: Dict[str, Dict[str, Dict[str, int]]] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self.state = sys.intern(self.state)  # type: ignore
 
     @staticmethod
     def create(
@@ -61,6 +68,7 @@ class Round:
             "user_query": self.user_query,
             "state": self.state,
             "post_list": [post.to_dict() for post in self.post_list],
+            "usage": self.usage,
         }
 
     @staticmethod
@@ -73,12 +81,54 @@ class Round:
             post_list=[Post.from_dict(post) for post in content["post_list"]]
             if content["post_list"] is not None
             else [],
+            usage=content.get("usage") or {},
         )
 
     def add_post(self, post: Post):
         """Add a post to the post list."""
         self.post_list.append(post)
 
+    def add_usage(self, role: str, llm_alias: str, usage: Dict[str, int]):
+        """Add the token usage of an LLM request made by the role."""
+        alias_usage = self.usage.setdefault(role, {}).setdefault(llm_alias, {})
+        for key, value in usage.items():
+            alias_usage[key] = alias_usage.get(key, 0) + value
+
     def change_round_state(self, new_state: Literal["finished", "failed", "created"]):
         """Change the state of the round."""
         self.state = new_state
+
+
+class RoundView(Round):
+    """
+    A read-only view of a round with read-only posts, which can be shared by the callers without copying it.
+    Its deep copy is a writable round.
+    """
+
+    __slots__ = ()
+
+    @staticmethod
+    def of(round: Round, post_list: Sequence[PostView]) -> RoundView:
+        view = object.__new__(RoundView)
+        object.__setattr__(view, "id", round.id)
+        object.__setattr__(view, "user_query", round.user_query)
+        object.__setattr__(view, "state", round.state)
+        object.__setattr__(view, "post_list", tuple(post_list))
+        # the token usage is not part of the view, which only carries the conversation
+        object.__setattr__(view, "usage", {})
+        return view
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"RoundView is read-only, deepcopy it to modify {name}")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"RoundView is read-only, deepcopy it to modify {name}")
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Round:
+        return Round(
+            id=self.id,
+            user_query=self.user_query,
+            state=self.state,
+            post_list=[copy.deepcopy(post, memo) for post in self.post_list],
+            usage={},
+        )
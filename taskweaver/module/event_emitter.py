@@ -1,14 +1,16 @@
 from __future__ import annotations
 
 import abc
+import sys
 from contextlib import contextmanager
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from taskweaver.memory.attachment import Attachment, AttachmentType
 from taskweaver.memory.post import Post
 from taskweaver.memory.type_vars import RoleName
+from taskweaver.utils import StringBuilder
 
 
 class EventScope(Enum):
@@ -128,6 +130,8 @@ class PostEventProxy:
         self.round_id = round_id
         self.post = post
         self.message_is_end = False
+        # the attachment being streamed and the builder of its content, which is set once the stream ends
+        self.streaming_attachment: Optional[Tuple[Attachment, StringBuilder]] = None
         self.create("Post created")
 
     def create(self, message: str):
@@ -140,7 +144,8 @@ class PostEventProxy:
         )
 
     def update_send_to(self, send_to: RoleName):
-        self.post.send_to = send_to
+        # the role name may be parsed from the LLM output, so it is interned like the role names of the posts
+        self.post.send_to = sys.intern(send_to)
         self._emit(
             PostEventType.post_send_to_update,
             "",
@@ -175,10 +180,16 @@ class PostEventProxy:
             assert id == attachment.id
             if type is not None:
                 assert type == attachment.type
-            attachment.content += message
+            if self.streaming_attachment is not None and self.streaming_attachment[0] is attachment:
+                self.streaming_attachment[1].append(message)
+                if is_end:
+                    self.end_attachment_stream()
+            else:
+                attachment.content += message
             attachment.extra = extra
         else:
             assert type is not None, "type is required when creating new attachment"
+            self.end_attachment_stream()
             attachment = Attachment.create(
                 type=type,
                 content=message,
@@ -186,6 +197,8 @@ class PostEventProxy:
                 id=id,
             )
             self.post.add_attachment(attachment)
+            if not is_end:
+                self.streaming_attachment = (attachment, StringBuilder(message))
         self._emit(
             PostEventType.post_attachment_update,
             message,
@@ -198,12 +211,21 @@ class PostEventProxy:
         )
         return attachment
 
+    def end_attachment_stream(self):
+        """Set the content of the attachment being streamed, also when its stream is interrupted before the end."""
+        if self.streaming_attachment is not None:
+            attachment, content = self.streaming_attachment
+            attachment.content = str(content)
+            self.streaming_attachment = None
+
     def error(self, msg: str):
+        self.streaming_attachment = None
         self.post.attachment_list = []
         self.post.message = msg
         self._emit(PostEventType.post_error, msg)
 
     def end(self, msg: str = ""):
+        self.end_attachment_stream()
         self._emit(PostEventType.post_end, msg)
         return self.post
 
@@ -278,6 +300,17 @@ class SessionEventEmitter:
         )
         self.current_round_id = None
 
+    def end_session(self):
+        self.emit(
+            TaskWeaverEvent(
+                EventScope.session,
+                SessionEventType.session_end,
+                None,
+                None,
+                "Session ended",
+            ),
+        )
+
     def register(self, handler: SessionEventHandler):
         self.handlers.append(handler)
 
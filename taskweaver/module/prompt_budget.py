@@ -0,0 +1,186 @@
+import copy
+from typing import Callable, Dict, List, Optional, Tuple
+
+from taskweaver.llm.tokenizer import Tokenizer
+from taskweaver.llm.util import ChatMessageType
+from taskweaver.memory import Round
+from taskweaver.memory.attachment import AttachmentType
+
+
+class PromptBudget:
+    """
+    PromptBudget assembles a prompt from its sections within a token budget.
+
+    The sections are, in order, the system messages, the example conversations, the context messages
+    (e.g., the experiences selected for the current query) and the conversation rounds. The static sections
+    come first so that the prompt prefix stays identical across turns, which is what prefix caching relies on.
+    When the prompt exceeds the budget, the lowest-priority content is removed in a fixed order:
+    1. the oldest rounds, while keeping at least the latest round;
+    2. the examples, from the last one;
+    3. the verbose execution results in the remaining rounds, which are truncated to their head and tail.
+    The system and context messages and the latest round are never removed, so the prompt may still exceed
+    the budget.
+    A budget of 0 disables the enforcement, but the token stats are still collected.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Tokenizer,
+        token_budget: int = 0,
+        min_result_tokens: int = 64,
+    ):
+        self.tokenizer = tokenizer
+        self.token_budget = token_budget
+        self.min_result_tokens = min_result_tokens
+        self.stats: Dict[str, int] = {}
+
+    def build(
+        self,
+        system: List[ChatMessageType],
+        examples: List[List[ChatMessageType]],
+        rounds: List[Round],
+        rounds_composer: Callable[[List[Round]], List[ChatMessageType]],
+        context: Optional[List[ChatMessageType]] = None,
+    ) -> List[ChatMessageType]:
+        context = context if context is not None else []
+
+        def count(messages: List[ChatMessageType]) -> int:
+            return self.tokenizer.count_message_tokens(messages, with_reply=False)
+
+        system_tokens = count(system)
+        example_tokens = [count(example) for example in examples]
+        context_tokens = count(context)
+        conversation = rounds_composer(rounds)
+        conversation_tokens = count(conversation)
+
+        def total_tokens() -> int:
+            return (
+                system_tokens
+                + sum(example_tokens)
+                + context_tokens
+                + conversation_tokens
+                + self.tokenizer.tokens_per_reply
+            )
+
+        def over_budget() -> bool:
+            return self.token_budget > 0 and total_tokens() > self.token_budget
+
+        self.stats = {
+            "dropped_rounds": 0,
+            "dropped_examples": 0,
+            "truncated_results": 0,
+        }
+
+        # 1. drop the oldest rounds, as many as estimated at once, then one by one if the estimate falls short
+        if over_budget() and len(rounds) > 1:
+            dropped = self._count_rounds_to_drop(rounds, rounds_composer, count, total_tokens() - self.token_budget)
+            rounds = rounds[dropped:]
+            conversation = rounds_composer(rounds)
+            conversation_tokens = count(conversation)
+            self.stats["dropped_rounds"] += dropped
+        while over_budget() and len(rounds) > 1:
+            rounds = rounds[1:]
+            conversation = rounds_composer(rounds)
+            conversation_tokens = count(conversation)
+            self.stats["dropped_rounds"] += 1
+
+        # 2. drop the examples from the last one
+        examples = list(examples)
+        while over_budget() and len(examples) > 0:
+            examples.pop()
+            example_tokens.pop()
+            self.stats["dropped_examples"] += 1
+
+        # 3. truncate the verbose execution results, halving their length until the prompt fits
+        if over_budget():
+            result_tokens = self._max_result_tokens(rounds)
+            while over_budget() and result_tokens > self.min_result_tokens:
+                result_tokens = max(self.min_result_tokens, result_tokens // 2)
+                truncated_rounds, truncated = self.truncate_execution_results(rounds, result_tokens)
+                conversation = rounds_composer(truncated_rounds)
+                conversation_tokens = count(conversation)
+                self.stats["truncated_results"] = truncated
+
+        self.stats.update(
+            {
+                "system_tokens": system_tokens,
+                "example_tokens": sum(example_tokens),
+                "context_tokens": context_tokens,
+                "conversation_tokens": conversation_tokens,
+                "total_tokens": total_tokens(),
+                "token_budget": self.token_budget,
+            },
+        )
+
+        chat_history = list(system)
+        for example in examples:
+            chat_history.extend(example)
+        chat_history.extend(context)
+        chat_history.extend(conversation)
+        return chat_history
+
+    @staticmethod
+    def _count_rounds_to_drop(
+        rounds: List[Round],
+        rounds_composer: Callable[[List[Round]], List[ChatMessageType]],
+        count: Callable[[List[ChatMessageType]], int],
+        excess_tokens: int,
+    ) -> int:
+        """
+        Estimate the number of the oldest rounds to drop to remove `excess_tokens` tokens from the conversation.
+        The tokens of each round are counted once, as the difference between the round composed with the next one
+        and the next one alone, which keeps the conversation head and the final round composed the same way.
+        The savings are summed from the oldest round, instead of recomposing the conversation for each round.
+        """
+        saved_tokens = 0
+        next_tokens = count(rounds_composer(rounds[1:2]))
+        for index in range(1, len(rounds)):
+            round_tokens = count(rounds_composer(rounds[index - 1 : index + 1])) - next_tokens
+            saved_tokens += round_tokens
+            if saved_tokens >= excess_tokens or index == len(rounds) - 1:
+                return index
+            next_tokens = count(rounds_composer(rounds[index + 1 : index + 2]))
+        return 0
+
+    @staticmethod
+    def _result_texts(rounds: List[Round]) -> List[str]:
+        texts: List[str] = []
+        for rnd in rounds:
+            for post in rnd.post_list:
+                if post.send_from == "CodeInterpreter" and post.message is not None:
+                    texts.append(post.message)
+                texts.extend(a.content for a in post.attachment_list if a.type == AttachmentType.execution_result)
+        return texts
+
+    def _max_result_tokens(self, rounds: List[Round]) -> int:
+        return max([self.tokenizer.count_tokens(text) for text in self._result_texts(rounds)], default=0)
+
+    def truncate_execution_results(
+        self,
+        rounds: List[Round],
+        max_tokens: int,
+    ) -> Tuple[List[Round], int]:
+        """
+        Return a copy of the rounds with the execution results, and the CodeInterpreter messages reporting them,
+        truncated to `max_tokens` tokens, together with the number of truncated texts.
+        """
+        rounds = copy.deepcopy(rounds)
+        truncated = 0
+
+        def truncate(text: Optional[str]) -> Optional[str]:
+            nonlocal truncated
+            if text is None:
+                return text
+            new_text = self.tokenizer.truncate(text, max_tokens)
+            if new_text != text:
+                truncated += 1
+            return new_text
+
+        for rnd in rounds:
+            for post in rnd.post_list:
+                if post.send_from == "CodeInterpreter":
+                    post.message = truncate(post.message)
+                for attachment in post.attachment_list:
+                    if attachment.type == AttachmentType.execution_result:
+                        attachment.content = truncate(attachment.content)
+        return rounds, truncated
@@ -1,4 +1,7 @@
-from typing import List, Tuple
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, List, Tuple, TypeVar
+
+T = TypeVar("T")
 
 
 class PromptUtil:
@@ -52,3 +55,37 @@ class PromptUtil:
         for delimiter in PromptUtil.get_all_delimiters():
             text = PromptUtil.remove_delimiter(text, delimiter)
         return text
+
+
+class PromptCache:
+    """
+    A small LRU cache of the static sections of a prompt, e.g., the formatted examples or plugins.
+
+    Sections are keyed by the identity of the objects they are rendered from. The cache keeps a reference to
+    these objects, so that their ids cannot be reused while the entry is alive.
+    """
+
+    def __init__(self, max_size: int = 16):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Tuple[List[Any], Any]]" = OrderedDict()
+
+    @staticmethod
+    def make_key(name: str, objects: Iterable[Any]) -> Tuple[Hashable, List[Any]]:
+        objects = list(objects)
+        return (name, tuple(id(o) for o in objects)), objects
+
+    def get_or_create(self, name: str, objects: Iterable[Any], factory: Callable[[], T]) -> T:
+        """Get the section rendered from the given objects, or render it with `factory` on a cache miss."""
+        key, refs = self.make_key(name, objects)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key][1]
+
+        value = factory()
+        self._entries[key] = (refs, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
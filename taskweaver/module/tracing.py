@@ -114,6 +114,9 @@ class DummyTracer:
     def start_as_current_span(self, span_name):
         return self
 
+    def start_span(self, span_name):
+        return self
+
     def set_attribute(self, key, value):
         pass
 
@@ -154,3 +157,10 @@ def get_tracer():
         return DummyTracer()
 
     return _tracer
+
+
+def get_current_span():
+    if _trace is None:
+        return DummyTracer()
+
+    return _trace.get_current_span()
@@ -12,13 +12,16 @@ from taskweaver.llm.util import ChatMessageType, format_chat_message
 from taskweaver.logging import TelemetryLogger
 from taskweaver.memory import Conversation, Memory, Post, Round, RoundCompressor
 from taskweaver.memory.attachment import AttachmentType
+from taskweaver.memory.embedding_index import QueryEmbeddingCache
 from taskweaver.memory.experience import Experience, ExperienceGenerator
 from taskweaver.memory.plugin import PluginRegistry
 from taskweaver.misc.example import load_examples
 from taskweaver.module.event_emitter import SessionEventEmitter
+from taskweaver.module.prompt_budget import PromptBudget
+from taskweaver.module.prompt_util import PromptCache
 from taskweaver.module.tracing import Tracing, get_tracer, tracing_decorator
 from taskweaver.role import PostTranslator, Role
-from taskweaver.utils import read_yaml
+from taskweaver.utils import StringBuilder, read_yaml
 
 
 class PlannerConfig(ModuleConfig):
@@ -63,6 +66,9 @@ class PlannerConfig(ModuleConfig):
 
         self.llm_alias = self._get_str("llm_alias", default="", required=False)
 
+        # the maximum number of tokens in the prompt, 0 means unlimited
+        self.prompt_token_budget = self._get_int("prompt_token_budget", 0)
+
 
 class Planner(Role):
     conversation_delimiter_message: str = "Let's start the new conversation!"
@@ -119,10 +125,17 @@ class Planner(Role):
         self.max_self_ask_num = 3
 
         self.round_compressor = round_compressor
+        self.prompt_budget = PromptBudget(
+            self.llm_api.get_tokenizer(self.config.llm_alias),
+            self.config.prompt_token_budget,
+        )
+        self.prompt_cache = PromptCache()
         self.compression_prompt_template = read_yaml(self.config.compression_prompt_path)["content"]
 
         if self.config.use_experience:
             self.experience_generator = experience_generator
+            # the user query is embedded once in a round, not in each reply of the Planner
+            self.query_embedding_cache = QueryEmbeddingCache(self.llm_api.get_embedding)
             self.experience_generator.refresh(target_role="All")
             self.experience_generator.load_experience(target_role="All")
             self.logger.info(
@@ -202,22 +215,34 @@ class Planner(Role):
         rounds: List[Round],
         selected_experiences: Optional[List[Experience]] = None,
     ) -> List[ChatMessageType]:
-        experiences = (
-            self.experience_generator.format_experience_in_prompt(
-                self.prompt_data["experience_instruction"],
-                selected_experiences,
-            )
-            if self.config.use_experience
-            else ""
-        )
-        chat_history = [format_chat_message(role="system", message=f"{self.instruction}\n{experiences}")]
+        # the instruction and the examples are static, so they are rendered once and put first in the prompt,
+        # which keeps the prompt prefix identical across turns for the prefix caching of the LLM endpoints
+        system = [format_chat_message(role="system", message=self.instruction)]
 
+        examples: List[List[ChatMessageType]] = []
         if self.config.use_example and len(self.examples) != 0:
-            for conv_example in self.examples:
-                conv_example_in_prompt = self.compose_conversation_for_prompt(
-                    conv_example.rounds,
-                )
-                chat_history += conv_example_in_prompt
+            examples = self.prompt_cache.get_or_create(
+                "examples",
+                self.examples,
+                lambda: [self.compose_conversation_for_prompt(conv_example.rounds) for conv_example in self.examples],
+            )
+
+        # the experiences are selected for each query, so they are put after the static prefix
+        context: List[ChatMessageType] = []
+        if self.config.use_experience and selected_experiences is not None and len(selected_experiences) > 0:
+            context = self.prompt_cache.get_or_create(
+                "experiences",
+                [exp for exp, _ in selected_experiences],
+                lambda: [
+                    format_chat_message(
+                        role="system",
+                        message=self.experience_generator.format_experience_in_prompt(
+                            self.prompt_data["experience_instruction"],
+                            selected_experiences,
+                        ),
+                    ),
+                ],
+            )
 
         summary = None
         if self.config.prompt_compression and self.round_compressor is not None:
@@ -229,15 +254,17 @@ class Planner(Role):
                 prompt_template=self.compression_prompt_template,
             )
 
-        chat_history.extend(
-            self.compose_conversation_for_prompt(
-                rounds,
+        return self.prompt_budget.build(
+            system,
+            examples,
+            rounds,
+            rounds_composer=lambda _rounds: self.compose_conversation_for_prompt(
+                _rounds,
                 summary=summary,
             ),
+            context=context,
         )
 
-        return chat_history
-
     @tracing_decorator
     def reply(
         self,
@@ -252,7 +279,10 @@ class Planner(Role):
         self.tracing.set_span_attribute("use_experience", self.config.use_experience)
 
         if self.config.use_experience:
-            selected_experiences = self.experience_generator.retrieve_experience(user_query)
+            selected_experiences = self.experience_generator.retrieve_experience(
+                user_query,
+                query_embedding=self.query_embedding_cache.get(rounds[-1].id, user_query),
+            )
         else:
             selected_experiences = None
 
@@ -260,6 +290,9 @@ class Planner(Role):
 
         post_proxy.update_status("composing prompt")
         chat_history = self.compose_prompt(rounds, selected_experiences)
+        self.logger.info(f"Planner prompt token stats: {self.prompt_budget.stats}")
+        for key, value in self.prompt_budget.stats.items():
+            self.tracing.set_span_attribute(f"prompt.{key}", value)
 
         def check_post_validity(post: Post):
             assert post.send_to is not None, "LLM failed to generate send_to field"
@@ -289,7 +322,7 @@ class Planner(Role):
                 llm_alias=self.config.llm_alias,
             )
 
-        llm_output: List[str] = []
+        llm_output = StringBuilder()
         try:
 
             def stream_filter(s: Iterable[ChatMessageType]):
@@ -299,7 +332,6 @@ class Planner(Role):
                         if is_first_chunk:
                             post_proxy.update_status("receiving LLM response")
                             is_first_chunk = False
-                        llm_output.append(c["content"])
                         yield c
                 finally:
                     if isinstance(s, types.GeneratorType):
@@ -315,6 +347,7 @@ class Planner(Role):
                     post_proxy=post_proxy,
                     llm_output=stream_filter(llm_stream),
                     validation_func=check_post_validity,
+                    llm_output_builder=llm_output,
                 )
 
         except (JSONDecodeError, AssertionError) as e:
@@ -323,7 +356,7 @@ class Planner(Role):
             self.tracing.set_span_exception(e)
             post_proxy.error(f"failed to parse LLM output due to {str(e)}")
             post_proxy.update_attachment(
-                "".join(llm_output),
+                str(llm_output),
                 AttachmentType.invalid_response,
             )
             post_proxy.update_attachment(
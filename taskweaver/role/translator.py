@@ -1,8 +1,9 @@
 import io
 import json
 import types
+from collections import OrderedDict
 from json import JSONDecodeError
-from typing import Any, Callable, Dict, Iterable, Iterator, List, Literal, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Literal, Optional, Tuple, Union
 
 import ijson
 from injector import inject
@@ -12,7 +13,42 @@ from taskweaver.logging import TelemetryLogger
 from taskweaver.memory import Attachment, Post
 from taskweaver.memory.attachment import AttachmentType
 from taskweaver.module.event_emitter import PostEventProxy, SessionEventEmitter
-from taskweaver.utils import json_parser
+from taskweaver.utils import StringBuilder, json_parser
+
+
+class PostRenderCache:
+    """
+    The renderings of the posts in the prompts, e.g., the raw text of a post, keyed by the post id and the render
+    options. A post does not change once it is finished, so that its renderings are reused in the following turns
+    and composing the prompt of a long conversation renders the new posts only.
+    A rendering is checked against the message, the receiver and the attachments of the post, so that it is
+    rendered again if the post is mutated.
+    """
+
+    def __init__(self, max_size: int = 4096) -> None:
+        self.max_size = max_size
+        self._entries: OrderedDict[Tuple[str, Hashable], Tuple[Tuple[Any, ...], str]] = OrderedDict()
+
+    def get(self, post: Post, options: Hashable, render: Callable[[], str]) -> str:
+        key = (post.id, options)
+        signature = (
+            post.message,
+            post.send_to,
+            tuple((attachment.type, attachment.content, attachment.extra) for attachment in post.attachment_list),
+        )
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == signature:
+            self._entries.move_to_end(key)
+            return entry[1]
+        rendered = render()
+        self._entries[key] = (signature, rendered)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return rendered
+
+    def __len__(self) -> int:
+        return len(self._entries)
 
 
 class PostTranslator:
@@ -29,6 +65,7 @@ class PostTranslator:
     ):
         self.logger = logger
         self.event_emitter = event_emitter
+        self.render_cache = PostRenderCache()
 
     def raw_text_to_post(
         self,
@@ -37,22 +74,22 @@ class PostTranslator:
         early_stop: Optional[Callable[[Union[AttachmentType, Literal["message", "send_to"]], str], bool]] = None,
         validation_func: Optional[Callable[[Post], None]] = None,
         use_v2_parser: bool = True,
+        llm_output_builder: Optional[StringBuilder] = None,
     ) -> None:
         """
         Convert the raw text output of LLM to a Post object.
         :param llm_output_stream:
         :param send_from:
         :param early_stop:
+        :param llm_output_builder: the builder the raw text output is appended to, for the caller to read it
         :return: Post
         """
+        full_llm_content = llm_output_builder if llm_output_builder is not None else StringBuilder()
 
-        # llm_output_list = [token for token in llm_output_stream]  # collect all the llm output via iterator
-        # llm_output = "".join(llm_output_list)
         def stream_filter(s: Iterable[ChatMessageType]) -> Iterator[str]:
-            full_llm_content = ""
             try:
                 for c in s:
-                    full_llm_content += c["content"]
+                    full_llm_content.append(c["content"])
                     yield c["content"]
             finally:
                 if isinstance(s, types.GeneratorType):
@@ -60,7 +97,8 @@ class PostTranslator:
                         s.close()
                     except GeneratorExit:
                         pass
-                self.logger.info(f"LLM output: {full_llm_content}")
+                # the output is joined only if the log record is emitted
+                self.logger.info("LLM output: %s", full_llm_content)
 
         value_buf: str = ""
         filtered_stream = stream_filter(llm_output)
@@ -128,6 +166,7 @@ class PostTranslator:
                     parser_stream.close()
                 except GeneratorExit:
                     pass
+            post_proxy.end_attachment_stream()
 
         if validation_func is not None:
             validation_func(post_proxy.post)
@@ -149,6 +188,29 @@ class PostTranslator:
         :param ignored_types:
         :return: str
         """
+        options = (
+            "raw_text",
+            content_formatter,
+            if_format_message,
+            if_format_send_to,
+            tuple(ignored_types) if ignored_types is not None else None,
+        )
+        return self.render_cache.get(
+            post,
+            options,
+            lambda: self._post_to_raw_text(
+                post, content_formatter, if_format_message, if_format_send_to, ignored_types
+            ),
+        )
+
+    def _post_to_raw_text(
+        self,
+        post: Post,
+        content_formatter: Callable[[Attachment], str],
+        if_format_message: bool,
+        if_format_send_to: bool,
+        ignored_types: Optional[List[AttachmentType]],
+    ) -> str:
         structured_llm: List[Dict[str, str]] = []
         for attachment in post.attachment_list:
             attachments_dict = {}
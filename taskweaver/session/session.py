@@ -7,8 +7,11 @@ from injector import Injector, inject
 from taskweaver.code_interpreter import CodeInterpreter, CodeInterpreterCLIOnly, CodeInterpreterPluginOnly
 from taskweaver.code_interpreter.code_executor import CodeExecutor
 from taskweaver.config.module_config import ModuleConfig
+from taskweaver.llm.usage import TokenUsage, usage_context
 from taskweaver.logging import TelemetryLogger
+from taskweaver.logging.event_log import SessionEventLog, event_log_scope
 from taskweaver.memory import Memory, Post, Round
+from taskweaver.memory.attachment import AttachmentType
 from taskweaver.module.event_emitter import SessionEventEmitter, SessionEventHandler
 from taskweaver.module.tracing import Tracing, tracing_decorator, tracing_decorator_non_class
 from taskweaver.planner.planner import Planner
@@ -32,6 +35,11 @@ class AppSessionConfig(ModuleConfig):
             default="python",
         )
 
+        # "event_log" appends the posts, the round states and the prompts of a session to a JSONL file
+        # from a background thread, while "json" writes a JSON file for the session, each round and each prompt
+        self.log_format = self._get_enum("log_format", options=["event_log", "json"], default="event_log")
+        self.event_log_compress = self._get_bool("event_log_compress", False)
+
 
 class Session:
     @inject
@@ -95,10 +103,21 @@ class Session:
         self.max_internal_chat_round_num = self.config.max_internal_chat_round_num
         self.internal_chat_num = 0
 
-        self.logger.dump_log_file(
-            self,
-            file_path=os.path.join(self.workspace, f"{self.session_id}.json"),
-        )
+        self.event_log: Optional[SessionEventLog] = None
+        if self.config.log_format == "event_log" and not self.logger.is_remote:
+            self.event_log = SessionEventLog(
+                os.path.join(
+                    self.workspace,
+                    "events.jsonl.gz" if self.config.event_log_compress else "events.jsonl",
+                ),
+                compress=self.config.event_log_compress,
+            )
+            self.event_log.log_session(self.to_dict())
+        else:
+            self.logger.dump_log_file(
+                self,
+                file_path=os.path.join(self.workspace, f"{self.session_id}.json"),
+            )
 
     def init(self):
         if not os.path.exists(self.workspace):
@@ -119,6 +138,8 @@ class Session:
     @tracing_decorator
     def _send_text_message(self, message: str) -> Round:
         chat_round = self.memory.create_round(user_query=message)
+        if self.event_log is not None:
+            self.event_log.log_round(chat_round)
 
         self.tracing.set_span_attribute("round_id", chat_round.id)
         self.tracing.set_span_attribute("round_index", self.round_index)
@@ -133,26 +154,37 @@ class Session:
             self.tracing.set_span_attribute("in.message", post.message)
             self.tracing.set_span_attribute("in.attachments", str(post.attachment_list))
 
-            chat_round.add_post(post)
-
-            if recipient == "Planner":
-                reply_post = self.planner.reply(
-                    self.memory,
-                    prompt_log_path=os.path.join(
-                        self.workspace,
-                        f"planner_prompt_log_{chat_round.id}_{post.id}.json",
-                    ),
-                )
-            elif recipient == "CodeInterpreter":
-                reply_post = self.code_interpreter.reply(
-                    self.memory,
-                    prompt_log_path=os.path.join(
-                        self.workspace,
-                        f"code_generator_prompt_log_{chat_round.id}_{post.id}.json",
-                    ),
-                )
-            else:
-                raise Exception(f"Unknown recipient {recipient}")
+            self._add_post(chat_round, post)
+
+            # the token usage of the LLM requests made by the recipient is recorded in the round,
+            # and the requests are routed by the turn and whether the previous step failed
+            previous_failed = len(
+                post.get_attachment(AttachmentType.revise_message)
+            ) > 0 or "FAILURE" in post.get_attachment(AttachmentType.execution_status)
+            with usage_context(
+                round=chat_round,
+                role=recipient,
+                turn=self.internal_chat_num,
+                previous_failed=previous_failed,
+            ):
+                if recipient == "Planner":
+                    reply_post = self.planner.reply(
+                        self.memory,
+                        prompt_log_path=os.path.join(
+                            self.workspace,
+                            f"planner_prompt_log_{chat_round.id}_{post.id}.json",
+                        ),
+                    )
+                elif recipient == "CodeInterpreter":
+                    reply_post = self.code_interpreter.reply(
+                        self.memory,
+                        prompt_log_path=os.path.join(
+                            self.workspace,
+                            f"code_generator_prompt_log_{chat_round.id}_{post.id}.json",
+                        ),
+                    )
+                else:
+                    raise Exception(f"Unknown recipient {recipient}")
 
             return reply_post
 
@@ -166,7 +198,7 @@ class Session:
                     )
                     self.internal_chat_num += 1
                     if post.send_to == "User":
-                        chat_round.add_post(post)
+                        self._add_post(chat_round, post)
                         self.internal_chat_num = 0
                         break
                     if self.internal_chat_num >= self.max_internal_chat_round_num:
@@ -186,7 +218,7 @@ class Session:
                             send_from="CodeInterpreter",
                             send_to="User",
                         )
-                        chat_round.add_post(reply_post)
+                        self._add_post(chat_round, reply_post)
                         break
                     else:
                         post = _send_message("CodeInterpreter", post)
@@ -211,13 +243,16 @@ class Session:
             self.tracing.set_span_attribute("internal_chat_num", self.internal_chat_num)
 
             self.internal_chat_num = 0
-            self.logger.dump_log_file(
-                chat_round,
-                file_path=os.path.join(
-                    self.workspace,
-                    f"{self.session_id}_{chat_round.id}.json",
-                ),
-            )
+            if self.event_log is not None:
+                self.event_log.log_round_state(chat_round)
+            else:
+                self.logger.dump_log_file(
+                    chat_round,
+                    file_path=os.path.join(
+                        self.workspace,
+                        f"{self.session_id}_{chat_round.id}.json",
+                    ),
+                )
             self.event_emitter.end_round(chat_round.id)
             return chat_round
 
@@ -244,7 +279,8 @@ class Session:
             if len(file_names) > 0:
                 message_prefix += f"files added: {', '.join(file_names)}.\n"
 
-        with self.event_emitter.handle_events_ctx(event_handler):
+        # the prompt logs of the roles are appended to the event log of the session
+        with self.event_emitter.handle_events_ctx(event_handler), event_log_scope(self.event_log):
             chat_round = self._send_text_message(message_prefix + message)
 
             self.tracing.set_span_attribute("round_id", chat_round.id)
@@ -255,6 +291,11 @@ class Session:
 
             return chat_round
 
+    def _add_post(self, chat_round: Round, post: Post) -> None:
+        chat_round.add_post(post)
+        if self.event_log is not None:
+            self.event_log.log_post(chat_round.id, post)
+
     @tracing_decorator
     def _upload_file(self, name: str, path: Optional[str] = None, content: Optional[bytes] = None) -> str:
         target_name = name.split("/")[-1]
@@ -281,10 +322,37 @@ class Session:
             ),
         )
 
+    def get_usage_summary(self) -> Dict[str, Any]:
+        """Get the token usage of the session, in total, by role, by LLM alias and by round."""
+        total = TokenUsage()
+        roles: Dict[str, TokenUsage] = {}
+        llm_aliases: Dict[str, TokenUsage] = {}
+        rounds: Dict[str, Dict[str, int]] = {}
+        for chat_round in self.memory.conversation.rounds:
+            round_total = TokenUsage()
+            for role, role_usage in chat_round.usage.items():
+                for llm_alias, alias_usage in role_usage.items():
+                    usage = TokenUsage.from_dict(alias_usage)
+                    round_total.add(usage)
+                    roles.setdefault(role, TokenUsage()).add(usage)
+                    llm_aliases.setdefault(llm_alias, TokenUsage()).add(usage)
+            total.add(round_total)
+            rounds[chat_round.id] = round_total.to_dict()
+        return {
+            "total": total.to_dict(),
+            "roles": {role: usage.to_dict() for role, usage in roles.items()},
+            "llm_aliases": {llm_alias: usage.to_dict() for llm_alias, usage in llm_aliases.items()},
+            "rounds": rounds,
+        }
+
     @tracing_decorator
     def stop(self) -> None:
         self.logger.info(f"Session {self.session_id} is stopped")
+        # cancel the background work of the roles, e.g., the round compression
+        self.event_emitter.end_session()
         self.code_executor.stop()
+        if self.event_log is not None:
+            self.event_log.close()
 
     def to_dict(self) -> Dict[str, str]:
         return {
@@ -1,12 +1,13 @@
 from __future__ import annotations
 
+import bisect
 import dataclasses
 import json
 import os
 import secrets
 from datetime import datetime
 from hashlib import md5
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 
 def create_id(length: int = 4) -> str:
@@ -73,3 +74,56 @@ def json_dump(obj: Any, fp: Any):
 
 def generate_md5_hash(content: str) -> str:
     return md5(content.encode()).hexdigest()
+
+
+class StringBuilder:
+    """
+    A string built from appended chunks in linear time, e.g., the content of a streamed LLM output.
+    The chunks are joined once when the string is read, and a substring is read from the chunks it spans only.
+    A single writer may append while a reader reads the length and the substrings of the appended part.
+    """
+
+    __slots__ = ("_chunks", "_ends", "_length", "_value")
+
+    def __init__(self, value: str = "") -> None:
+        self._chunks: List[str] = []
+        # the end offset of each chunk
+        self._ends: List[int] = []
+        self._length = 0
+        self._value: Optional[str] = None
+        self.append(value)
+
+    def append(self, chunk: str) -> None:
+        if chunk == "":
+            return
+        self._chunks.append(chunk)
+        self._ends.append(self._length + len(chunk))
+        self._length += len(chunk)
+        self._value = None
+
+    def substring(self, start: int, end: Optional[int] = None) -> str:
+        end = self._length if end is None else min(end, self._length)
+        if start >= end:
+            return ""
+        if self._value is not None:
+            return self._value[start:end]
+        idx = bisect.bisect_right(self._ends, start)
+        parts: List[str] = []
+        while start < end:
+            chunk, chunk_end = self._chunks[idx], self._ends[idx]
+            chunk_start = chunk_end - len(chunk)
+            parts.append(chunk[start - chunk_start : end - chunk_start])
+            start = chunk_end
+            idx += 1
+        return "".join(parts)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __str__(self) -> str:
+        if self._value is None:
+            value = "".join(self._chunks)
+            # keep the joined string as the only chunk, so that it is not joined again with the next chunks
+            self._chunks, self._ends = [value], [len(value)]
+            self._value = value
+        return self._value
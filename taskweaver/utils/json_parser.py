@@ -1,4 +1,4 @@
-import itertools
+import re
 import types
 from typing import Any, Iterable, List, Literal, NamedTuple, Optional, Tuple
 
@@ -76,37 +76,79 @@ def is_ws(ch: str):
     return ch == " " or ch == "\t" or ch == "\n" or ch == "\r"
 
 
+_WS_CHARS = frozenset(" \t\n\r")
+_WS_RUN = re.compile(r"[ \t\n\r]+")
+# the run of the plain characters of a string up to the next quote or escape
+_STR_RUN = re.compile(r'[^"\\]+')
+_HEX_DIGITS = "0123456789abcdefABCDEF"
+_ESCAPES = {"n": "\n", "/": "/", "\\": "\\", "r": "\r", "t": "\t", "b": "\b", "f": "\f", '"': '"'}
+
+
 def parse_json_stream(
     token_stream: Iterable[str],
     skip_ws: bool = False,
     ijson_prefix: bool = False,
     skip_after_root: bool = False,
 ) -> Iterable[ParserEvent]:
-    buf: str = ""
-    is_end: bool = False
-    prefix_stack: List[Tuple[bool, str]] = []
+    """
+    Parse the JSON chunks of a token stream into parser events. The events of a chunk are reduced as in
+    `reduce_events`, i.e., the consecutive events of the same type are merged into one.
+
+    The chunks are scanned with an index cursor: the runs of plain string characters and whitespaces
+    are consumed at once, the other characters one by one. The prefix of each depth is computed once
+    when the depth is entered.
+    """
+    # the prefixes of the depths, the last one is the prefix of the current depth
+    prefixes: List[str] = [""]
+    # the state of a string is a list [in_escape, escape_buf, value_parts, is_obj_key] updated in place
     state_stack: List[Tuple[ParserStateType, Any]] = [("root", (False, False))]
     ev_queue: List[ParserEvent] = []
 
+    # the pending event, to which the following events of the same type are merged
+    pending_ev: Optional[ParserEventType] = None
+    pending_prefix: str = ""
+    pending_value: Any = None
+    pending_value_strs: List[str] = []
+    pending_is_end: bool = False
+
     def add_event(ev: ParserEventType, value: Any, value_str: str, is_end: bool):
-        if ijson_prefix:
-            prefix = ".".join("item" if is_arr else val for is_arr, val in prefix_stack)
-        else:
-            prefix = "".join(f"[{val}]" if is_arr else f".{val}" for is_arr, val in prefix_stack)
+        nonlocal pending_ev, pending_prefix, pending_value, pending_is_end
+        if skip_ws and ev == "ws":
+            return
+        if ev != pending_ev:
+            flush_event()
+            pending_ev = ev
+        pending_prefix, pending_value, pending_is_end = prefixes[-1], value, is_end
+        pending_value_strs.append(value_str)
+
+    def flush_event():
+        nonlocal pending_ev
+        if pending_ev is None:
+            return
         ev_queue.append(
             ParserEvent(
-                prefix,
-                ev,
-                value,
-                value_str,
-                is_end,
+                pending_prefix,
+                pending_ev,
+                pending_value,
+                "".join(pending_value_strs),
+                pending_is_end,
             ),
         )
+        pending_value_strs.clear()
+        pending_ev = None
+
+    def push_prefix(is_arr: bool, val: str):
+        parent = prefixes[-1]
+        if ijson_prefix:
+            segment = "item" if is_arr else val
+            prefixes.append(segment if len(prefixes) == 1 else f"{parent}.{segment}")
+        else:
+            prefixes.append(f"{parent}[{val}]" if is_arr else f"{parent}.{val}")
 
     def parse_ws(ch: str) -> bool:
-        is_in_ws = state_stack[-1][0] == "ws" if len(state_stack) > 0 else False
+        is_in_ws = state_stack[-1][0] == "ws"
 
-        if not is_ws(ch):
+        if ch not in _WS_CHARS:
             if is_in_ws:
                 add_event("ws", None, "", True)
                 state_stack.pop()
@@ -119,7 +161,7 @@ def parse_json_stream(
     def parse_str_begin(ch: str, is_obj_key: bool = False) -> bool:
         if ch == '"':
             add_event("map_key" if is_obj_key else "string", "", "", False)
-            state_stack.append(("string", (False, "", "", is_obj_key)))
+            state_stack.append(("string", [False, "", [], is_obj_key]))
             return True
         return False
 
@@ -167,7 +209,7 @@ def parse_json_stream(
         if parse_ws(ch):
             return True
         if value_to_end:
-            prefix_stack.pop()
+            prefixes.pop()
             state_stack.pop()
             if ch == ",":
                 return True
@@ -191,7 +233,7 @@ def parse_json_stream(
         if parse_ws(ch):
             return True
         if value_begins:
-            prefix_stack.pop()
+            prefixes.pop()
             if ch == ",":
                 state_stack[-1] = ("array", (idx + 1, False, True))
                 return True
@@ -205,71 +247,53 @@ def parse_json_stream(
                 state_stack.pop()
                 return True
             state_stack[-1] = ("array", (idx, True, False))
-            prefix_stack.append((True, str(idx)))
+            push_prefix(True, str(idx))
             if parse_value_begin(ch):
                 return True
             raise StreamJsonParserError(f"invalid value for index {idx}: {ch}")
         return False
 
-    def parse_str_value(ch: str, cur_state_ext: Tuple[bool, str, str, bool]) -> bool:
-        in_escape, escape_buf, value_buf, is_obj_key = cur_state_ext
+    def parse_str_value(ch: str, cur_state_ext: List[Any]) -> bool:
+        in_escape, escape_buf, value_parts, is_obj_key = cur_state_ext
         ev: ParserEventType = "map_key" if is_obj_key else "string"
         if in_escape and escape_buf.startswith("u"):
-            if ch in "0123456789abcdefABCDEF":
+            if ch in _HEX_DIGITS:
                 escape_buf += ch
             else:
                 raise StreamJsonParserError(f"invalid unicode escape sequence: \\{escape_buf}{ch}")
             if len(escape_buf) == 5:
                 new_ch = chr(int(escape_buf[1:], 16))
-                value_buf += new_ch
+                value_parts.append(new_ch)
                 add_event(ev, None, new_ch, False)
-                state_stack[-1] = ("string", (False, "", value_buf, is_obj_key))
+                cur_state_ext[0], cur_state_ext[1] = False, ""
             else:
-                state_stack[-1] = ("string", (True, escape_buf, value_buf, is_obj_key))
+                cur_state_ext[1] = escape_buf
             return True
         if in_escape:
-            assert escape_buf == ""
             if ch == "u":
-                state_stack[-1] = ("string", (True, ch, value_buf, is_obj_key))
+                cur_state_ext[1] = ch
                 return True
-            new_ch = ""
-            if ch == "n":
-                new_ch = "\n"
-            elif ch == "/":
-                new_ch = "/"
-            elif ch == "\\":
-                new_ch = "\\"
-            elif ch == "r":
-                new_ch = "\r"
-            elif ch == "r":
-                new_ch = "\r"
-            elif ch == "t":
-                new_ch = "\t"
-            elif ch == "b":
-                new_ch = "\b"
-            elif ch == "f":
-                new_ch = "\f"
-            elif ch == '"':
-                new_ch = '"'
-            else:
+            new_ch = _ESCAPES.get(ch)
+            if new_ch is None:
                 raise StreamJsonParserError(f"invalid escape sequence: \\{ch}")
-            value_buf += new_ch
+            value_parts.append(new_ch)
             add_event(ev, None, new_ch, False)
-            state_stack[-1] = ("string", (False, "", value_buf, is_obj_key))
+            cur_state_ext[0] = False
             return True
         if ch == '"':
+            value_buf = "".join(value_parts)
             add_event(ev, value_buf, "", True)
             state_stack.pop()
             if is_obj_key:
-                prefix_stack.append((False, value_buf))
+                push_prefix(False, value_buf)
                 state_stack.append(("object_value", (value_buf, False, False)))
             return True
         if ch == "\\":
-            state_stack[-1] = ("string", (True, "", value_buf, is_obj_key))
+            cur_state_ext[0] = True
             return True
-        value_buf += ch
+        # the runs of plain characters are scanned in `parse_chunk`, only the end of the stream gets here
+        value_parts.append(ch)
         add_event(ev, None, ch, False)
-        state_stack[-1] = ("string", (False, "", value_buf, is_obj_key))
         return True
 
     def parse_literal_value(
@@ -328,72 +352,76 @@ def parse_json_stream(
             state_stack[-1] = ("root", (True, has_skip_cnt))
             return parse_value_begin(ch)
 
-    def process_ev_queue():
-        result = ev_queue.copy()
-        result = reduce_events(result, skip_ws=skip_ws)
-        ev_queue.clear()
-        return result
+    def parse_char(ch: str) -> bool:
+        """Parse a character, the empty one for the end of the stream; return False if it is to be parsed again."""
+        cur_state, cur_state_ext = state_stack[-1]
+        r = False
+        if cur_state == "root":
+            r = parse_root(ch, cur_state_ext)
+        elif cur_state == "object":
+            r = parse_obj_begin(ch)
+        elif cur_state == "string":
+            r = parse_str_value(ch, cur_state_ext)
+        elif cur_state == "object_value":
+            r = parse_obj_value(ch, cur_state_ext)
+        elif cur_state == "array":
+            r = parse_array_begin(ch, cur_state_ext)
+        elif cur_state == "literal":
+            r = parse_literal_value(ch, cur_state_ext)
+        elif cur_state == "number":
+            # number needs to peek next token to determine if it's finished
+            return parse_number(ch, cur_state_ext)
+        elif cur_state == "ws":
+            # ws also need to peek next token to determine the end
+            return parse_ws(ch)
+        else:
+            raise StreamJsonParserError(f"not implemented handling for {cur_state}: {ch}")
+        if not r and ch != "":
+            raise StreamJsonParserError(
+                f"failed to parse {cur_state}: {ch} \n State: {state_stack} Prefix: {prefixes[-1]}",
+            )
+        return True
 
-    def parse_buf():
-        nonlocal buf, is_end
-        while True:
-            if len(buf) == 0 and not is_end:
-                break
+    def parse_chunk(chunk: str):
+        pos, size = 0, len(chunk)
+        while pos < size:
             cur_state, cur_state_ext = state_stack[-1]
-            ch = "" if buf == "" else buf[0]
-            buf = buf if buf == "" else buf[1:]
-            r = False
-            if cur_state == "root":
-                r = parse_root(ch, cur_state_ext)
-            elif cur_state == "object":
-                r = parse_obj_begin(ch)
-            elif cur_state == "string":
-                assert cur_state_ext is not None
-                r = parse_str_value(ch, cur_state_ext)
-            elif cur_state == "object_value":
-                assert cur_state_ext is not None
-                r = parse_obj_value(ch, cur_state_ext)
-            elif cur_state == "array":
-                assert cur_state_ext is not None
-                r = parse_array_begin(ch, cur_state_ext)
-            elif cur_state == "literal":
-                assert cur_state_ext is not None
-                r = parse_literal_value(ch, cur_state_ext)
-            elif cur_state == "number":
-                assert cur_state_ext is not None
-                r = parse_number(ch, cur_state_ext)
-                if not r:
-                    # number needs to peek next token to determine if it's finished
-                    # restore token to buffer when finishes
-                    buf = ch + buf
-                    r = True
+            if cur_state == "string" and not cur_state_ext[0]:
+                run = _STR_RUN.match(chunk, pos)
+                if run is not None:
+                    run_str = run.group()
+                    cur_state_ext[2].append(run_str)
+                    add_event("map_key" if cur_state_ext[3] else "string", None, run_str, False)
+                    pos = run.end()
                     continue
             elif cur_state == "ws":
-                r = parse_ws(ch)
-                if not r:
-                    # ws also need to peek next token to determine the end
-                    # restore token to buffer when finishes
-                    buf = ch + buf
-                    r = True
+                run = _WS_RUN.match(chunk, pos)
+                if run is not None:
+                    add_event("ws", None, run.group(), False)
+                    pos = run.end()
                     continue
-            else:
-                raise StreamJsonParserError(f"not implemented handling for {cur_state}: {ch}")
-            if not r and not is_end:
-                raise StreamJsonParserError(
-                    f"failed to parse {cur_state}: {ch} \n State: {state_stack} Prefix: {prefix_stack}",
-                )
-            if is_end:
+            elif cur_state == "root" and cur_state_ext[1] and skip_after_root:
+                add_event("skip", None, chunk[pos:], False)
                 break
+            if parse_char(chunk[pos]):
+                pos += 1
+
+    def process_ev_queue():
+        flush_event()
+        result = ev_queue.copy()
+        ev_queue.clear()
+        return result
 
     try:
-        for chunk in itertools.chain(token_stream, [None]):
-            if chunk is None:
-                is_end = True
-            else:
-                buf += chunk
-            parse_buf()
+        for chunk in token_stream:
+            parse_chunk(chunk)
             yield from process_ev_queue()
 
+        # the end of the stream is parsed as an empty character
+        while not parse_char(""):
+            pass
+        yield from process_ev_queue()
+
         # post parsing checks
         assert len(state_stack) > 0
 
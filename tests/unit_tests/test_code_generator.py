@@ -556,3 +556,60 @@ def test_code_correction_prompt():
         "- ProgramApe must not import the plugins and otherwise the code will be "
         "failed to execute.\n"
     )
+
+
+def test_plugin_only_auto_plugin_selection(tmp_path, monkeypatch):
+    import json
+    import shutil
+
+    from taskweaver.code_interpreter.code_generator import CodeGeneratorPluginOnly
+    from taskweaver.code_interpreter.code_generator.plugin_selection import PluginSelector
+    from taskweaver.llm import LLMApi, format_chat_message
+    from taskweaver.memory import Memory, Post, Round
+    from taskweaver.module.event_emitter import SessionEventEmitter
+
+    plugin_dir = os.path.join(tmp_path, "plugins")
+    shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data/plugins"), plugin_dir)
+    app_injector = Injector([PluginModule, LoggingModule])
+    app_config = AppConfigSource(
+        config={
+            "app_dir": os.path.dirname(os.path.abspath(__file__)),
+            "llm.api_key": "test_key",  # pragma: allowlist secret
+            "llm.embedding_api_type": "sentence_transformers",
+            "llm.embedding_model": "all-mpnet-base-v2",
+            "plugin.base_path": plugin_dir,
+            "plugin.embedding_storage": "npy",
+            "code_generator.enable_auto_plugin_selection": True,
+            "code_generator.prompt_file_path": os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                "data/prompts/generator_plugin_only.yaml",
+            ),
+        },
+    )
+    app_injector.binder.bind(AppConfigSource, to=app_config)
+    llm_api = app_injector.get(LLMApi)
+    app_injector.binder.bind(LLMApi, to=llm_api)
+    monkeypatch.setattr(llm_api, "get_embedding_list", lambda texts: [[1.0, 0.0] for _ in texts])
+    monkeypatch.setattr(llm_api, "get_embedding", lambda text: [1.0, 0.0])
+    app_injector.get(PluginSelector).refresh()
+
+    function_calls = json.dumps([{"name": "klarna_search", "arguments": {"query": "iphone", "in_stock": True}}])
+    monkeypatch.setattr(
+        llm_api,
+        "chat_completion",
+        lambda *args, **kwargs: format_chat_message("function", function_calls),
+    )
+
+    code_generator = app_injector.get(CodeGeneratorPluginOnly)
+    memory = Memory(session_id="session-1")
+    round1 = Round.create(user_query="find iphones on sale", id="round-1")
+    round1.add_post(Post.create(message="find iphones on sale", send_from="Planner", send_to="CodeInterpreter"))
+    memory.conversation.add_round(round1)
+
+    event_emitter = app_injector.get(SessionEventEmitter)
+    event_emitter.start_round(round1.id)
+    post = code_generator.reply(memory, post_proxy=event_emitter.create_post_proxy("CodeInterpreter"))
+
+    assert post.get_attachment(AttachmentType.function)[0] == function_calls
+    # the plugin called is kept in the pool, though its name is not an identifier in the function calls
+    assert [p.name for p in code_generator.selected_plugin_pool.get_plugins()] == ["klarna_search"]
@@ -0,0 +1,122 @@
+import numpy as np
+
+from taskweaver.memory.embedding_index import EmbeddingIndex, IVFEmbeddingIndex, QueryEmbeddingCache
+
+
+def test_embedding_index():
+    index: EmbeddingIndex[str] = EmbeddingIndex()
+    assert index.search([1.0, 0.0]) == []
+
+    index.add_many(["a", "b", "c"], [[1.0, 0.0], [1.0, 1.0], [0.0, 2.0]])
+    assert [k for k, _ in index.search([1.0, 0.0])] == ["a", "b", "c"]
+    assert [k for k, _ in index.search([1.0, 0.0], top_k=2)] == ["a", "b"]
+    assert [k for k, _ in index.search([1.0, 0.0], threshold=0.5)] == ["a", "b"]
+    key, similarity = index.search([0.0, 3.0], top_k=1)[0]
+    assert key == "c" and abs(similarity - 1.0) < 1e-6
+
+    # replacing and removing update the index in place
+    index.add("a", [0.0, 1.0])
+    assert sorted(k for k, _ in index.search([0.0, 1.0], top_k=2)) == ["a", "c"]
+    assert index.remove("c")
+    assert not index.remove("c")
+    assert sorted(index.keys()) == ["a", "b"]
+    assert [k for k, _ in index.search([0.0, 1.0])] == ["a", "b"]
+
+
+def test_embedding_index_matches_exact_search():
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(200, 16))
+    index: EmbeddingIndex[int] = EmbeddingIndex()
+    for i, embedding in enumerate(embeddings):
+        index.add(i, embedding.tolist())
+    query = rng.normal(size=16)
+
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:10]
+    assert [k for k, _ in index.search(query.tolist(), top_k=10)] == expected.tolist()
+
+
+def clustered_embeddings(rng: np.random.Generator, size: int, dim: int = 16) -> np.ndarray:
+    centers = rng.normal(size=(20, dim))
+    return centers[rng.integers(0, len(centers), size)] + 0.3 * rng.normal(size=(size, dim))
+
+
+def test_ivf_embedding_index():
+    rng = np.random.default_rng(0)
+    embeddings = clustered_embeddings(rng, 2000)
+    exact: EmbeddingIndex[int] = EmbeddingIndex()
+    ivf: IVFEmbeddingIndex[int] = IVFEmbeddingIndex(nprobe=4, min_train_size=500)
+    exact.add_many(list(range(1000)), embeddings[:1000])
+    ivf.add_many(list(range(400)), embeddings[:400])
+    # the index searches exactly before it is trained
+    assert not ivf.is_trained
+    assert len(ivf.search(embeddings[0])) == 400
+    for i in range(400, 1000):
+        ivf.add(i, embeddings[i])
+    assert ivf.is_trained
+
+    queries = clustered_embeddings(rng, 50)
+    recall = np.mean(
+        [
+            len(set(k for k, _ in exact.search(q, top_k=10)) & set(k for k, _ in ivf.search(q, top_k=10))) / 10
+            for q in queries
+        ],
+    )
+    assert recall >= 0.9
+
+    # the removed embeddings are not found, and the moved ones are still found
+    for i in range(0, 1000, 2):
+        assert ivf.remove(i)
+    assert sorted(ivf.keys()) == list(range(1, 1000, 2))
+    for i in [1, 333, 999]:
+        assert ivf.search(embeddings[i], top_k=1)[0][0] == i
+
+    # the index is trained again when the number of embeddings doubles
+    ivf.add_many(list(range(1000, 2000)), embeddings[1000:])
+    assert len(ivf) == 1500
+    assert ivf.search(embeddings[1500], top_k=1)[0][0] == 1500
+
+
+def test_ivf_embedding_index_save_load(tmp_path):
+    rng = np.random.default_rng(1)
+    embeddings = clustered_embeddings(rng, 600)
+    keys = [f"exp-{i}" for i in range(600)]
+    path = str(tmp_path / "ivf_index.npz")
+
+    ivf: IVFEmbeddingIndex[str] = IVFEmbeddingIndex(nlist=10, nprobe=2, min_train_size=100)
+    ivf.add_many(keys, embeddings)
+    assert ivf.is_dirty
+    ivf.save(path, "model-a")
+    assert not ivf.is_dirty
+
+    # the saved clusters are reused for the saved keys
+    loaded: IVFEmbeddingIndex[str] = IVFEmbeddingIndex(nlist=10, nprobe=2, min_train_size=100)
+    assert loaded.load(path, "model-a")
+    loaded.add_many(keys, embeddings)
+    assert not loaded.is_dirty
+    query = embeddings[42]
+    assert loaded.search(query, top_k=5) == ivf.search(query, top_k=5)
+    loaded.add("exp-new", query)
+    assert loaded.is_dirty
+    assert {k for k, _ in loaded.search(query, top_k=2)} == {"exp-42", "exp-new"}
+
+    # the clusters of other embeddings are not loaded
+    assert not IVFEmbeddingIndex().load(path, "model-b")
+    assert not IVFEmbeddingIndex().load(str(tmp_path / "missing.npz"))
+
+
+def test_query_embedding_cache():
+    embedded = []
+
+    def embed(query: str):
+        embedded.append(query)
+        return [float(len(query))]
+
+    cache = QueryEmbeddingCache(embed)
+    assert cache.get("round-1", "query") == [5.0]
+    assert cache.get("round-1", "query") == [5.0]
+    assert cache.get("round-1", "other query") == [11.0]
+    assert embedded == ["query", "other query"]
+    # the embeddings are dropped in a new round
+    cache.get("round-2", "query")
+    assert embedded == ["query", "other query", "query"]
@@ -0,0 +1,74 @@
+import threading
+import time
+from typing import List
+
+import pytest
+from injector import Injector
+
+from taskweaver.config.config_mgt import AppConfigSource
+from taskweaver.llm.embedding_server import EmbeddingServer, MicroBatcher
+from taskweaver.llm.sentence_transformer import SentenceTransformerService
+
+
+def fake_encode(calls: List[List[str]]):
+    def encode(strings: List[str]) -> List[List[float]]:
+        calls.append(strings)
+        time.sleep(0.05)
+        return [[float(len(s)), 1.0] for s in strings]
+
+    return encode
+
+
+def test_micro_batcher():
+    calls: List[List[str]] = []
+    batcher = MicroBatcher(fake_encode(calls), batch_window=0.2, max_batch_size=64)
+
+    results: List = [None] * 4
+
+    def run(i: int):
+        results[i] = batcher.submit(["x" * i, "y" * (i + 10)])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert sorted(calls[0]) == sorted(s for i in range(4) for s in ["x" * i, "y" * (i + 10)])
+    for i in range(4):
+        assert results[i] == [[float(i), 1.0], [float(i + 10), 1.0]]
+
+    # a batch is cut at max_batch_size
+    calls.clear()
+    batcher = MicroBatcher(fake_encode(calls), batch_window=0.2, max_batch_size=2)
+    assert batcher.submit(["a", "b"]) == [[1.0, 1.0], [1.0, 1.0]]
+    assert len(calls) == 1
+    assert batcher.submit([]) == []
+
+
+def test_embedding_server():
+    calls: List[List[str]] = []
+    server = EmbeddingServer("all-mpnet-base-v2", fake_encode(calls), port=0, batch_window=0.01)
+    server.start()
+    try:
+        app_injector = Injector()
+        app_config = AppConfigSource(
+            config={
+                "llm.embedding_api_type": "sentence_transformers",
+                "llm.embedding_model": "all-mpnet-base-v2",
+                "llm.sentence_transformers.server_url": server.url,
+            },
+        )
+        app_injector.binder.bind(AppConfigSource, to=app_config)
+        service = app_injector.get(SentenceTransformerService)
+
+        assert service.get_embeddings(["abc", "de"]) == [[3.0, 1.0], [2.0, 1.0]]
+        assert calls == [["abc", "de"]]
+
+        # a client of another model is rejected
+        service.config.embedding_model = "all-MiniLM-L12-v2"
+        with pytest.raises(Exception, match="all-mpnet-base-v2"):
+            service.get_embeddings(["abc"])
+    finally:
+        server.shutdown()
@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+from taskweaver.memory.embedding_store import EmbeddingRecord, EmbeddingStore
+
+
+def test_embedding_store(tmp_path):
+    store_dir = os.path.join(tmp_path, "store")
+    assert not EmbeddingStore.exists(store_dir)
+    store = EmbeddingStore(store_dir)
+    assert len(store) == 0
+
+    store.put_many(
+        [
+            EmbeddingRecord("a", [1.0, 0.0], model="m", hash="h1", text="first 经验"),
+            EmbeddingRecord("b", [0.0, 1.0], model="m", hash="h2"),
+        ],
+    )
+    assert EmbeddingStore.exists(store_dir)
+
+    # a reopened store reads the embeddings from the memory-mapped matrix
+    reopened = EmbeddingStore(store_dir)
+    record = reopened.get("a")
+    assert record is not None
+    assert record.text == "first 经验"
+    assert record.model == "m" and record.hash == "h1"
+    assert isinstance(record.embedding, np.memmap)
+    assert reopened.get("b").text is None  # type: ignore
+    assert reopened.get_embeddings(["b", "a"]).tolist() == [[0.0, 1.0], [1.0, 0.0]]
+
+    reopened.update([EmbeddingRecord("a", [0.5, 0.5], model="m2", text="")], ["b"])
+    store = EmbeddingStore(store_dir)
+    assert store.keys() == ["a"]
+    assert store.get("a").text == ""  # type: ignore
+    assert store.get_embeddings(["a"]).tolist() == [[0.5, 0.5]]
+    # only the files of the latest version are kept
+    assert len(os.listdir(store_dir)) == 3
@@ -0,0 +1,95 @@
+import json
+import os
+
+import pytest
+
+from taskweaver.logging.event_log import (
+    SessionEventLog,
+    export_log_files,
+    get_event_log_writer,
+    load_conversation,
+    read_events,
+)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_event_log(tmp_path, compress: bool):
+    from taskweaver.memory import Attachment, Post, Round
+    from taskweaver.memory.attachment import AttachmentType
+
+    path = os.path.join(tmp_path, "events.jsonl.gz" if compress else "events.jsonl")
+    event_log = SessionEventLog(path, compress=compress)
+    event_log.log_session({"session_id": "session-1", "workspace": str(tmp_path)})
+
+    chat_round = Round.create(user_query="hello", id="round-1")
+    event_log.log_round(chat_round)
+    post = Post.create(message="hello", send_from="User", send_to="Planner")
+    chat_round.add_post(post)
+    event_log.log_post(chat_round.id, post)
+    reply = Post.create(
+        message="hi",
+        send_from="Planner",
+        send_to="User",
+        attachment_list=[Attachment.create(AttachmentType.plan, "1. say hi")],
+    )
+    chat_round.add_post(reply)
+    event_log.log_post(chat_round.id, reply)
+    event_log.log_file("planner_prompt_log_round-1_post-1.json", [{"role": "system", "content": "be nice"}])
+    chat_round.add_usage("Planner", "default", {"prompt_tokens": 3})
+    chat_round.change_round_state("finished")
+    event_log.log_round_state(chat_round)
+    event_log.close()
+    get_event_log_writer().flush()
+
+    assert [record["type"] for record in read_events(path)] == [
+        "session",
+        "round",
+        "post",
+        "post",
+        "attachment",
+        "file",
+        "round_state",
+    ]
+    conversation = load_conversation(path)
+    assert [r.to_dict() for r in conversation.rounds] == [chat_round.to_dict()]
+
+    output_dir = os.path.join(tmp_path, "logs")
+    export_log_files(path, output_dir)
+    assert sorted(os.listdir(output_dir)) == [
+        "planner_prompt_log_round-1_post-1.json",
+        "session-1.json",
+        "session-1_round-1.json",
+    ]
+    with open(os.path.join(output_dir, "session-1_round-1.json")) as f:
+        assert json.load(f) == chat_round.to_dict()
+
+
+def test_event_log_compressed_live(tmp_path):
+    import gzip
+    import zlib
+
+    # the compressed log of a live session is readable after each drain of the writer
+    path = os.path.join(tmp_path, "events.jsonl.gz")
+    event_log = SessionEventLog(path, compress=True)
+    event_log.log_session({"session_id": "session-1"})
+    get_event_log_writer().flush()
+    assert [record["type"] for record in read_events(path)] == ["session"]
+    event_log.log_file("prompt.json", {"content": "hello"})
+    get_event_log_writer().flush()
+    assert [record["type"] for record in read_events(path)] == ["session", "file"]
+    event_log.close()
+
+    # a log cut by a crash ends with an incomplete gzip member, whose complete lines are read
+    crashed_path = os.path.join(tmp_path, "crashed.jsonl.gz")
+    with open(crashed_path, "wb") as f:
+        f.write(gzip.compress(b'{"type": "session", "session_id": "session-1"}\n'))
+        compressor = zlib.compressobj(wbits=31)
+        f.write(compressor.compress(b'{"type": "file", "name": "a.json", "content": 1}\n{"type": "fi'))
+        f.write(compressor.flush(zlib.Z_SYNC_FLUSH))
+    assert [record["type"] for record in read_events(crashed_path)] == ["session", "file"]
+
+    # or with a gzip header cut by a crash
+    with open(crashed_path, "wb") as f:
+        f.write(gzip.compress(b'{"type": "session", "session_id": "session-1"}\n'))
+        f.write(b"\x1f\x8b\x08")
+    assert [record["type"] for record in read_events(crashed_path)] == ["session"]
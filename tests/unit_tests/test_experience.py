@@ -50,3 +50,152 @@ def test_experience_retrieval():
 
     assert len(experiences) == 1
     assert experiences[0][0].exp_id == "test-exp-1"
+
+
+def test_experience_index(monkeypatch: pytest.MonkeyPatch):
+    from taskweaver.memory.experience import Experience
+
+    app_injector = Injector([LoggingModule])
+    app_config = AppConfigSource(
+        config={
+            "llm.api_key": "test_key",
+            "experience.retrieve_threshold": 0.5,
+        },
+    )
+    app_injector.binder.bind(AppConfigSource, to=app_config)
+    experience_manager = app_injector.create_object(ExperienceGenerator)
+    monkeypatch.setattr(experience_manager.llm_api, "get_embedding", lambda query: [1.0, 0.0, 0.0])
+
+    assert experience_manager.retrieve_experience("query") == []
+    for exp_id, embedding in [("exp-1", [1.0, 0.0, 0.0]), ("exp-2", [1.0, 1.0, 0.0]), ("exp-3", [0.0, 0.0, 1.0])]:
+        experience_manager.add_experience(Experience(experience_text=exp_id, exp_id=exp_id, embedding=embedding))
+
+    assert [exp.exp_id for exp, _ in experience_manager.retrieve_experience("query")] == ["exp-1", "exp-2"]
+    assert [exp.exp_id for exp, _ in experience_manager.retrieve_experience("query", top_k=1)] == ["exp-1"]
+
+    experience_manager.remove_experience("exp-1")
+    assert [exp.exp_id for exp, _ in experience_manager.retrieve_experience("query")] == ["exp-2"]
+    assert [exp.exp_id for exp in experience_manager.experience_list] == ["exp-2", "exp-3"]
+
+
+def test_experience_binary_store(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    import shutil
+
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data/experience")
+    exp_dir = str(tmp_path)
+    shutil.copy(os.path.join(data_dir, "raw_exp_test-exp-1.yaml"), exp_dir)
+    shutil.copy(os.path.join(data_dir, "Planner_exp_test-exp-1.yaml"), exp_dir)
+
+    app_injector = Injector([LoggingModule])
+    app_config = AppConfigSource(
+        config={
+            "llm.api_key": "test_key",
+            "llm.embedding_api_type": "sentence_transformers",
+            "llm.embedding_model": "all-mpnet-base-v2",
+            "experience.experience_dir": exp_dir,
+            "experience.storage": "npy",
+            "experience.retrieve_threshold": 0.0,
+            "embedding_index.type": "ivf",
+            "embedding_index.ivf_min_train_size": 1,
+        },
+    )
+    app_injector.binder.bind(AppConfigSource, to=app_config)
+    experience_manager = app_injector.create_object(ExperienceGenerator)
+    monkeypatch.setattr(experience_manager.llm_api, "get_embedding", lambda query: [1.0] * 768)
+    monkeypatch.setattr(experience_manager.llm_api, "get_embedding_list", lambda texts: [[1.0] * 768 for _ in texts])
+    monkeypatch.setattr(experience_manager.llm_api, "chat_completion", lambda *args, **kwargs: {"content": "Hello!"})
+
+    # the experience in the yaml file is migrated, so it is not summarized again
+    experience_manager.migrate_experience(target_role="Planner")
+    experience_manager.refresh(target_role="Planner")
+    experience_manager.load_experience(target_role="Planner")
+    exp = experience_manager.experience_list[0]
+    assert exp.exp_id == "test-exp-1"
+    assert exp.experience_text != "Hello!"
+    assert len(exp.embedding) == 768
+
+    # a new raw experience is summarized into the store
+    shutil.copy(os.path.join(exp_dir, "raw_exp_test-exp-1.yaml"), os.path.join(exp_dir, "raw_exp_test-exp-2.yaml"))
+    experience_manager.refresh(target_role="Planner")
+    experience_manager.load_experience(target_role="Planner")
+    assert sorted(exp.exp_id for exp, _ in experience_manager.retrieve_experience("query")) == [
+        "test-exp-1",
+        "test-exp-2",
+    ]
+    assert experience_manager.experiences["test-exp-2"].experience_text == "Hello!"
+    # the clusters of the ivf index are saved next to the embedding store
+    assert os.path.exists(os.path.join(exp_dir, "embeddings", "Planner", "ivf_index.npz"))
+
+    experience_manager.delete_experience("test-exp-2", target_role="Planner")
+    assert [exp.exp_id for exp, _ in experience_manager.retrieve_experience("query")] == ["test-exp-1"]
+
+
+def test_experience_parallel_refresh(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    import shutil
+    import threading
+
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data/experience")
+    exp_dir = str(tmp_path)
+    for i in range(1, 5):
+        shutil.copy(os.path.join(data_dir, "raw_exp_test-exp-1.yaml"), os.path.join(exp_dir, f"raw_exp_exp-{i}.yaml"))
+
+    app_injector = Injector([LoggingModule])
+    app_config = AppConfigSource(
+        config={
+            "llm.api_key": "test_key",
+            "llm.embedding_api_type": "sentence_transformers",
+            "llm.embedding_model": "all-mpnet-base-v2",
+            "experience.experience_dir": exp_dir,
+            "experience.refresh_concurrency": 2,
+            "experience.refresh_retry_delay": 0.0,
+            "experience.refresh_batch_size": 2,
+        },
+    )
+    app_injector.binder.bind(AppConfigSource, to=app_config)
+    experience_manager = app_injector.create_object(ExperienceGenerator)
+
+    lock = threading.Lock()
+    summarized = []
+    embedded_batches = []
+
+    def summarize_experience(exp_id, prompt=None, target_role="All"):
+        with lock:
+            summarized.append(exp_id)
+            # exp-2 fails once and is retried, exp-4 fails until it is fixed
+            if exp_id == "exp-4" or (exp_id == "exp-2" and summarized.count("exp-2") == 1):
+                raise Exception("rate limited")
+        return f"summary of {exp_id}"
+
+    def get_embedding_list(texts):
+        embedded_batches.append(len(texts))
+        return [[1.0] * 768 for _ in texts]
+
+    monkeypatch.setattr(experience_manager, "summarize_experience", summarize_experience)
+    monkeypatch.setattr(experience_manager.llm_api, "get_embedding_list", get_embedding_list)
+
+    progress = []
+    with pytest.raises(ValueError, match="exp-4"):
+        experience_manager.refresh(target_role="Planner", progress=lambda done, total: progress.append((done, total)))
+    assert progress == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    assert summarized.count("exp-2") == 2
+    assert summarized.count("exp-4") == 3
+    assert sorted(embedded_batches) == [1, 2]
+    # the summarized experiences are saved, so that the next refresh resumes from the failed one
+    assert sorted(f for f in os.listdir(exp_dir) if f.startswith("Planner_exp_")) == [
+        "Planner_exp_exp-1.yaml",
+        "Planner_exp_exp-2.yaml",
+        "Planner_exp_exp-3.yaml",
+    ]
+
+    summarized.clear()
+    monkeypatch.setattr(experience_manager, "summarize_experience", lambda exp_id, *args: f"summary of {exp_id}")
+    experience_manager.refresh(target_role="Planner")
+    experience_manager.load_experience(target_role="Planner")
+    assert sorted(exp.exp_id for exp in experience_manager.experience_list) == ["exp-1", "exp-2", "exp-3", "exp-4"]
+
+    # only the experience whose raw experience changes is summarized again
+    embedded_batches.clear()
+    with open(os.path.join(exp_dir, "raw_exp_exp-1.yaml"), "a", encoding="utf-8") as f:
+        f.write("\n# edited\n")
+    experience_manager.refresh(target_role="Planner")
+    assert embedded_batches == [1]
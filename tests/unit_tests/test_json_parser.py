@@ -123,3 +123,27 @@ bad_cases: List[str] = [
 def test_json_parser_bad(bad_case: str):
     with pytest.raises(json_parser.StreamJsonParserError):
         json_parser.parse_json(bad_case)
+
+
+def test_json_parser_stream_chunks():
+    code = "\n".join(f"df_{i} = pd.read_csv('./data_{i}.csv')\t# \"step\" \\ {i} ሴ" for i in range(100))
+    obj = {"response": [{"type": "thought", "content": "load"}, {"type": "python", "content": code}]}
+    dumped_str = json.dumps(obj, indent=2)
+
+    for chunk_size in [1, 3, 7, 64, len(dumped_str)]:
+        chunks = [dumped_str[i : i + chunk_size] for i in range(0, len(dumped_str), chunk_size)]
+        events = list(json_parser.parse_json_stream(chunks + [" trailing"], skip_after_root=True))
+
+        # the events of a chunk are merged by type, the string runs split only at the chunk boundaries
+        assert len(events) < 3 * len(chunks) + 40
+        content_events = [ev for ev in events if ev.prefix == ".response[1].content" and ev.event == "string"]
+        assert "".join(ev.value_str for ev in content_events) == code
+        assert content_events[-1].is_end and content_events[-1].value == code
+        assert all(not ev.is_end for ev in content_events[:-1])
+        assert events[-1] == json_parser.ParserEvent("", "skip", None, "", True)
+
+        ijson_events = list(json_parser.parse_json_stream(chunks, skip_ws=True, ijson_prefix=True))
+        assert all(ev.event != "ws" for ev in ijson_events)
+        assert "response.item.content" in set(ev.prefix for ev in ijson_events)
+
+        assert json_parser.parse_json(chunks) == obj
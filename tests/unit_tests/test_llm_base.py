@@ -1,11 +1,12 @@
 import json
+from typing import Any, Generator
 
 import pytest
 from injector import Injector
 
 from taskweaver.config.config_mgt import AppConfigSource
 from taskweaver.llm import LLMApi, format_chat_message
-from taskweaver.llm.mock import LLMMockApiException
+from taskweaver.llm.mock import LLMMockApiException, MockApiService
 from taskweaver.llm.util import ChatMessageType
 
 
@@ -80,3 +81,31 @@ def test_llm_output_format(
         recv_msg += chunk["content"]
 
     assert recv_msg == chat_response["content"]
+
+
+def test_mock_record_early_stop(tmp_path):
+    app_injector = Injector()
+    app_injector.binder.bind(
+        AppConfigSource,
+        to=AppConfigSource(
+            config={
+                "llm.mock.mode": "playback_or_record",
+                "llm.mock.cache_path": str(tmp_path / "mock.yaml"),
+            },
+        ),
+    )
+    mock = app_injector.get(MockApiService)
+
+    class BaseService:
+        def chat_completion(self, *args: Any, **kwargs: Any) -> Generator[ChatMessageType, None, None]:
+            yield format_chat_message("assistant", "Hello")
+            yield format_chat_message("assistant", ", world!")
+
+    mock.set_base_completion_service(BaseService())  # type: ignore
+    messages = [format_chat_message("user", "Hi")]
+
+    # the part received before the consumer stops is recorded
+    stream = mock.chat_completion(messages)
+    assert next(stream)["content"] == "Hello"
+    stream.close()
+    assert mock.cache.get_completion(messages) == format_chat_message("assistant", "Hello")
@@ -0,0 +1,172 @@
+import queue
+import sys
+import threading
+import time
+import types
+from typing import Generator, List, Optional
+
+import pytest
+from injector import Injector
+
+from taskweaver.config.config_mgt import AppConfigSource
+from taskweaver.llm import LLMApi, format_chat_message
+from taskweaver.llm.cancellation import CancellationStats, CancellationToken, cancellable_stream, on_cancel
+from taskweaver.llm.util import ChatMessageType
+
+
+class FakeResponse:
+    """A streaming response whose reads block until a chunk is sent or the response is closed."""
+
+    def __init__(self):
+        self.chunks: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+        self.chunks.put(None)
+
+    def __iter__(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                if self.closed.is_set():
+                    raise ConnectionError("response closed")
+                return
+            yield chunk
+
+
+def fake_service(response: FakeResponse) -> Generator[ChatMessageType, None, None]:
+    on_cancel(response.close)
+    for chunk in response:
+        yield format_chat_message("assistant", chunk)
+
+
+def test_cancellable_stream():
+    stats = CancellationStats()
+    response = FakeResponse()
+    for chunk in ["a", "b", "c"]:
+        response.chunks.put(chunk)
+    response.chunks.put(None)
+    assert "".join(c["content"] for c in cancellable_stream(lambda: fake_service(response), stats=stats)) == "abc"
+    assert not response.closed.is_set()
+
+    # closing the stream early closes the response
+    response = FakeResponse()
+    response.chunks.put("a")
+    stream = cancellable_stream(lambda: fake_service(response), stats=stats)
+    assert next(stream)["content"] == "a"
+    stream.close()
+    assert response.closed.is_set()
+
+    # cancelling the token from another thread unblocks a pending read
+    response = FakeResponse()
+    token = CancellationToken()
+    received: List[str] = []
+
+    def consume():
+        for c in cancellable_stream(lambda: fake_service(response), token, stats):
+            received.append(c["content"])
+
+    thread = threading.Thread(target=consume)
+    thread.start()
+    response.chunks.put("x")
+    time.sleep(0.1)
+    token.cancel()
+    thread.join(timeout=1)
+    assert not thread.is_alive()
+    assert received == ["x"]
+
+    assert stats.get_stats() == {
+        "completed_streams": 1,
+        "completed_tokens": 3,
+        "cancelled_streams": 2,
+        "cancelled_tokens": 2,
+        "estimated_saved_tokens": 4,
+        "estimated_saved_seconds": pytest.approx(0.0, abs=0.01),
+    }
+
+
+@pytest.mark.app_config(
+    {
+        "llm.use_mock": True,
+        "llm.mock.mode": "fixed",
+    },
+)
+def test_smoother_cancellation(app_injector: Injector):
+    api = app_injector.get(LLMApi)
+    stats = CancellationStats()
+    response = FakeResponse()
+    response.chunks.put("Hello, ")
+
+    start_time = time.time()
+    stream = api._stream_smoother(lambda: fake_service(response), stats, len)
+    assert next(stream)["content"] != ""
+    stream.close()
+    # the response is closed right away, without waiting for the next chunk
+    assert response.closed.wait(timeout=0.5)
+    assert time.time() - start_time < 1
+    deadline = time.time() + 1
+    while stats.get_stats()["cancelled_streams"] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert stats.get_stats()["cancelled_streams"] == 1
+    assert stats.get_stats()["cancelled_tokens"] == len("Hello, ")
+
+
+class FakeGenAIResponse:
+    """A streaming response of google-generativeai, cancelled by its private iterator or closed."""
+
+    def __init__(self, response: FakeResponse, cancellable: bool):
+        self.response = response
+        self.usage_metadata = None
+        if cancellable:
+            self._iterator = types.SimpleNamespace(cancel=response.close)
+        else:
+            self.close = response.close
+
+    def __iter__(self):
+        for chunk in self.response:
+            yield types.SimpleNamespace(text=chunk)
+
+
+@pytest.mark.parametrize("cancellable", [True, False])
+def test_google_genai_cancellation(monkeypatch: pytest.MonkeyPatch, cancellable: bool):
+    response = FakeResponse()
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda api_key: None
+    genai.GenerativeModel = lambda **kwargs: types.SimpleNamespace(
+        generate_content=lambda messages, stream: FakeGenAIResponse(response, cancellable),
+    )
+    genai_types = types.ModuleType("google.generativeai.types")
+    genai_types.GenerateContentResponse = FakeGenAIResponse
+    google = types.ModuleType("google")
+    google.generativeai = genai
+    monkeypatch.setitem(sys.modules, "google", google)
+    monkeypatch.setitem(sys.modules, "google.generativeai", genai)
+    monkeypatch.setitem(sys.modules, "google.generativeai.types", genai_types)
+
+    from taskweaver.llm.google_genai import GoogleGenAIService
+
+    app_injector = Injector()
+    app_injector.binder.bind(
+        AppConfigSource,
+        to=AppConfigSource(config={"llm.api_type": "google_genai", "llm.api_key": "test_key"}),
+    )
+    service = app_injector.get(GoogleGenAIService)
+
+    token = CancellationToken()
+    received: List[str] = []
+
+    def consume():
+        messages = [format_chat_message("user", "hi")]
+        for c in cancellable_stream(lambda: service.chat_completion(messages), token):
+            received.append(c["content"])
+
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    response.chunks.put("x")
+    time.sleep(0.1)
+    token.cancel()
+    thread.join(timeout=1)
+    assert not thread.is_alive()
+    assert response.closed.is_set()
+    assert received == ["x"]
@@ -0,0 +1,150 @@
+import time
+from typing import Generator, List
+
+import pytest
+from injector import Injector
+
+from taskweaver.llm import LLMApi, format_chat_message
+from taskweaver.llm.hedging import HedgeBudget, LatencyTracker, LLMHedgingConfig, get_hedge_delay, hedged_stream
+from taskweaver.llm.util import ChatMessageType
+
+
+def slow_stream(name: str, first_chunk_delay: float, log: List[str]) -> Generator[ChatMessageType, None, None]:
+    try:
+        time.sleep(first_chunk_delay)
+        for chunk in [name, "-1", "-2"]:
+            yield format_chat_message("assistant", chunk)
+        log.append(f"{name} finished")
+    finally:
+        log.append(f"{name} closed")
+
+
+def wait_for(condition, timeout: float = 2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_hedged_stream():
+    log: List[str] = []
+    budget = HedgeBudget(ratio=1.0)
+    trackers = (LatencyTracker(), LatencyTracker())
+
+    # the slow primary request is hedged, and the secondary one wins
+    output = "".join(
+        c["content"]
+        for c in hedged_stream(
+            lambda: slow_stream("primary", 1.0, log),
+            lambda: slow_stream("secondary", 0.0, log),
+            delay=0.1,
+            budget=budget,
+            trackers=trackers,
+        )
+    )
+    assert output == "secondary-1-2"
+    assert len(trackers[0]) == 0 and len(trackers[1]) == 1
+    # the primary request is cancelled once its first chunk arrives
+    wait_for(lambda: "primary closed" in log)
+    assert "primary finished" not in log
+
+    # a fast primary request is not hedged
+    log.clear()
+    output = "".join(
+        c["content"]
+        for c in hedged_stream(
+            lambda: slow_stream("primary", 0.0, log),
+            lambda: slow_stream("secondary", 0.0, log),
+            delay=0.5,
+            budget=budget,
+            trackers=trackers,
+        )
+    )
+    assert output == "primary-1-2"
+    assert not any(entry.startswith("secondary") for entry in log)
+
+
+def test_hedge_budget():
+    budget = HedgeBudget(ratio=0.5)
+    log: List[str] = []
+
+    def run() -> str:
+        return "".join(
+            c["content"]
+            for c in hedged_stream(
+                lambda: slow_stream("primary", 0.3, log),
+                lambda: slow_stream("secondary", 0.0, log),
+                delay=0.05,
+                budget=budget,
+                trackers=(LatencyTracker(), LatencyTracker()),
+            )
+        )
+
+    # each request earns half a credit, so only every other request can be hedged
+    assert run() == "primary-1-2"
+    assert run() == "secondary-1-2"
+    assert run() == "primary-1-2"
+
+
+def test_hedged_stream_errors():
+    def failing_stream() -> Generator[ChatMessageType, None, None]:
+        raise ValueError("failed")
+        yield  # pragma: no cover
+
+    log: List[str] = []
+    # the error of the primary request is raised if it is not hedged
+    with pytest.raises(ValueError):
+        list(
+            hedged_stream(
+                failing_stream,
+                lambda: slow_stream("secondary", 0.0, log),
+                delay=1.0,
+                budget=HedgeBudget(ratio=1.0),
+                trackers=(LatencyTracker(), LatencyTracker()),
+            ),
+        )
+
+    # the secondary request is used if the hedged primary request fails
+    def slow_failing_stream() -> Generator[ChatMessageType, None, None]:
+        time.sleep(0.2)
+        raise ValueError("failed")
+        yield  # pragma: no cover
+
+    output = "".join(
+        c["content"]
+        for c in hedged_stream(
+            slow_failing_stream,
+            lambda: slow_stream("secondary", 0.3, log),
+            delay=0.05,
+            budget=HedgeBudget(ratio=1.0),
+            trackers=(LatencyTracker(), LatencyTracker()),
+        )
+    )
+    assert output == "secondary-1-2"
+
+
+@pytest.mark.app_config(
+    {
+        "llm.use_mock": True,
+        "llm.mock.mode": "fixed",
+        "llm.hedging.enabled": True,
+        "llm.hedging.min_samples": 2,
+        "llm.hedging.min_delay": 0.1,
+    },
+)
+def test_llm_api_hedging(app_injector: Injector):
+    config = app_injector.get(LLMHedgingConfig)
+    tracker = LatencyTracker()
+    assert get_hedge_delay(config, tracker) == config.initial_delay
+    tracker.record(0.5)
+    tracker.record(0.2)
+    assert get_hedge_delay(config, tracker) == 0.5
+
+    api = app_injector.get(LLMApi)
+    output = "".join(
+        c["content"]
+        for c in api.chat_completion_stream(
+            [format_chat_message("user", "Hi")],
+            use_smoother=False,
+        )
+    )
+    assert output == "Hello!"
@@ -0,0 +1,159 @@
+from typing import Any, Generator, List, Optional
+
+import pytest
+from injector import Injector
+
+from taskweaver.llm import LLMApi, format_chat_message
+from taskweaver.llm.base import CompletionService
+from taskweaver.llm.pool import CompletionServicePool
+from taskweaver.llm.resilience import CircuitBreaker, LLMServerError, ResilientCompletionService
+from taskweaver.llm.util import ChatMessageType
+
+
+class EndpointService(CompletionService):
+    def __init__(self, name: str, healthy: bool = True, typed_error: bool = True):
+        self.endpoint = name
+        self.healthy = healthy
+        self.typed_error = typed_error
+        self.call_count = 0
+
+    def chat_completion(
+        self,
+        messages: List[ChatMessageType],
+        stream: bool = True,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        top_p: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Generator[ChatMessageType, None, None]:
+        self.call_count += 1
+        if not self.healthy and self.typed_error:
+            raise LLMServerError(f"{self.endpoint} is down")
+        if not self.healthy:
+            raise Exception(f"Failed to get completion with error code 500: {self.endpoint} is down")
+        yield format_chat_message("assistant", self.endpoint)
+
+
+def complete(pool: CompletionService) -> str:
+    return "".join(c["content"] for c in pool.chat_completion([format_chat_message("user", "Hi")]))
+
+
+def test_weighted_round_robin():
+    service_a = EndpointService("test_weighted_round_robin_a")
+    service_b = EndpointService("test_weighted_round_robin_b")
+    pool = CompletionServicePool(
+        [
+            CompletionServicePool.create_member(service_a, weight=3),
+            CompletionServicePool.create_member(service_b, weight=1),
+        ],
+    )
+    outputs = [complete(pool) for _ in range(8)]
+    assert service_a.call_count == 6
+    assert service_b.call_count == 2
+    # smooth round-robin never sends a burst larger than the weight to one endpoint
+    assert outputs[:4].count("test_weighted_round_robin_b") == 1
+
+
+def test_failover_and_circuit_breaker():
+    service_a = EndpointService("test_failover_and_circuit_breaker_a", healthy=False)
+    service_b = EndpointService("test_failover_and_circuit_breaker_b")
+    backup = EndpointService("test_failover_and_circuit_breaker_backup")
+    pool = CompletionServicePool(
+        [
+            CompletionServicePool.create_member(service_a, failure_threshold=2, recovery_timeout=60),
+            CompletionServicePool.create_member(service_b),
+        ],
+        [CompletionServicePool.create_member(backup)],
+    )
+
+    for _ in range(4):
+        assert complete(pool) == "test_failover_and_circuit_breaker_b"
+    # the unhealthy endpoint is taken out of the pool after 2 consecutive failures
+    assert service_a.call_count == 2
+    assert pool.members[0].circuit_breaker.state == CircuitBreaker.OPEN
+    assert backup.call_count == 0
+
+    # the backup is used when no primary endpoint is available
+    service_b.healthy = False
+    assert complete(pool) == "test_failover_and_circuit_breaker_backup"
+
+    backup.healthy = False
+    with pytest.raises(LLMServerError):
+        complete(pool)
+
+
+def test_failover_untyped_error():
+    service = EndpointService("test_failover_untyped_error", healthy=False, typed_error=False)
+    backup = EndpointService("test_failover_untyped_error_backup")
+    pool = CompletionServicePool(
+        [CompletionServicePool.create_member(service, failure_threshold=2, recovery_timeout=60)],
+        [CompletionServicePool.create_member(backup)],
+    )
+
+    # an untyped error, as raised by the services on an HTTP 5xx, is a failure of the endpoint
+    for _ in range(5):
+        assert complete(pool) == "test_failover_untyped_error_backup"
+    assert service.call_count == 2
+    assert pool.members[0].circuit_breaker.state == CircuitBreaker.OPEN
+
+    backup.healthy = False
+    backup.typed_error = False
+    with pytest.raises(Exception, match="error code 500"):
+        complete(pool)
+
+
+def test_pool_consumer_stops_reading():
+    service = EndpointService("test_pool_consumer_stops_reading")
+    pool = CompletionServicePool([CompletionServicePool.create_member(service, failure_threshold=1)])
+    stream = pool.chat_completion([format_chat_message("user", "Hi")])
+    next(stream)
+    stream.close()
+    assert pool.members[0].circuit_breaker.state == CircuitBreaker.CLOSED
+    assert pool.members[0].outstanding == 0
+
+
+def test_circuit_breaker_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+    # only one trial request is let through
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.app_config(
+    {
+        "llm.api_type": "openai",
+        "llm.api_key": "test_key",
+        "llm.model": "gpt-4",
+        "llm.backup_model": "gpt-35-turbo",
+        "llm.pool.endpoints": [
+            {"llm.api_base": "https://east.example.com/v1", "weight": 2},
+            {"llm.api_base": "https://west.example.com/v1"},
+        ],
+        "ext_llms.llm_configs": {
+            "single": {"llm.model": "gpt-4o"},
+            "pooled": [{"llm.model": "gpt-4o"}, {"llm.model": "gpt-4o-mini"}],
+        },
+    },
+)
+def test_llm_api_pool(app_injector: Injector):
+    api = app_injector.get(LLMApi)
+
+    pool = api.completion_service
+    assert isinstance(pool, CompletionServicePool)
+    assert [m.weight for m in pool.members] == [2, 1]
+    assert [m.endpoint for m in pool.members] == [
+        "https://east.example.com/v1#gpt-4",
+        "https://west.example.com/v1#gpt-4",
+    ]
+    assert [m.endpoint for m in pool.fallback_members] == ["https://api.openai.com/v1#gpt-35-turbo"]
+
+    # the pool and backup model of the primary LLM are not inherited by the extra LLMs
+    assert isinstance(api.ext_llms["single"], ResilientCompletionService)
+    assert isinstance(api.ext_llms["pooled"], CompletionServicePool)
+    assert len(api.ext_llms["pooled"].members) == 2
+    assert len(api.ext_llms["pooled"].fallback_members) == 0
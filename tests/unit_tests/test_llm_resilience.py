@@ -0,0 +1,209 @@
+import json
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Generator, List, Optional
+
+import pytest
+from injector import Injector
+
+from taskweaver.config.config_mgt import AppConfigSource
+from taskweaver.llm import LLMApi, format_chat_message
+from taskweaver.llm.base import CompletionService
+from taskweaver.llm.resilience import (
+    LLMRateLimitError,
+    LLMResilienceConfig,
+    LLMServerError,
+    ResilientCompletionService,
+    TokenBucket,
+    get_rate_limiter,
+    observe_rate_limit_headers,
+    parse_duration,
+    parse_retry_after,
+)
+from taskweaver.llm.util import ChatMessageType
+
+
+class ThrottledService(CompletionService):
+    def __init__(self, throttle_times: int, fail_after_chunks: Optional[int] = None):
+        self.throttle_times = throttle_times
+        self.fail_after_chunks = fail_after_chunks
+        self.call_count = 0
+
+    def chat_completion(
+        self,
+        messages: List[ChatMessageType],
+        stream: bool = True,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        top_p: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Generator[ChatMessageType, None, None]:
+        self.call_count += 1
+        if self.call_count <= self.throttle_times:
+            raise LLMRateLimitError("throttled", retry_after=0.05)
+        for i, chunk in enumerate(["Hello", ", ", "world"]):
+            if self.fail_after_chunks is not None and i >= self.fail_after_chunks:
+                raise LLMRateLimitError("throttled in the middle of the stream", retry_after=0.05)
+            yield format_chat_message("assistant", chunk)
+
+
+@pytest.mark.app_config(
+    {
+        "llm.resilience.backoff_base": 0.01,
+        "llm.resilience.max_retries": 2,
+    },
+)
+def test_retry_on_rate_limit(app_injector: Injector, monkeypatch: pytest.MonkeyPatch):
+    sleeps: List[float] = []
+
+    def sleep(seconds: float):
+        sleeps.append(seconds)
+        real_sleep(seconds)
+
+    real_sleep = time.sleep
+    monkeypatch.setattr("taskweaver.llm.resilience.time.sleep", sleep)
+
+    config = app_injector.get(LLMResilienceConfig)
+
+    service = ThrottledService(throttle_times=2)
+    resilient = ResilientCompletionService(service, config, endpoint="test_retry_on_rate_limit")
+    output = "".join(c["content"] for c in resilient.chat_completion([format_chat_message("user", "Hi")]))
+    assert output == "Hello, world"
+    assert service.call_count == 3
+    # the backoff honours the Retry-After of the throttled responses
+    assert len(sleeps) == 2
+    assert all(s >= 0.05 for s in sleeps)
+
+    service = ThrottledService(throttle_times=3)
+    resilient = ResilientCompletionService(service, config, endpoint="test_retry_on_rate_limit_exhausted")
+    with pytest.raises(LLMRateLimitError):
+        for _ in resilient.chat_completion([format_chat_message("user", "Hi")]):
+            pass
+    assert service.call_count == 3
+
+
+@pytest.mark.app_config(
+    {
+        "llm.resilience.backoff_base": 0.01,
+    },
+)
+def test_no_retry_after_partial_output(app_injector: Injector, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr("taskweaver.llm.resilience.time.sleep", lambda s: None)
+
+    config = app_injector.get(LLMResilienceConfig)
+    service = ThrottledService(throttle_times=0, fail_after_chunks=1)
+    resilient = ResilientCompletionService(service, config, endpoint="test_no_retry_after_partial_output")
+
+    received: List[str] = []
+    with pytest.raises(LLMRateLimitError):
+        for chunk in resilient.chat_completion([format_chat_message("user", "Hi")]):
+            received.append(chunk["content"])
+    assert received == ["Hello"]
+    assert service.call_count == 1
+
+
+def test_token_bucket_tuned_by_headers():
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("1.5") == 1.5
+    assert parse_duration("abc") is None
+    assert parse_retry_after({"Retry-After": "2"}) == 2
+    assert parse_retry_after({"retry-after-ms": "1500"}) == 1.5
+    assert parse_retry_after({}) is None
+
+    bucket = TokenBucket()
+    assert bucket.acquire(timeout=0)
+
+    bucket.update(limit_per_minute=60, remaining=0, reset_after=10)
+    assert bucket.rate == 1.0
+    assert not bucket.acquire(timeout=0.01)
+
+    observe_rate_limit_headers(
+        "test_token_bucket_tuned_by_headers",
+        {
+            "x-ratelimit-limit-requests": "120",
+            "x-ratelimit-remaining-requests": "100",
+            "x-ratelimit-reset-requests": "1s",
+        },
+    )
+    limiter = get_rate_limiter("test_token_bucket_tuned_by_headers")
+    assert limiter.rate == 2.0
+    assert limiter.acquire(timeout=0)
+
+
+def test_rate_limiter_per_service_endpoint(app_injector: Injector):
+    config = app_injector.get(LLMResilienceConfig)
+    services = [ThrottledService(throttle_times=0), ThrottledService(throttle_times=0)]
+    services[0].config = types.SimpleNamespace(api_base="https://a.example.com", model="gpt")  # type: ignore
+    services[1].config = types.SimpleNamespace(api_base="https://b.example.com", model="gpt")  # type: ignore
+    first, second = (ResilientCompletionService(service, config) for service in services)
+
+    assert first.endpoint == "https://a.example.com#gpt"
+    assert first.rate_limiter is get_rate_limiter("https://a.example.com#gpt")
+    assert second.rate_limiter is get_rate_limiter("https://b.example.com#gpt")
+    assert first.rate_limiter is not second.rate_limiter
+
+    # a block learned from the responses of one endpoint does not block the other
+    first.rate_limiter.block_for(60)
+    assert not first.rate_limiter.acquire(timeout=0)
+    assert second.rate_limiter.acquire(timeout=0)
+
+
+@pytest.mark.app_config(
+    {
+        "llm.use_mock": True,
+        "llm.mock.mode": "fixed",
+    },
+)
+def test_llm_api_with_resilience(app_injector: Injector):
+    api = app_injector.get(LLMApi)
+    assert isinstance(api.completion_service.base_completion_service, ResilientCompletionService)
+    assert api.chat_completion([format_chat_message("user", "Hi")])["content"] == "Hello!"
+
+
+def test_openai_client_retries():
+    request_count = 0
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def do_POST(self):
+            nonlocal request_count
+            request_count += 1
+            self.rfile.read(int(self.headers["Content-Length"]))
+            body = json.dumps({"error": {"message": "internal error"}}).encode("utf-8")
+            self.send_response(500)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        app_injector = Injector()
+        app_config = AppConfigSource(
+            config={
+                "llm.api_type": "openai",
+                "llm.api_base": f"http://127.0.0.1:{server.server_address[1]}/v1",
+                "llm.api_key": "test_key",
+                "llm.model": "gpt-4",
+                "llm.resilience.max_retries": 2,
+                "llm.resilience.backoff_base": 0,
+                "llm.resilience.failure_threshold": 0,
+            },
+        )
+        app_injector.binder.bind(AppConfigSource, to=app_config)
+        api = app_injector.get(LLMApi)
+
+        # only the resilience layer retries, the client does not retry underneath it
+        with pytest.raises(LLMServerError):
+            api.chat_completion([format_chat_message("user", "Hi")])
+        assert request_count == 3
+    finally:
+        server.shutdown()
+        server.server_close()
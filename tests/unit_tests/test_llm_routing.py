@@ -0,0 +1,114 @@
+from typing import Generator
+
+import pytest
+from injector import Injector
+
+from taskweaver.llm import LLMApi, format_chat_message
+from taskweaver.llm.routing import AliasTracker, LLMRouter, RoutingPolicy, tracked_stream
+from taskweaver.llm.usage import usage_context
+from taskweaver.llm.util import ChatMessageType
+
+
+def make_policy(**kwargs) -> RoutingPolicy:
+    settings = dict(
+        enabled=True,
+        fast_alias="fast",
+        max_message_tokens=10,
+        max_prompt_tokens=100,
+        max_turns=2,
+        escalate_on_failure=True,
+        min_success_rate=0.9,
+        min_samples=3,
+    )
+    settings.update(kwargs)
+    return RoutingPolicy(**settings)  # type: ignore
+
+
+def test_router():
+    router = LLMRouter()
+    policy = make_policy()
+
+    def route(message_tokens=1, prompt_tokens=10, turn=0, previous_failed=False):
+        decision = router.route(policy, "", message_tokens, prompt_tokens, turn, previous_failed)
+        return decision.alias, decision.reason
+
+    assert route() == ("fast", "easy")
+    assert route(previous_failed=True) == ("", "previous_failed")
+    assert route(message_tokens=11) == ("", "long_message")
+    assert route(prompt_tokens=101) == ("", "long_prompt")
+    assert route(turn=3) == ("", "late_turn")
+
+    # the fast LLM is bypassed while it fails, or while it is slower than the requested LLM
+    for success in [True, False, False]:
+        router.get_tracker("fast").record(success, 0.1)
+    assert route() == ("", "fast_unhealthy")
+    for _ in range(30):
+        router.get_tracker("fast").record(True, 2.0)
+        router.get_tracker("").record(True, 1.0)
+    assert route() == ("", "fast_slower")
+
+    assert router.get_stats()["decisions"] == {
+        "fast": {"easy": 1},
+        "": {
+            "previous_failed": 1,
+            "long_message": 1,
+            "long_prompt": 1,
+            "late_turn": 1,
+            "fast_unhealthy": 1,
+            "fast_slower": 1,
+        },
+    }
+
+
+def test_tracked_stream():
+    tracker = AliasTracker()
+
+    def stream(fail: bool) -> Generator[ChatMessageType, None, None]:
+        yield format_chat_message("assistant", "a")
+        if fail:
+            raise Exception("failed")
+        yield format_chat_message("assistant", "b")
+
+    assert "".join(c["content"] for c in tracked_stream(lambda: stream(False), tracker)) == "ab"
+    with pytest.raises(Exception, match="failed"):
+        list(tracked_stream(lambda: stream(True), tracker))
+    # closing a stream early tells nothing about the LLM
+    early_closed = tracked_stream(lambda: stream(False), tracker)
+    next(early_closed)
+    early_closed.close()
+
+    stats = tracker.get_stats()
+    assert stats["samples"] == 2
+    assert stats["success_rate"] == 0.5
+
+
+@pytest.mark.app_config(
+    {
+        "llm.use_mock": True,
+        "llm.mock.mode": "fixed",
+        "llm.tokenizer.type": "estimate",
+        "ext_llms.llm_configs": {
+            "fast": {"llm.api_type": "openai", "llm.api_key": "key", "llm.model": "small"},
+        },
+        "llm.routing.fast_alias": "fast",
+        "llm.routing.roles": {"Planner": {"enabled": True}},
+    },
+)
+def test_routing_by_role(app_injector: Injector):
+    api = app_injector.get(LLMApi)
+    assert api.routing_enabled
+    short_messages = [format_chat_message("user", "hello")]
+    long_messages = [format_chat_message("user", "hello " * 300)]
+
+    with usage_context(role="Planner"):
+        assert api._route(short_messages, None) == "fast"
+        assert api._route(long_messages, None) == ""
+    with usage_context(role="Planner", previous_failed=True):
+        assert api._route(short_messages, None) == ""
+    # the routing is disabled for the other roles
+    with usage_context(role="CodeInterpreter"):
+        assert api._route(short_messages, None) is None
+
+    # the requests to the primary LLM are tracked
+    assert api.chat_completion(short_messages)["content"] == "Hello!"
+    assert api.get_routing_stats()["llm_aliases"][""]["samples"] >= 1
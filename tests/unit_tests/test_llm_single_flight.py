@@ -0,0 +1,110 @@
+import threading
+import time
+from typing import Generator, List
+
+import pytest
+from injector import Injector
+
+from taskweaver.llm import LLMApi, format_chat_message
+from taskweaver.llm.single_flight import SingleFlight, embedding_flights
+from taskweaver.llm.util import ChatMessageType
+
+
+def run_concurrently(target, count: int) -> List:
+    results: List = [None] * count
+
+    def run(i: int):
+        results[i] = target()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_single_flight_do():
+    flights = SingleFlight("test")
+    calls: List[int] = []
+
+    def embed() -> List[float]:
+        calls.append(1)
+        time.sleep(0.2)
+        return [1.0, 2.0]
+
+    results = run_concurrently(lambda: flights.do("key", embed), 5)
+    assert results == [[1.0, 2.0]] * 5
+    assert len(calls) == 1
+    assert flights.get_stats() == {"upstream_calls": 1, "coalesced_calls": 4, "cached_calls": 0, "saved_calls": 4}
+
+    # the flight ends with the upstream call, unless the recent results are kept
+    flights.do("key", embed)
+    assert len(calls) == 2
+    flights.do("key", embed, cache_size=1)
+    flights.do("key", embed, cache_size=1)
+    assert len(calls) == 3
+    assert flights.get_stats()["cached_calls"] == 1
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError("failed")
+
+    def call_failing():
+        with pytest.raises(ValueError):
+            flights.do("failing", fail)
+        return True
+
+    assert run_concurrently(call_failing, 3) == [True] * 3
+
+
+def test_single_flight_stream():
+    flights = SingleFlight("test")
+    calls: List[int] = []
+    closed: List[int] = []
+
+    def stream() -> Generator[ChatMessageType, None, None]:
+        calls.append(1)
+        try:
+            for i in range(5):
+                time.sleep(0.05)
+                yield format_chat_message("assistant", str(i))
+        finally:
+            closed.append(1)
+
+    results = run_concurrently(lambda: "".join(c["content"] for c in flights.stream("key", stream)), 4)
+    assert results == ["01234"] * 4
+    assert len(calls) == 1
+    assert flights.get_stats()["coalesced_calls"] == 3
+
+    # the upstream stream is closed once every caller stops reading
+    for chunk in flights.stream("key", stream):
+        break
+    deadline = time.time() + 2
+    while len(closed) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(closed) == 2
+    assert len(calls) == 2
+
+
+@pytest.mark.app_config(
+    {
+        "llm.use_mock": True,
+        "llm.mock.mode": "fixed",
+        "llm.single_flight.completion": True,
+    },
+)
+def test_llm_api_single_flight(app_injector: Injector):
+    api = app_injector.get(LLMApi)
+    assert api.chat_completion([format_chat_message("user", "Hi")])["content"] == "Hello!"
+    output = "".join(
+        c["content"] for c in api.chat_completion_stream([format_chat_message("user", "Hi")], use_smoother=False)
+    )
+    assert output == "Hello!"
+
+    before = embedding_flights.get_stats()
+    assert api.get_embedding("test_llm_api_single_flight") == api.get_embedding("test_llm_api_single_flight")
+    after = embedding_flights.get_stats()
+    assert after["upstream_calls"] == before["upstream_calls"] + 1
+    assert after["cached_calls"] == before["cached_calls"] + 1
+    assert "embedding" in api.get_single_flight_stats()
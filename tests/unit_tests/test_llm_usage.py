@@ -0,0 +1,77 @@
+from typing import Generator, List
+
+import pytest
+from injector import Injector
+
+from taskweaver.llm import LLMApi, format_chat_message
+from taskweaver.llm.usage import TokenUsage, get_usage_tracker, metered_stream, report_usage, usage_context
+from taskweaver.llm.util import ChatMessageType
+from taskweaver.memory import Round
+
+
+def fake_service(chunks: List[str], reported: bool) -> Generator[ChatMessageType, None, None]:
+    for chunk in chunks:
+        yield format_chat_message("assistant", chunk)
+    if reported:
+        report_usage(prompt_tokens=10, completion_tokens=len(chunks), cached_tokens=4)
+
+
+def test_metered_stream():
+    usages: List[TokenUsage] = []
+
+    def estimate(content: str) -> TokenUsage:
+        return TokenUsage(prompt_tokens=1, completion_tokens=len(content))
+
+    # the usage reported by the provider is used
+    stream = metered_stream(lambda: fake_service(["a", "b", "c"], True), usages.append, estimate)
+    assert "".join(c["content"] for c in stream) == "abc"
+    assert usages[-1] == TokenUsage(prompt_tokens=10, completion_tokens=3, cached_tokens=4, requests=1)
+
+    # the usage is estimated when it is not reported
+    stream = metered_stream(lambda: fake_service(["ab", "cd"], False), usages.append, estimate)
+    assert "".join(c["content"] for c in stream) == "abcd"
+    assert usages[-1] == TokenUsage(prompt_tokens=1, completion_tokens=4, requests=1, estimated_requests=1)
+
+    # a stream closed early is estimated from the content received
+    stream = metered_stream(lambda: fake_service(["ab", "cd"], True), usages.append, estimate)
+    assert next(stream)["content"] == "ab"
+    stream.close()
+    assert usages[-1] == TokenUsage(prompt_tokens=1, completion_tokens=2, requests=1, estimated_requests=1)
+    assert len(usages) == 3
+
+    # usage reported outside a metered stream is ignored
+    report_usage(prompt_tokens=1, completion_tokens=1)
+
+
+@pytest.mark.app_config(
+    {
+        "llm.use_mock": True,
+        "llm.mock.mode": "fixed",
+        "llm.tokenizer.type": "estimate",
+    },
+)
+def test_usage_accounting(app_injector: Injector):
+    api = app_injector.get(LLMApi)
+    chat_round = Round.create(user_query="hi")
+    messages = [format_chat_message("user", "hi")]
+    reply_tokens = api.get_tokenizer().count_tokens("Hello!")
+    before = get_usage_tracker("default").get_stats()["roles"].get("Planner", {}).get("completion_tokens", 0)
+
+    with usage_context(round=chat_round, role="Planner"):
+        assert api.chat_completion(messages)["content"] == "Hello!"
+        stream = api.chat_completion_stream(messages, use_smoother=False)
+    # the labels are captured when the stream is created
+    assert "".join(c["content"] for c in stream) == "Hello!"
+
+    usage = chat_round.usage["Planner"]["default"]
+    assert usage["requests"] == 2
+    assert usage["estimated_requests"] == 2
+    assert usage["completion_tokens"] == 2 * reply_tokens
+    assert usage["prompt_tokens"] > 0
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+
+    stats = api.get_usage_stats()["default"]
+    assert stats["roles"]["Planner"]["completion_tokens"] - before == 2 * reply_tokens
+
+    # the usage is persisted with the round
+    assert Round.from_dict(chat_round.to_dict()).usage == chat_round.usage
@@ -1,5 +1,11 @@
+import copy
+
+import pytest
+
+
 def test_memory_get_rounds():
     from taskweaver.memory import Memory, Post, Round
+    from taskweaver.memory.attachment import Attachment, AttachmentType
     from taskweaver.module.prompt_util import PromptUtil
 
     post1 = Post.create(
@@ -71,7 +77,90 @@ def test_memory_get_rounds():
     assert rounds[2].post_list[0].message == "what is the max value?"
     assert rounds[2].post_list[1].message == "The max value is 0.94"
 
-    # the rounds are deeply copied, so the original memory should not be changed
+    # the rounds are read-only views, whose deep copies can be modified without changing the original memory
+    with pytest.raises(AttributeError):
+        rounds[0].post_list[0].message = "create a dataframe 1"
+    rounds = copy.deepcopy(rounds)
     rounds[0].post_list[0].message = "create a dataframe 1"
+    rounds[0].post_list[0].attachment_list.append(Attachment.create(AttachmentType.text, "text"))
     assert rounds[0].post_list[0].message == "create a dataframe 1"
     assert memory.conversation.rounds[0].post_list[0].message == "create a dataframe"
+    assert memory.conversation.rounds[0].post_list[0].attachment_list == []
+
+
+def test_memory_get_rounds_incremental():
+    from taskweaver.memory import Memory, Post
+    from taskweaver.module.prompt_util import PromptUtil
+
+    def create_post(message: str, send_from: str, send_to: str) -> Post:
+        return Post.create(message=message, send_from=send_from, send_to=send_to)  # type: ignore
+
+    memory = Memory(session_id="session-1")
+    round1 = memory.create_round(user_query="hello")
+    round1.add_post(create_post("hello", "User", "Planner"))
+    round1.add_post(create_post("list files", "Planner", "CodeInterpreter"))
+    result = "files: " + PromptUtil.wrap_text_with_delimiter("a.csv", PromptUtil.DELIMITER_TEMPORAL)
+    round1.add_post(create_post(result, "CodeInterpreter", "Planner"))
+
+    rounds = memory.get_role_rounds(role="Planner")
+    assert [p.message for p in rounds[0].post_list] == ["hello", "list files", "files: a.csv"]
+    # the views are reused as long as the round does not change
+    assert memory.get_role_rounds(role="Planner")[0] is rounds[0]
+
+    round1.add_post(create_post("done", "Planner", "User"))
+    rounds = memory.get_role_rounds(role="Planner")
+    assert [p.message for p in rounds[0].post_list] == ["hello", "list files", "files: a.csv", "done"]
+    round1.change_round_state("finished")
+
+    # the temporal parts are removed once the round is not the last one
+    round2 = memory.create_round(user_query="again")
+    round2.add_post(create_post("again", "User", "Planner"))
+    rounds = memory.get_role_rounds(role="Planner")
+    assert [p.message for p in rounds[0].post_list] == ["hello", "list files", "files: ", "done"]
+    assert rounds[0].state == "finished"
+    assert [p.message for p in rounds[1].post_list] == ["again"]
+
+    # a failed round is skipped, so that the previous round is the last one again
+    round2.change_round_state("failed")
+    rounds = memory.get_role_rounds(role="Planner")
+    assert len(rounds) == 1
+    assert rounds[0].post_list[2].message == "files: a.csv"
+    assert len(memory.get_role_rounds(role="Planner", include_failure_rounds=True)) == 2
+    assert [p.message for p in memory.get_role_rounds(role="CodeInterpreter")[0].post_list] == [
+        "list files",
+        "files: a.csv",
+    ]
+
+
+def test_memory_compact_representation():
+    import json
+
+    from taskweaver.memory import Memory, Post, Round
+    from taskweaver.memory.attachment import Attachment, AttachmentType
+
+    post = Post.create("load the data", "Planner", "CodeInterpreter")
+    post.add_attachment(Attachment.create(AttachmentType.plan, "1. load the data"))
+    chat_round = Round.create(user_query="hello", id="round-1")
+    chat_round.add_post(post)
+    for obj in [post, post.attachment_list[0], chat_round]:
+        assert not hasattr(obj, "__dict__")
+
+    # the role names and the states of the loaded rounds are interned, and the format is unchanged
+    content = json.loads(json.dumps(chat_round.to_dict()))
+    loaded = Round.from_dict(content)
+    assert loaded.post_list[0].send_from is post.send_from
+    assert loaded.post_list[0].send_to is post.send_to
+    assert loaded.state is chat_round.state
+    assert loaded.to_dict().keys() == chat_round.to_dict().keys()
+    assert loaded.post_list[0].to_dict().keys() == post.to_dict().keys()
+    assert loaded.post_list[0].attachment_list[0].to_dict() == post.attachment_list[0].to_dict()
+
+    memory = Memory(session_id="session-1")
+    memory.conversation.add_round(chat_round)
+    last = memory.get_role_rounds(role="Planner")[0]
+    memory.create_round(user_query="next")
+    earlier = memory.get_role_rounds(role="Planner")[0]
+    # the two forms of a post share the views of its attachments
+    assert earlier.post_list[0].attachment_list is last.post_list[0].attachment_list
+    with pytest.raises(AttributeError):
+        earlier.post_list[0].attachment_list[0].content = "changed"  # type: ignore
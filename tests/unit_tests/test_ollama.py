@@ -0,0 +1,213 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+from injector import Injector
+
+from taskweaver.config.config_mgt import AppConfigSource
+from taskweaver.llm.ollama import OllamaService
+from taskweaver.llm.resilience import LLMServerError
+
+
+class StubOllamaServer:
+    """A local server answering like Ollama, or like an older Ollama without `/api/chat` and `/api/embed`."""
+
+    def __init__(self, legacy: bool = False):
+        self.legacy = legacy
+        self.requests: List[Tuple[str, Dict[str, Any]]] = []
+        # the probe of /api/chat waits for this event, as the loading of a model does
+        self.model_loaded = threading.Event()
+        self.model_loaded.set()
+        # the status of the completions, or an error reported in the stream if it is 200
+        self.completion_status: Optional[int] = None
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append((self.path, body))
+                if stub.legacy and self.path in ["/api/chat", "/api/embed"]:
+                    self._send(404, b"404 page not found", "text/plain")
+                elif self.path == "/api/embed":
+                    self._send_json({"embeddings": [[float(len(s)), 0.0] for s in body["input"]]})
+                elif self.path == "/api/embeddings":
+                    self._send_json({"embedding": [float(len(body["prompt"])), 0.0]})
+                elif self.path == "/api/chat" and len(body["messages"]) == 0:
+                    stub.model_loaded.wait(10)
+                    self._send_json({"model": body["model"], "done": True, "done_reason": "load"})
+                else:
+                    self._send_completion(body)
+
+            def _send_completion(self, body: Dict[str, Any]):
+                if stub.completion_status == 200:
+                    self._send_json({"error": "model runner has unexpectedly stopped"})
+                    return
+                if stub.completion_status is not None:
+                    self._send(
+                        stub.completion_status, json.dumps({"error": "failed"}).encode("utf-8"), "application/json"
+                    )
+                    return
+                pieces = ["Hello", ", ", "world"]
+                usage = {"prompt_eval_count": 7, "eval_count": 3}
+                if self.path == "/api/chat":
+                    objs = [{"message": {"role": "assistant", "content": p}, "done": False} for p in pieces]
+                    final = {"message": {"role": "assistant", "content": ""}, "done": True, **usage}
+                    whole = {"message": {"role": "assistant", "content": "".join(pieces)}, "done": True, **usage}
+                else:
+                    objs = [{"response": p, "done": False} for p in pieces]
+                    final = {"response": "", "done": True, **usage}
+                    whole = {"response": "".join(pieces), "done": True, **usage}
+                if not body["stream"]:
+                    self._send_json(whole)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                for obj in objs + [final]:
+                    self.wfile.write((json.dumps(obj) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+
+            def _send_json(self, obj: Any):
+                self._send(200, json.dumps(obj).encode("utf-8"), "application/json")
+
+            def _send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def paths(self) -> List[str]:
+        return [path for path, _ in self.requests]
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def create_service(url: str, **config: Any) -> OllamaService:
+    app_injector = Injector()
+    app_config = AppConfigSource(
+        config={
+            "llm.api_type": "ollama",
+            "llm.api_base": url,
+            "llm.model": "llama3",
+            "llm.embedding_model": "nomic-embed-text",
+            "llm.response_format": "text",
+            **config,
+        },
+    )
+    app_injector.binder.bind(AppConfigSource, to=app_config)
+    return app_injector.get(OllamaService)
+
+
+@pytest.fixture()
+def stub_server():
+    server = StubOllamaServer()
+    yield server
+    server.shutdown()
+
+
+def test_ollama_completion(stub_server: StubOllamaServer):
+    service = create_service(stub_server.url)
+    messages = [{"role": "user", "content": "hi"}]
+
+    chunks = list(service.chat_completion(messages, stream=True, temperature=0, max_tokens=10))
+    assert "".join(c["content"] for c in chunks) == "Hello, world"
+    # the support of /api/chat is probed once
+    assert stub_server.paths() == ["/api/chat", "/api/chat"]
+    body = stub_server.requests[-1][1]
+    assert body["keep_alive"] == "30m"
+    assert body["options"] == {"temperature": 0, "num_predict": 10}
+
+    # a non-streamed completion is exactly one request
+    stub_server.requests.clear()
+    chunks = list(service.chat_completion(messages, stream=False))
+    assert [c["content"] for c in chunks] == ["Hello, world"]
+    assert stub_server.paths() == ["/api/chat"]
+
+
+def test_ollama_legacy_server():
+    server = StubOllamaServer(legacy=True)
+    try:
+        service = create_service(server.url, **{"llm.ollama.keep_alive": "-1"})
+        messages = [{"role": "system", "content": "be brief"}, {"role": "user", "content": "hi"}]
+
+        assert "".join(c["content"] for c in service.chat_completion(messages)) == "Hello, world"
+        assert "".join(c["content"] for c in service.chat_completion(messages)) == "Hello, world"
+        assert server.paths() == ["/api/chat", "/api/generate", "/api/generate"]
+        body = server.requests[-1][1]
+        assert body["system"] == "be brief"
+        assert body["keep_alive"] == -1
+
+        server.requests.clear()
+        assert service.get_embeddings(["a", "bb"]) == [[1.0, 0.0], [2.0, 0.0]]
+        assert server.paths() == ["/api/embed", "/api/embeddings", "/api/embeddings"]
+    finally:
+        server.shutdown()
+
+
+def test_ollama_batch_embedding(stub_server: StubOllamaServer):
+    service = create_service(stub_server.url, **{"llm.ollama.embedding_batch_size": 2})
+
+    assert service.get_embeddings(["a", "bb", "ccc"]) == [[1.0, 0.0], [2.0, 0.0], [3.0, 0.0]]
+    assert stub_server.paths() == ["/api/embed", "/api/embed", "/api/embed"]
+    assert [body["input"] for _, body in stub_server.requests] == [[], ["a", "bb"], ["ccc"]]
+
+
+def test_ollama_probe_out_of_lock(stub_server: StubOllamaServer):
+    service = create_service(stub_server.url)
+    stub_server.model_loaded.clear()
+    completions: List[str] = []
+    completion_thread = threading.Thread(
+        target=lambda: completions.extend(
+            c["content"] for c in service.chat_completion([{"role": "user", "content": "hi"}])
+        ),
+    )
+    completion_thread.start()
+    while stub_server.paths() != ["/api/chat"]:
+        threading.Event().wait(0.01)
+
+    # the embeddings are not blocked by the probe of /api/chat waiting for the model to be loaded
+    embeddings: List[List[float]] = []
+    embedding_thread = threading.Thread(target=lambda: embeddings.extend(service.get_embeddings(["a"])))
+    embedding_thread.start()
+    embedding_thread.join(5)
+    assert not embedding_thread.is_alive()
+    assert embeddings == [[1.0, 0.0]]
+    assert completion_thread.is_alive()
+
+    stub_server.model_loaded.set()
+    completion_thread.join(5)
+    assert "".join(completions) == "Hello, world"
+    assert stub_server.paths() == ["/api/chat", "/api/embed", "/api/embed", "/api/chat"]
+
+
+def test_ollama_server_error(stub_server: StubOllamaServer):
+    service = create_service(stub_server.url)
+    messages = [{"role": "user", "content": "hi"}]
+
+    # the server errors are retryable, also when reported in the stream
+    for status in [500, 503]:
+        stub_server.completion_status = status
+        for stream in [True, False]:
+            with pytest.raises(LLMServerError, match=f"error code {status}"):
+                list(service.chat_completion(messages, stream=stream))
+    stub_server.completion_status = 200
+    with pytest.raises(LLMServerError, match="model runner has unexpectedly stopped"):
+        list(service.chat_completion(messages, stream=True))
+
+    # the client errors are not
+    stub_server.completion_status = 400
+    with pytest.raises(Exception, match="error code 400") as exc_info:
+        list(service.chat_completion(messages))
+    assert not isinstance(exc_info.value, LLMServerError)
@@ -173,6 +173,22 @@ def test_compose_example_for_prompt():
     assert messages[-1]["role"] == "user"
     assert messages[-1]["content"] == "User: Let's start the new conversation!\nhello"
 
+    round2 = Round.create(user_query="bye", id="round-2")
+    round2.add_post(
+        Post.create(
+            message="bye",
+            send_from="User",
+            send_to="Planner",
+            attachment_list=[],
+        ),
+    )
+    memory.conversation.add_round(round2)
+
+    new_messages = planner.compose_prompt(rounds=memory.conversation.rounds)
+    # the system instruction and the examples are a stable prefix, and the examples are only rendered once
+    assert new_messages[: len(messages) - 1] == messages[:-1]
+    assert new_messages[1] is messages[1]
+
 
 def test_skip_planning():
     from taskweaver.memory import Memory, Post, Round
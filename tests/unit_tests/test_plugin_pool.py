@@ -1,8 +1,13 @@
+import json
 import os
 
 from injector import Injector
 
-from taskweaver.code_interpreter.code_generator.plugin_selection import SelectedPluginPool
+from taskweaver.code_interpreter.code_generator.plugin_selection import (
+    SelectedPluginPool,
+    get_code_identifiers,
+    get_function_call_names,
+)
 from taskweaver.config.config_mgt import AppConfigSource
 from taskweaver.logging import LoggingModule
 from taskweaver.memory.plugin import PluginModule, PluginRegistry
@@ -54,3 +59,32 @@ def test_plugin_pool():
 
     selected_plugin_pool.filter_unused_plugins("")
     assert len(selected_plugin_pool) == 2
+
+
+def test_code_identifiers():
+    code = (
+        "%pip install pandas\n"
+        "import pandas as pd\n"
+        "df = pd.read_csv('anomaly_detection.csv')\n"
+        "# paper_summary is not needed\n"
+        "result = sql_pull_data(df.query)\n"
+    )
+    identifiers = get_code_identifiers(code)
+    assert {"pd", "df", "read_csv", "sql_pull_data", "query", "result"} <= identifiers
+    # the names in strings and comments are not used
+    assert "anomaly_detection" not in identifiers
+    assert "paper_summary" not in identifiers
+    # the words of the code which cannot be parsed
+    assert get_code_identifiers("xcxcxc anomaly_detection() ababab") == {"xcxcxc", "anomaly_detection", "ababab"}
+
+
+def test_function_call_names():
+    function_calls = json.dumps(
+        [
+            {"name": "anomaly_detection", "arguments": {"flag": True}},
+            {"name": "sql_pull_data", "arguments": {"query": "paper_summary"}},
+        ],
+    )
+    assert get_function_call_names(function_calls) == {"anomaly_detection", "sql_pull_data"}
+    assert get_function_call_names(json.dumps({"name": "klarna_search", "arguments": {}})) == {"klarna_search"}
+    assert get_function_call_names("klarna_search(") == {"klarna_search"}
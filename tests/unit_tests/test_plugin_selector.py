@@ -37,3 +37,55 @@ def test_plugin_selector():
     selected_plugins = plugin_selector.plugin_select(query2, top_k=3)
 
     assert any([p.name == "paper_summary" for p in selected_plugins])
+
+
+def test_plugin_embedding_store(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    import shutil
+
+    plugin_dir = os.path.join(tmp_path, "plugins")
+    shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data/plugins"), plugin_dir)
+    app_injector = Injector([PluginModule])
+    app_config = AppConfigSource(
+        config={
+            "plugin.base_path": plugin_dir,
+            "plugin.embedding_storage": "npy",
+            "llm.embedding_api_type": "sentence_transformers",
+            "llm.embedding_model": "all-mpnet-base-v2",
+            "llm.api_key": "test_key",
+        },
+    )
+    app_injector.binder.bind(AppConfigSource, to=app_config)
+    plugin_selector = app_injector.get(PluginSelector)
+    embedded = []
+
+    def get_embedding_list(texts):
+        embedded.extend(texts)
+        return [[float(i == len(embedded) - len(texts) + j) for i in range(8)] for j in range(len(texts))]
+
+    monkeypatch.setattr(plugin_selector.llm_api, "get_embedding_list", get_embedding_list)
+
+    # the meta files are not parsed, and their embeddings are migrated to the store
+    assert all(len(p.meta_data.embedding) == 0 for p in plugin_selector.available_plugins)  # type: ignore
+    plugin_selector.migrate_embeddings()
+    assert len(plugin_selector.embedding_store) == len(plugin_selector.available_plugins)  # type: ignore
+
+    shutil.rmtree(os.path.join(plugin_dir, ".meta", "embeddings"))
+    plugin_selector = app_injector.get(PluginSelector)
+    monkeypatch.setattr(plugin_selector.llm_api, "get_embedding_list", get_embedding_list)
+    plugin_selector.refresh()
+    assert len(embedded) == len(plugin_selector.available_plugins)
+    plugin_selector.refresh()
+    assert len(embedded) == len(plugin_selector.available_plugins)
+    plugin_selector.load_plugin_embeddings()
+    assert len(plugin_selector.plugin_embedding_dict) == len(plugin_selector.available_plugins)
+
+    # the plugins most similar to the query are selected from the index
+    name = plugin_selector.available_plugins[1].name
+    monkeypatch.setattr(
+        plugin_selector.llm_api, "get_embedding", lambda query: plugin_selector.plugin_embedding_dict[name]
+    )
+    assert [p.name for p in plugin_selector.plugin_select("query", top_k=1)] == [name]
+    query_embedding = plugin_selector.plugin_embedding_dict[plugin_selector.available_plugins[2].name]
+    assert plugin_selector.plugin_select("query", top_k=1, query_embedding=query_embedding) == [
+        plugin_selector.available_plugins[2],
+    ]
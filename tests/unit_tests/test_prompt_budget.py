@@ -0,0 +1,113 @@
+from typing import List
+
+from taskweaver.llm.tokenizer import EstimatedTokenizer, get_tokenizer
+from taskweaver.llm.util import ChatMessageType, format_chat_message
+from taskweaver.memory import Attachment, Post, Round
+from taskweaver.memory.attachment import AttachmentType
+from taskweaver.module.prompt_budget import PromptBudget
+
+
+def test_estimated_tokenizer():
+    tokenizer = EstimatedTokenizer()
+    assert tokenizer.count_tokens("") == 0
+    assert tokenizer.count_tokens("Hello, world!") == 6
+    assert tokenizer.count_tokens("internationalization") == 5
+    assert tokenizer.count_tokens("你好") == 2
+
+    text = " ".join(["word"] * 100)
+    truncated = tokenizer.truncate(text, 20)
+    assert "[truncated]" in truncated
+    assert truncated.startswith("word")
+    assert tokenizer.count_tokens(truncated) < 30
+
+    assert isinstance(get_tokenizer("gpt-4", "estimate"), EstimatedTokenizer)
+    assert get_tokenizer("gpt-4", "auto").count_tokens("Hello, world!") > 0
+
+
+def create_round(index: int, result: str) -> Round:
+    rnd = Round.create(user_query=f"query {index}")
+    rnd.add_post(Post.create(f"run step {index}", "Planner", "CodeInterpreter"))
+    post = Post.create(f"result of step {index}: {result}", "CodeInterpreter", "Planner")
+    post.add_attachment(Attachment.create(AttachmentType.execution_result, result))
+    rnd.add_post(post)
+    return rnd
+
+
+def compose(rounds: List[Round]) -> List[ChatMessageType]:
+    conversation: List[ChatMessageType] = []
+    for rnd in rounds:
+        for post in rnd.post_list:
+            result = "".join(post.get_attachment(AttachmentType.execution_result))
+            conversation.append(format_chat_message("user", f"{post.message}\n{result}"))
+    return conversation
+
+
+def test_prompt_budget():
+    tokenizer = EstimatedTokenizer()
+    system = [format_chat_message("system", "You are a helpful assistant.")]
+    examples = [
+        [format_chat_message("user", "example one " * 20)],
+        [format_chat_message("user", "example two " * 20)],
+    ]
+    rounds = [create_round(i, "short result") for i in range(5)]
+
+    # without a budget the prompt is complete
+    budget = PromptBudget(tokenizer, token_budget=0)
+    prompt = budget.build(system, examples, rounds, compose)
+    assert len(prompt) == 1 + 2 + 10
+    assert budget.stats["total_tokens"] == tokenizer.count_message_tokens(prompt)
+    assert budget.stats["dropped_rounds"] == 0
+
+    # the oldest rounds are dropped first
+    full_tokens = budget.stats["total_tokens"]
+    budget = PromptBudget(tokenizer, token_budget=full_tokens - 20)
+    prompt = budget.build(system, examples, rounds, compose)
+    assert budget.stats["dropped_rounds"] > 0
+    assert budget.stats["dropped_examples"] == 0
+    assert budget.stats["total_tokens"] <= full_tokens - 20
+    assert prompt[-1]["content"].startswith("result of step 4")
+
+    # then the examples, and the verbose execution results in the remaining rounds
+    rounds = [create_round(0, "short result"), create_round(1, "row " * 2000)]
+    budget = PromptBudget(tokenizer, token_budget=300)
+    prompt = budget.build(system, examples, rounds, compose)
+    assert budget.stats["dropped_rounds"] == 1
+    assert budget.stats["dropped_examples"] == 2
+    assert budget.stats["truncated_results"] == 2
+    assert budget.stats["total_tokens"] <= 300
+    assert "[truncated]" in prompt[-1]["content"]
+    # the rounds passed in are not modified
+    assert "[truncated]" not in rounds[1].post_list[1].message
+
+
+def test_prompt_budget_drop_rounds():
+    tokenizer = EstimatedTokenizer()
+    system = [format_chat_message("system", "You are a helpful assistant.")]
+    rounds = [create_round(i, "result " * (i % 7 + 1)) for i in range(50)]
+    composed_rounds = 0
+
+    def compose_with_head(_rounds: List[Round]) -> List[ChatMessageType]:
+        # the head goes with the first round, as the summary and the plugins of the roles do
+        nonlocal composed_rounds
+        composed_rounds += len(_rounds)
+        conversation = compose(_rounds)
+        if len(conversation) > 0:
+            conversation[0] = format_chat_message("user", "conversation head " * 10 + conversation[0]["content"])
+        return conversation
+
+    full_tokens = tokenizer.count_message_tokens(system + compose_with_head(rounds))
+    for token_budget in range(full_tokens - 1000, full_tokens, 97):
+        # the same rounds are dropped as when dropping them one by one
+        expected = next(
+            dropped
+            for dropped in range(len(rounds))
+            if tokenizer.count_message_tokens(system + compose_with_head(rounds[dropped:])) <= token_budget
+        )
+        budget = PromptBudget(tokenizer, token_budget=token_budget)
+        composed_rounds = 0
+        prompt = budget.build(system, [], rounds, compose_with_head)
+        # each dropped round is composed a few times, rather than the whole conversation for each of them
+        assert composed_rounds <= 2 * len(rounds) + 3 * expected + 2
+        assert budget.stats["dropped_rounds"] == expected
+        assert prompt == system + compose_with_head(rounds[expected:])
+        assert budget.stats["total_tokens"] <= token_budget
@@ -27,3 +27,30 @@ def test_handle_delimiter():
     unmatched_text = "This is a test sentence. {{DELIMITER_START_TEMPORAL}}This is a temporal part."
     assert PromptUtil.remove_all_delimiters(unmatched_text) == "This is a test sentence. This is a temporal part."
     assert PromptUtil.remove_parts(unmatched_text, delimiter) == unmatched_text
+
+
+def test_prompt_cache():
+    from taskweaver.module.prompt_util import PromptCache
+
+    cache = PromptCache(max_size=2)
+    calls = []
+
+    def render(name: str):
+        calls.append(name)
+        return name.upper()
+
+    plugins_a = [object(), object()]
+    plugins_b = [object()]
+    assert cache.get_or_create("plugins", plugins_a, lambda: render("a")) == "A"
+    assert cache.get_or_create("plugins", list(plugins_a), lambda: render("a")) == "A"
+    assert calls == ["a"]
+
+    # the key depends on the name, and on the objects and their order
+    assert cache.get_or_create("examples", plugins_a, lambda: render("e")) == "E"
+    assert cache.get_or_create("plugins", plugins_a[::-1], lambda: render("r")) == "R"
+    assert calls == ["a", "e", "r"]
+
+    # the least recently used entry is evicted
+    assert cache.get_or_create("plugins", plugins_b, lambda: render("b")) == "B"
+    assert cache.get_or_create("plugins", plugins_a, lambda: render("a")) == "A"
+    assert calls == ["a", "e", "r", "b", "a"]
@@ -1,8 +1,12 @@
+import threading
+from typing import List
+
 from injector import Injector
 
 from taskweaver.config.config_mgt import AppConfigSource
 from taskweaver.logging import LoggingModule
 from taskweaver.memory import RoundCompressor
+from taskweaver.module.event_emitter import SessionEventEmitter
 
 
 def test_round_compressor():
@@ -16,6 +20,7 @@ def test_round_compressor():
             "llm.api_key": "test_key",
             "round_compressor.rounds_to_compress": 2,
             "round_compressor.rounds_to_retain": 2,
+            "round_compressor.background": False,
         },
     )
     app_injector.binder.bind(AppConfigSource, to=app_config)
@@ -77,3 +82,68 @@ def test_round_compressor():
     )
     assert summary == "None"
     assert len(retained) == 4
+
+
+def test_round_compressor_background():
+    from taskweaver.memory import Post, Round
+
+    app_injector = Injector(
+        [LoggingModule],
+    )
+    app_config = AppConfigSource(
+        config={
+            "llm.api_key": "test_key",
+            "llm.use_mock": True,
+            "llm.mock.mode": "fixed",
+            "round_compressor.rounds_to_compress": 2,
+            "round_compressor.rounds_to_retain": 2,
+        },
+    )
+    app_injector.binder.bind(AppConfigSource, to=app_config)
+    emitter = SessionEventEmitter()
+    app_injector.binder.bind(SessionEventEmitter, emitter)
+    compressor = app_injector.get(RoundCompressor)
+
+    rounds: List[Round] = []
+    for i in range(4):
+        chat_round = Round.create(user_query="hello", id=f"round-{i}")
+        chat_round.add_post(Post.create(message="hello", send_from="User", send_to="Planner"))
+        rounds.append(chat_round)
+
+    released = threading.Event()
+
+    def formatter(_rounds: List[Round]) -> str:
+        released.wait(timeout=10)
+        return "hello"
+
+    # the compression does not block the caller, which keeps all the rounds until the summary is published
+    summary, retained = compressor.compress_rounds(rounds, formatter)
+    assert summary == "None"
+    assert len(retained) == 4
+    released.set()
+    compressor.wait(timeout=10)
+    assert compressor.previous_summary == "Hello!"
+    assert compressor.processed_rounds == {"round-0", "round-1"}
+
+    summary, retained = compressor.compress_rounds(rounds, formatter)
+    assert summary == "Hello!"
+    assert [r.id for r in retained] == ["round-2", "round-3"]
+
+    # the compression is triggered when a round ends
+    for i in range(4, 6):
+        rounds.append(Round.create(user_query="hello", id=f"round-{i}"))
+    emitter.start_round("round-5")
+    emitter.end_round("round-5")
+    compressor.wait(timeout=10)
+    assert compressor.processed_rounds == {"round-0", "round-1", "round-2", "round-3"}
+
+    # and cancelled when the session stops
+    released.clear()
+    for i in range(6, 8):
+        rounds.append(Round.create(user_query="hello", id=f"round-{i}"))
+    emitter.start_round("round-7")
+    emitter.end_round("round-7")
+    emitter.end_session()
+    released.set()
+    compressor.wait(timeout=10)
+    assert compressor.processed_rounds == {"round-0", "round-1", "round-2", "round-3"}
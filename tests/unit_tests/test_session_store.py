@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from typing import List
+
+import pytest
+
+from taskweaver.app.app import TaskWeaverApp
+from taskweaver.session.session import Session
+
+
+def create_app(app_dir: str, store_type: str) -> TaskWeaverApp:
+    return TaskWeaverApp(
+        app_dir=app_dir,
+        config={
+            "llm.api_key": "test_key",
+            "llm.use_mock": True,
+            "llm.mock.mode": "fixed",
+            "session_manager.store_type": store_type,
+            "session_manager.store_path": os.path.join(app_dir, "session_store"),
+        },
+    )
+
+
+@pytest.mark.parametrize("store_type", ["file_system", "sqlite"])
+def test_durable_session_store(tmp_path, store_type: str):
+    app_dir = str(tmp_path)
+    app = create_app(app_dir, store_type)
+    session = app.get_session()
+    session.update_session_var({"user": "alice"})
+    app.session_manager.update_session(session)
+    chat_round = session.send_message("hello")
+    # the round is saved when it ends
+    assert [r.id for r in session.memory.conversation.rounds] == [chat_round.id]
+
+    # another app sharing the store hydrates the session
+    other_app = create_app(app_dir, store_type)
+    store = other_app.session_manager.session_store
+    assert list(store.get_active_session_ids()) == []
+    assert list(store.get_all_session_ids()) == [session.session_id]
+    hydrated = other_app.get_session(session.session_id)
+    assert hydrated is not session
+    assert hydrated.session_var == {"user": "alice"}
+    assert hydrated.round_index == session.round_index
+    assert [r.to_dict()["id"] for r in hydrated.memory.conversation.rounds] == [chat_round.id]
+    assert hydrated.memory.conversation.rounds[0].post_list[0].message == chat_round.post_list[0].message
+    assert not hydrated.code_executor.client_started
+
+    # the hydrated session saves its new rounds, and a stopped session is released from memory only
+    hydrated.send_message("hello again")
+    other_app.stop_session(session.session_id)
+    assert list(store.get_active_session_ids()) == []
+    assert len(create_app(app_dir, store_type).get_session(session.session_id).memory.conversation.rounds) == 2
+
+    store.remove_session(session.session_id)
+    assert not store.has_session(session.session_id)
+    with pytest.raises(Exception, match="session id not found"):
+        other_app.get_session(session.session_id)
+
+
+def test_sqlite_session_store_save_round_atomic(tmp_path, monkeypatch):
+    app_dir = str(tmp_path)
+    app = create_app(app_dir, "sqlite")
+    session = app.get_session()
+    store = app.session_manager.session_store
+    round_index = session.round_index
+
+    def fail_save_metadata(session_id: str, metadata: str):
+        raise RuntimeError("disk full")
+
+    # the round is not saved without the metadata
+    monkeypatch.setattr(store, "_save_metadata", fail_save_metadata)
+    chat_round = session.memory.create_round(user_query="hello")
+    with pytest.raises(RuntimeError, match="disk full"):
+        store.save_round(session, chat_round.id)
+    monkeypatch.undo()
+    assert store._load_session(session.session_id)[1] == []
+
+    store.save_round(session, chat_round.id)
+    metadata, round_list = store._load_session(session.session_id)
+    assert metadata["round_index"] == round_index
+    assert [r["id"] for r in round_list] == [chat_round.id]
+
+
+@pytest.mark.parametrize("store_type", ["file_system", "sqlite"])
+def test_durable_session_store_concurrent_hydration(tmp_path, store_type: str):
+    app_dir = str(tmp_path)
+    session = create_app(app_dir, store_type).get_session()
+    session.send_message("hello")
+    other_session = create_app(app_dir, store_type).get_session()
+
+    store = create_app(app_dir, store_type).session_manager.session_store
+    create_object = store.injector.create_object
+    created_sessions: List[Session] = []
+    other_hydrated = []
+
+    def create_session(cls, *args, **kwargs):
+        if cls is Session and args[0]["session_id"] == session.session_id:
+            # another session is hydrated while this one is built, as the store lock is not held meanwhile
+            thread = threading.Thread(target=lambda: other_hydrated.append(store.get_session(other_session.session_id)))
+            thread.start()
+            thread.join(10)
+            assert not thread.is_alive()
+            time.sleep(0.1)
+        obj = create_object(cls, *args, **kwargs)
+        if cls is Session:
+            created_sessions.append(obj)
+        return obj
+
+    store.injector.create_object = create_session
+    hydrated = []
+    threads = [
+        threading.Thread(target=lambda: hydrated.append(store.get_session(session.session_id))) for _ in range(2)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # the session is built only once, which appends one record to the event log of the session
+    assert len(hydrated) == 2
+    assert hydrated[0] is hydrated[1]
+    assert [s.session_id for s in created_sessions] == [other_session.session_id, session.session_id]
+    assert other_hydrated[0].session_id == other_session.session_id
+    assert sorted(store.get_active_session_ids()) == sorted([session.session_id, other_session.session_id])
+    assert store._hydrations == {}
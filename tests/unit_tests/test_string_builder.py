@@ -0,0 +1,20 @@
+from taskweaver.utils import StringBuilder
+
+
+def test_string_builder():
+    builder = StringBuilder("ab")
+    for chunk in ["cde", "", "f", "ghij"]:
+        builder.append(chunk)
+    value = "abcdefghij"
+    assert len(builder) == len(value)
+    for start in range(len(value) + 1):
+        for end in range(start, len(value) + 2):
+            assert builder.substring(start, end) == value[start:end]
+    assert builder.substring(3) == value[3:]
+
+    assert str(builder) == value
+    assert str(builder) is str(builder)
+    builder.append("kl")
+    assert str(builder) == value + "kl"
+    assert builder.substring(8, 11) == "ijk"
+    assert str(StringBuilder()) == ""
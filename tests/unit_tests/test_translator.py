@@ -1,3 +1,4 @@
+import json
 from random import randint
 from typing import Iterator
 
@@ -10,6 +11,8 @@ from taskweaver.memory import Attachment, Post
 from taskweaver.memory.attachment import AttachmentType
 from taskweaver.module.event_emitter import SessionEventEmitter
 from taskweaver.role import PostTranslator
+from taskweaver.role.translator import PostRenderCache
+from taskweaver.utils import StringBuilder
 
 response_str1 = (
     '{"response": [{"type": "thought", "content": "This is the thought"}, {"type": "python", '
@@ -144,3 +147,60 @@ def test_post_to_raw_text():
         if_format_send_to=True,
     )
     assert prompt == response_str1
+
+
+def test_raw_text_to_post_stream():
+    code = "\n".join(f"print('line {i}')" for i in range(500))
+    llm_output = json.dumps(
+        {"response": [{"type": "thought", "content": "think"}, {"type": "python", "content": code}]}
+    )
+    chunks = [format_chat_message("assistant", llm_output[i : i + 3]) for i in range(0, len(llm_output), 3)]
+
+    event_emitter = SessionEventEmitter()
+    event_emitter.start_round("test_round")
+    post_proxy = event_emitter.create_post_proxy("CodeInterpreter")
+    llm_output_builder = StringBuilder()
+    translator.raw_text_to_post(llm_output=chunks, post_proxy=post_proxy, llm_output_builder=llm_output_builder)
+    assert str(llm_output_builder) == llm_output
+    assert post_proxy.streaming_attachment is None
+    response = post_proxy.end()
+    assert [a.content for a in response.attachment_list] == ["think", code]
+
+    # the content of an attachment whose stream is interrupted is set with the content received
+    truncated = llm_output.index("line 100")
+    post_proxy = event_emitter.create_post_proxy("CodeInterpreter")
+    translator.raw_text_to_post(
+        llm_output=[format_chat_message("assistant", llm_output[:truncated])],
+        post_proxy=post_proxy,
+    )
+    response = post_proxy.end()
+    assert response.attachment_list[1].content == code[: code.index("line 100")]
+
+
+def test_post_to_raw_text_cache():
+    post = Post.create(message="This is the message", send_from="CodeInterpreter", send_to="Planner")
+    post.add_attachment(Attachment.create(type="python", content="print('This is the code')"))
+    cache = translator.render_cache
+    cache_size = len(cache)
+
+    prompt = translator.post_to_raw_text(post=post)
+    assert translator.post_to_raw_text(post=post) is prompt
+    assert translator.post_to_raw_text(post=post, if_format_message=False) != prompt
+    assert len(cache) == cache_size + 2
+
+    # a mutated post is rendered again
+    post.attachment_list[0].content = "print('This is the new code')"
+    assert "new code" in translator.post_to_raw_text(post=post)
+    post.add_attachment(Attachment.create(type="text", content="This is the text"))
+    assert "This is the text" in translator.post_to_raw_text(post=post)
+    post.message = "This is the new message"
+    assert "new message" in translator.post_to_raw_text(post=post)
+    assert len(cache) == cache_size + 2
+
+    rendered = []
+    small_cache = PostRenderCache(max_size=2)
+    posts = [Post.create(message=str(i), send_from="Planner", send_to="User") for i in range(3)]
+    for p in posts + posts[2:]:
+        small_cache.get(p, "message", lambda: rendered.append(p.message) or p.message)
+    assert rendered == ["0", "1", "2"]
+    assert len(small_cache) == 2